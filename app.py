@@ -1,42 +1,126 @@
+import hmac
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
-from tools import get_quiz_data
-from models import db, connect_db, User, Quiz, QuizQuestion, Question
-from forms import CreateQuizForm, AddQuestionToQuiz, EditQuestion, AddQuestion, NewUserForm, LogInForm, ChangeUsernameForm, ChangePasswordForm
+from flask import Blueprint, Flask, Response, render_template, request, flash, redirect, session, g, jsonify, abort, current_app, make_response
+from tools import get_rounds_data, connect_jservice, QuestionFetchError
+from jobs import enqueue_quiz_job, run_job_now, start_workers
+from migrations import connect_migrations
+from models import db, connect_db, configure_password_hashing, User, Quiz, QuizQuestion, Question, QuizJob
+from forms import CreateQuizForm, AddQuestionToQuiz, EditQuestion, AddQuestion, ImportQuestions, NewUserForm, LogInForm, ChangeUsernameForm, ChangePasswordForm
+from config import CONFIGS
+from export import FORMATS, export_response, library_rows, quiz_rows
+from fragment_cache import FragmentCache, make_backend
+from import_questions import import_questions
+from http_cache import static_url, page_etag, set_validators, not_modified, pending_flashes
+import metrics
+from pagination import keyset_page
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
+from user_cache import UserCache, CurrentUser
+from markupsafe import Markup
+from werkzeug.local import LocalProxy
 import re
 
 CURR_USER_KEY = "curr_user"
 
-app = Flask(__name__)
-uri = (os.environ.get('DATABASE_URL', 'postgresql:///trivia'))
-if uri.startswith("postgres://"):
-    uri = uri.replace("postgres://", "postgresql://", 1)
-app.config['SQLALCHEMY_DATABASE_URI'] = uri
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
+views = Blueprint("views", __name__)
 
-connect_db(app)
-db.create_all()
+#Logged in users are cached per process - see user_cache.py
+user_cache = UserCache()
+#Rendered quiz question lists - see fragment_cache.py
+fragment_cache = FragmentCache()
 
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'shh')
+def create_app(config=None):
+    """Make the app.
 
-debug = DebugToolbarExtension(app)
+    config is a config class (see config.py) - by default the one named by
+    FLASK_ENV, or ProductionConfig. Nothing here touches the database: the
+    engine connects on first use, and the schema is managed by migrations.py -
+    run `flask db upgrade` after deploying.
+    """
+
+    if config is None:
+        config = CONFIGS.get(os.environ.get('FLASK_ENV'), CONFIGS["production"])
+
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    connect_db(app)
+    metrics.connect_metrics(app)
+    connect_migrations(app)
+    connect_jservice(app)
+    configure_password_hashing(app)
+    user_cache.configure(app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TTL'])
+    fragment_cache.configure(make_backend(app))
+
+    if app.config['DEBUG_TB_ENABLED']:
+        #Only imported when it's wanted - production never loads it
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    app.register_blueprint(views)
+    app.jinja_env.globals["static_url"] = static_url
+
+    return app
 
 ######################################################
 #Login/Logout routes
 ######################################################
-@app.before_request
+def load_current_user(user_id):
+    """Look up the fields of the logged in user that the views need"""
+
+    user = db.session.query(User.id, User.username).filter(User.id == user_id).first()
+    return CurrentUser(user.id, user.username) if user else None
+
+
+def get_current_user():
+    """The logged in user (or None) - looked up the first time a view asks for it"""
+
+    if "current_user" not in g:
+        if CURR_USER_KEY in session:
+            g.current_user = user_cache.get(session[CURR_USER_KEY], load_current_user)
+        else:
+            g.current_user = None
+
+    return g.current_user
+
+
+@views.before_app_request
+def start_request_metrics():
+    """Start timing the request, and counting its SQL - see metrics.py"""
+
+    metrics.start_request()
+
+
+@views.after_app_request
+def record_request_metrics(resp):
+    """Record the request's metrics and send them back as a Server-Timing header"""
+
+    return metrics.finish_request(resp, request.endpoint or "unmatched", request.method)
+
+
+@views.teardown_app_request
+def end_request_metrics(exc):
+    metrics.end_request()
+
+
+@views.before_app_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    g.user is a proxy, so views that never look at it don't cost a lookup,
+    and the lookup itself usually comes from the user cache.
+    """
 
-    else:
-        g.user = None
+    g.user = LocalProxy(get_current_user)
+
+
+@views.before_app_first_request
+def start_quiz_job_workers():
+    """Start the background quiz generation workers"""
+
+    if not current_app.config['QUIZ_JOBS_EAGER']:
+        start_workers(current_app._get_current_object())
 
 
 def do_login(user):
@@ -52,7 +136,18 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+def quizzes_changed(quiz_ids):
+    """Drop the cached question lists of quizzes whose questions have changed.
+
+    They'd never be served again anyway, as they're for an old revision, but
+    this frees the space straight away.
+    """
+
+    for quiz_id in quiz_ids:
+        fragment_cache.invalidate(f"quiz-{quiz_id}")
+
+
+@views.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup."""
 
@@ -78,7 +173,7 @@ def signup():
         return render_template('signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@views.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
@@ -89,6 +184,8 @@ def login():
                                  form.password.data)
 
         if user:
+            #Save the password's hash in case authenticate upgraded it
+            db.session.commit()
             do_login(user)
             return redirect("/")
 
@@ -97,7 +194,7 @@ def login():
     return render_template('login.html', form=form)
 
 
-@app.route('/logout')
+@views.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -105,7 +202,7 @@ def logout():
     flash("You have been successfully logged out. Goodbye!", "success")
     return redirect("/login")
 
-@app.route('/deleteprofile')
+@views.route('/deleteprofile')
 def delete_profile_page():
     """Show delete profile page - contains warnings"""
 
@@ -115,7 +212,7 @@ def delete_profile_page():
 
     return render_template("delete_profile.html")
     
-@app.route('/delete', methods=["POST"])
+@views.route('/delete', methods=["POST"])
 def delete_user():
     """Delete user."""
 
@@ -123,10 +220,12 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    user_id = g.user.id
     do_logout()
 
-    db.session.delete(g.user)
+    db.session.delete(User.query.get_or_404(user_id))
     db.session.commit()
+    user_cache.invalidate(user_id)
 
     return redirect("/signup")
 
@@ -135,7 +234,7 @@ def delete_user():
 #Quiz routes
 ######################################################
 
-@app.route("/quizzes/create", methods=["GET", "POST"])
+@views.route("/quizzes/create", methods=["GET", "POST"])
 def create_quiz():
     """Create a new quiz"""
 
@@ -149,49 +248,64 @@ def create_quiz():
 
     if form.validate_on_submit():
         #Get form data
-        user_id = user.id
-        name = form.name.data
-        description = form.description.data
-        rounds = form.rounds.data
-        qs_per_round = form.qs_per_round.data
-        difficulty_levels = [form.round_one_diff.data, 
-                             form.round_two_diff.data,
-                             form.round_three_diff.data,
-                             form.round_four_diff.data,
-                             form.round_five_diff.data]
-        
-        #Create new quiz and add to db
-        quiz = Quiz(name=name,
-                    description=description,
-                    rounds=rounds,
-                    user_id=user_id)
-        db.session.add(quiz)
-        db.session.commit()
-        db.session.refresh(quiz)
-        quiz_id = quiz.id
+        params = {"name": form.name.data,
+                  "description": form.description.data,
+                  "rounds": form.rounds.data,
+                  "qs_per_round": form.qs_per_round.data,
+                  "difficulty_levels": [form.round_one_diff.data, 
+                                        form.round_two_diff.data,
+                                        form.round_three_diff.data,
+                                        form.round_four_diff.data,
+                                        form.round_five_diff.data]}
+
+        #Hand the actual work off to a background worker and let the user watch its progress
+        job = enqueue_quiz_job(user.id, params)
+        if current_app.config['QUIZ_JOBS_EAGER']:
+            run_job_now(current_app._get_current_object(), job)
+
+        return redirect(f"/quizzes/jobs/{job.id}")
 
-        #Get questions and add to db
-        for round_no in range(1, quiz.rounds + 1):
-            quiz_data = get_quiz_data(difficulty_levels[round_no - 1], qs_per_round, user_id)
-            db.session.add_all(quiz_data)
-            db.session.commit()
-            
-            #Create associations between quiz and questions
-            for quiz_datum in quiz_data:
-                db.session.refresh(quiz_datum)
-                quiz_question = QuizQuestion(quiz_id=quiz_id,
-                                             question_id=quiz_datum.id,
-                                             round=round_no)
-                db.session.add(quiz_question)
-            db.session.commit()
+    else:
+        return render_template("create_quiz.html", form=form)
 
+@views.route("/quizzes/jobs/<int:job_id>")
+def show_quiz_job(job_id):
+    """Show the progress of a quiz being generated - or the quiz, once it's ready"""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    job = QuizJob.query.get_or_404(job_id)
+    if job.user_id != g.user.id:
+        abort(404)
+
+    if job.status == "done":
         flash("Quiz successfully created!", "success")
-        return redirect(f"/quizzes/show/{quiz_id}")
+        return redirect(f"/quizzes/show/{job.quiz_id}")
 
-    else:
-        return render_template("create_quiz.html", form=form)
+    return render_template("quiz_job.html", job=job)
+
+@views.route("/quizzes/jobs/<int:job_id>/status")
+def quiz_job_status(job_id):
+    """JSON status of a quiz being generated - polled by the progress page"""
+
+    if not g.user:
+        return jsonify(error="Access unauthorized."), 401
 
-@app.route("/quizzes/show")
+    job = db.session.query(QuizJob.id, QuizJob.user_id, QuizJob.status, QuizJob.attempts,
+                           QuizJob.error, QuizJob.timings, QuizJob.quiz_id).filter(QuizJob.id == job_id).first()
+    if job is None or job.user_id != g.user.id:
+        return jsonify(error="Not found."), 404
+
+    return jsonify(id=job.id,
+                   status=job.status,
+                   attempts=job.attempts,
+                   error=job.error,
+                   timings=job.timings,
+                   quiz_id=job.quiz_id)
+
+@views.route("/quizzes/show")
 def show_quizzes():
     """Show all quizzes"""
     if not g.user:
@@ -201,11 +315,19 @@ def show_quizzes():
     user = g.user
     user_id = user.id
 
-    quizzes = Quiz.query.filter(Quiz.user_id == user_id).order_by(Quiz.id).all()
+    page = keyset_page(Quiz.query.filter(Quiz.user_id == user_id), Quiz.id,
+                       after=request.args.get("after", type=int),
+                       before=request.args.get("before", type=int),
+                       per_page=current_app.config['PAGE_SIZE'])
 
-    return render_template("show_all_quizzes.html",quizzes=quizzes)
+    #Count the questions in each quiz on the page in one query, rather than loading them all
+    question_counts = dict(db.session.query(QuizQuestion.quiz_id, func.count(QuizQuestion.question_id))
+                           .filter(QuizQuestion.quiz_id.in_([quiz.id for quiz in page.items]))
+                           .group_by(QuizQuestion.quiz_id))
 
-@app.route("/quizzes/show/<int:quiz_id>")
+    return render_template("show_all_quizzes.html",quizzes=page.items, page=page, question_counts=question_counts)
+
+@views.route("/quizzes/show/<int:quiz_id>")
 def show_quiz(quiz_id):
     """Show the quiz with the given id"""
 
@@ -214,17 +336,43 @@ def show_quiz(quiz_id):
         return redirect("/")
 
     quiz = Quiz.query.get_or_404(quiz_id)
-    quiz_questions = []
-    for round_no in range(1, quiz.rounds + 1):
-        round = []
-        for quiz_question in quiz.questions:
-            if quiz_question.round == round_no:
-                round.append(quiz_question.question)
-        quiz_questions.append(round)
 
-    return render_template("show_quiz.html", quiz_questions=quiz_questions, quiz=quiz)
+    #If the browser's copy is up to date, don't even load the questions
+    etag = page_etag("quiz", quiz.id, quiz.revision)
+    resp = not_modified(etag, quiz.updated_at)
+    if resp:
+        return resp
+
+    #Checked before rendering, which takes the messages out of the session
+    flashed = pending_flashes()
+
+    #The question list only needs loading and rendering when the quiz has changed since it was last shown
+    rounds_html = fragment_cache.get_or_render(f"quiz-{quiz.id}", etag,
+                                               lambda: render_template("quiz_rounds.html", quiz_questions=quiz.questions_by_round()))
+
+    resp = make_response(render_template("show_quiz.html", rounds_html=Markup(rounds_html), quiz=quiz))
+    #A copy with the messages in mustn't be kept under the quiz's ETag, or they'd be shown again on every visit
+    #after - without validators it gets the same never-cached headers as any other page
+    if flashed:
+        return resp
+    return set_validators(resp, etag, quiz.updated_at)
+
+@views.route("/quizzes/export/<int:quiz_id>.<fmt>")
+def export_quiz(quiz_id, fmt):
+    """Download the quiz as CSV or NDJSON, or show it as a printable answer sheet"""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if fmt not in FORMATS:
+        abort(404)
+
+    quiz = Quiz.query.get_or_404(quiz_id)
+
+    return export_response(fmt, quiz.name, lambda: quiz_rows(quiz_id), with_round=True)
 
-@app.route("/quizzes/edit/<int:quiz_id>", methods=["GET", "POST"])
+@views.route("/quizzes/edit/<int:quiz_id>", methods=["GET", "POST"])
 def edit_quiz(quiz_id):
     """Edit the quiz with the given id"""
     
@@ -233,92 +381,82 @@ def edit_quiz(quiz_id):
         return redirect("/")
 
     if request.method == 'POST':
-        q_ids = request.form.getlist("checked_questions")
+        q_ids = {int(q_id) for q_id in request.form.getlist("checked_questions")}
         quiz = Quiz.query.get_or_404(quiz_id)
-        replacement_question_ids =[]
 
-        for q_id in q_ids:
-            q_to_replace = Question.query.get_or_404(int(q_id))
+        #Find where every selected question sits in the quiz, and its difficulty, in one go
+        to_replace = (db.session.query(QuizQuestion.question_id, QuizQuestion.round, Question.difficulty)
+                      .join(Question, Question.id == QuizQuestion.question_id)
+                      .filter(QuizQuestion.quiz_id == quiz_id, QuizQuestion.question_id.in_(q_ids))
+                      .all())
+        if len(to_replace) != len(q_ids):
+            abort(404)
+
+        #Get replacement questions - they'll have the same difficulty and round as the old ones.
+        #Grouping by difficulty means at most one fetch per difficulty level
+        rounds_by_difficulty = {}
+        for quiz_question in to_replace:
+            rounds_by_difficulty.setdefault(quiz_question.difficulty, []).append(quiz_question.round)
+        difficulties = list(rounds_by_difficulty)
 
-            for quiz_question in q_to_replace.quizzes:
-                qq = quiz_question.quiz
-                if qq.id == quiz_id:
-                    quiz_question_to_replace = quiz_question
-        
-            #get replacement question - will have same difficulty and round as old question
-            replacement_question_array = get_quiz_data([q_to_replace.difficulty], 1, q_to_replace.user_id)
-            replacement_question = replacement_question_array[0]
-
-            #add new question to db
-            db.session.add(replacement_question)
-            db.session.commit()
-            db.session.refresh(replacement_question)
-            replacement_question_ids.append(replacement_question.id)
-
-            #add new question to quiz
-            new_quiz_question = QuizQuestion(quiz_id=quiz_id,
-                                     question_id=replacement_question.id,
-                                     round=quiz_question_to_replace.round)
-            db.session.add(new_quiz_question)
-            db.session.commit()
-
-            #remove question from quiz - don't delete it, though
-            db.session.delete(quiz_question_to_replace)
-            db.session.commit()
+        try:
+            #Nothing that's already on the quiz, including the questions being replaced
+            replacements = get_rounds_data([[difficulty] for difficulty in difficulties],
+                                           [len(rounds_by_difficulty[difficulty]) for difficulty in difficulties],
+                                           quiz.user_id, in_use=Question.bank_ids_on_quiz(quiz_id))
+        except QuestionFetchError:
+            db.session.rollback()
+            flash("Couldn't get replacement questions right now. Please try again.", "danger")
+            return redirect(f"/quizzes/edit/{quiz_id}")
+
+        #Remove the old questions from the quiz - don't delete them, though - and add the new ones, all in one transaction
+        QuizQuestion.query.filter(QuizQuestion.quiz_id == quiz_id,
+                                  QuizQuestion.question_id.in_(q_ids)).delete(synchronize_session=False)
+        for difficulty, replacement_questions in zip(difficulties, replacements):
+            for round_no, replacement_question in zip(rounds_by_difficulty[difficulty], replacement_questions):
+                db.session.add(QuizQuestion(quiz_id=quiz_id, question=replacement_question, round=round_no))
+        Quiz.touch([quiz_id])
+        db.session.flush()
+
+        replacement_question_ids = [question.id for replacement_questions in replacements for question in replacement_questions]
+        db.session.commit()
+        quizzes_changed([quiz_id])
 
-        quiz_questions = []
-        
-        for round_no in range(1, quiz.rounds + 1):
-            round = []
-            for quiz_question in quiz.questions:
-                if quiz_question.round == round_no:
-                    round.append(quiz_question.question)
-            quiz_questions.append(round)
+        quiz_questions = quiz.questions_by_round()
 
         flash("Questions successfully replaced. New questions highlighted in yellow.", "success")
         return render_template("edit_quiz.html", quiz_questions=quiz_questions, quiz=quiz, rq_ids=replacement_question_ids)
 
     else:
         quiz = Quiz.query.get_or_404(quiz_id)
-        quiz_questions = []
-        
-        for round_no in range(1, quiz.rounds + 1):
-            round = []
-            for quiz_question in quiz.questions:
-                if quiz_question.round == round_no:
-                    round.append(quiz_question.question)
-            quiz_questions.append(round)
+        quiz_questions = quiz.questions_by_round()
 
         return render_template("edit_quiz.html", quiz_questions=quiz_questions, quiz=quiz, rq_ids=None)
 
-@app.route("/quizzes/remove_questions/<int:quiz_id>", methods=["POST"])
+@views.route("/quizzes/remove_questions/<int:quiz_id>", methods=["POST"])
 def remove_question(quiz_id):
     """Remove selected questions in the quiz with the given id"""
-    q_ids = request.form.getlist("checked_questions")
+    q_ids = [int(q_id) for q_id in request.form.getlist("checked_questions")]
     quiz = Quiz.query.get_or_404(quiz_id)
 
-    for q_id in q_ids:
-        q_to_remove = Question.query.get_or_404(int(q_id))
-
-        for quiz_question in q_to_remove.quizzes:
-            qq = quiz_question.quiz
-            if qq.id == quiz_id:
-                quiz_question_to_remove = quiz_question
-
-        #remove question from quiz - don't delete it, though
-        db.session.delete(quiz_question_to_remove)
-        db.session.commit()
+    #remove questions from quiz in one statement - don't delete them, though
+    QuizQuestion.query.filter(QuizQuestion.quiz_id == quiz.id,
+                              QuizQuestion.question_id.in_(q_ids)).delete(synchronize_session=False)
+    Quiz.touch([quiz.id])
+    db.session.commit()
+    quizzes_changed([quiz.id])
 
     flash("Questions successfully removed", "success")
     return redirect(f"/quizzes/edit/{quiz_id}")
     
 
-@app.route("/quizzes/delete/<int:quiz_id>", methods=["POST"])
+@views.route("/quizzes/delete/<int:quiz_id>", methods=["POST"])
 def delete_quiz(quiz_id):
 
     quiz_to_delete = Quiz.query.get_or_404(quiz_id)
     db.session.delete(quiz_to_delete)
     db.session.commit()
+    quizzes_changed([quiz_id])
 
     flash("Quiz deleted.", "success")
     return redirect("/quizzes/show")
@@ -327,7 +465,7 @@ def delete_quiz(quiz_id):
 #Question routes
 ######################################################
 
-@app.route("/questions/create", methods=["GET", "POST"])
+@views.route("/questions/create", methods=["GET", "POST"])
 def create_question():
     """Add question"""
 
@@ -357,7 +495,43 @@ def create_question():
 
     return render_template("create_question.html", form=form)
 
-@app.route("/questions/edit/<int:question_id>", methods=["GET", "POST"])
+@views.route("/questions/import", methods=["GET", "POST"])
+def import_questions_page():
+    """Import questions from a CSV or JSON file - optionally adding them to a quiz"""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    user_id = g.user.id
+
+    form = ImportQuestions()
+    #Only the user's own quizzes - 0 for not adding the questions to one
+    user_quizzes = db.session.query(Quiz.id, Quiz.name).filter(Quiz.user_id == user_id).order_by(Quiz.id).all()
+    form.quiz.choices = [(0, "None")] + [(quiz.id, quiz.name) for quiz in user_quizzes]
+
+    report = None
+
+    if form.validate_on_submit():
+        quiz = Quiz.query.get(form.quiz.data) if form.quiz.data else None
+
+        if quiz is not None and form.round.data > quiz.rounds:
+            form.round.errors.append(f"{quiz.name} only has {quiz.rounds} rounds")
+        else:
+            upload = form.file.data
+            report = import_questions(upload.stream, upload.filename, user_id, quiz, form.round.data if quiz else None)
+
+            if report.file_error:
+                flash(report.file_error, "danger")
+            else:
+                if quiz is not None and report.imported:
+                    quizzes_changed([quiz.id])
+                flash(f"{report.imported} questions imported" + (f", {report.error_count} rows skipped." if report.error_count else "."),
+                      "success" if report.imported else "danger")
+
+    return render_template("import_questions.html", form=form, report=report)
+
+@views.route("/questions/edit/<int:question_id>", methods=["GET", "POST"])
 def edit_question(question_id):
     """Edit question"""
 
@@ -373,14 +547,16 @@ def edit_question(question_id):
         question.question = form.question.data
         question.answer = form.answer.data
         question.difficulty = form.difficulty.data
+        quiz_ids = question.touch()
         db.session.commit()
+        quizzes_changed(quiz_ids)
 
         flash("Question successfully edited.", 'success')
         return redirect(f"/questions/show/{question_id}")
 
     return render_template("edit_question.html", question=question, form=form)
 
-@app.route("/questions/show")
+@views.route("/questions/show")
 def show_questions():
     """Show all questions"""
    
@@ -391,11 +567,46 @@ def show_questions():
     user = g.user
     user_id = user.id
 
-    questions = Question.query.filter(Question.user_id == user_id).order_by(Question.id).all()
+    page = keyset_page(Question.query.filter(Question.user_id == user_id), Question.id,
+                       after=request.args.get("after", type=int),
+                       before=request.args.get("before", type=int),
+                       per_page=current_app.config['PAGE_SIZE'])
+
+    return render_template("show_all_questions.html",questions=page.items, page=page)
+
+@views.route("/questions/export.<fmt>")
+def export_questions(fmt):
+    """Download all the user's questions as CSV or NDJSON, or show them as a printable answer sheet"""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    if fmt not in FORMATS:
+        abort(404)
 
-    return render_template("show_all_questions.html",questions=questions)
+    user_id = g.user.id
 
-@app.route("/questions/show/<int:question_id>", methods=["GET", "POST"])
+    return export_response(fmt, f"{g.user.username}'s questions", lambda: library_rows(user_id))
+
+@views.route("/questions/search")
+def search_questions():
+    """Search the user's questions"""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    terms = request.args.get("q", "").strip()
+    page = max(request.args.get("page", 1, type=int), 1)
+    questions, more = [], False
+
+    if terms:
+        questions, more = Question.search(g.user.id, terms, page=page, per_page=current_app.config['PAGE_SIZE'])
+
+    return render_template("search_questions.html", questions=questions, terms=terms, page=page, more=more)
+
+@views.route("/questions/show/<int:question_id>", methods=["GET", "POST"])
 def show_question(question_id):
     """Show question - Also allow it to be added to a quiz"""
 
@@ -406,10 +617,8 @@ def show_question(question_id):
     question = Question.query.get_or_404(question_id)
     form = AddQuestionToQuiz()
 
-    #Get all the quizzes that the question is on
-    quizzes_with_question = [quiz_question.quiz.id for quiz_question in question.quizzes]
-    #Then use this to get all the quizzes it isn't on
-    quiz_choice_data = db.session.query(Quiz.id, Quiz.name, Quiz.rounds).filter(Quiz.id.notin_(quizzes_with_question)).all()
+    #The user's quizzes that the question isn't on yet
+    quiz_choice_data = Quiz.without_question(g.user.id, question_id).all()
     #These are the options for the quiz select in the form
     quiz_choices = [(quiz_datum.id, quiz_datum.name) for quiz_datum in quiz_choice_data]
     #These help dynamically generate the rounds in the quiz selected that the question can be added to
@@ -424,18 +633,20 @@ def show_question(question_id):
         #Add the question to the selected quiz and round and show the amended quiz
         new_quiz_question = QuizQuestion(quiz_id=quiz_id, question_id=question_id, round=round)
         db.session.add(new_quiz_question)
+        Quiz.touch([quiz_id])
         db.session.commit()
+        quizzes_changed([quiz_id])
         
-        #Get quiz for sake of showing its name in flash message
-        quiz = Quiz.query.get_or_404(quiz_id)
+        #The quiz's name for the flash message - it's one of the choices
+        quiz_name = dict(quiz_choices)[quiz_id]
         
-        flash(f"Question ID:{question.id} added to Round {round} of Quiz {quiz.name}", "success")
-        return redirect(f"/quizzes/show/{quiz.id}")
+        flash(f"Question ID:{question.id} added to Round {round} of Quiz {quiz_name}", "success")
+        return redirect(f"/quizzes/show/{quiz_id}")
 
 
     return render_template("show_question.html", question=question, form=form, quiz_rounds=quiz_rounds)
 
-@app.route("/questions/delete/<int:question_id>", methods=["POST"])
+@views.route("/questions/delete/<int:question_id>", methods=["POST"])
 def delete_question(question_id):
     """Delete Question"""
 
@@ -444,15 +655,18 @@ def delete_question(question_id):
         return redirect("/")
 
     question_to_delete = Question.query.get_or_404(question_id)
+    #The quizzes it's on are losing a question
+    quiz_ids = question_to_delete.touch()
     db.session.delete(question_to_delete)
     db.session.commit()
+    quizzes_changed(quiz_ids)
 
     flash("Question deleted.", "success")
     return redirect("/questions/show")
 ######################################################
 #Change username/password routes
 ######################################################
-@app.route("/change_username", methods=["GET", "POST"])
+@views.route("/change_username", methods=["GET", "POST"])
 def change_username():
     """Change username"""
 
@@ -468,16 +682,22 @@ def change_username():
 
     if form.validate_on_submit():
 
-        if User.authenticate(user.username, form.password.data):
+        #Only the password needs checking - we already know who the user is
+        user = User.query.get_or_404(user_id)
+
+        if user.verify_password(form.password.data):
             
             try:
                 user.username = form.username.data
                 db.session.commit()
 
             except IntegrityError:
+                db.session.rollback()
                 flash("Username already taken.", 'danger')
                 return render_template('change_username.html', form=form, user_name=user_name)
 
+            user_cache.invalidate(user_id)
+
             flash("Username successfully changed.", 'success')
             return redirect("/")
 
@@ -485,7 +705,7 @@ def change_username():
 
     return render_template('change_username.html', form=form, user_name=user_name)
 
-@app.route("/change_password", methods=["GET", "POST"])
+@views.route("/change_password", methods=["GET", "POST"])
 def change_password():
     """Change password"""
 
@@ -500,6 +720,7 @@ def change_password():
     if form.validate_on_submit():
         
         if User.change_password(user.username, form.password.data, form.new_password.data):
+            user_cache.invalidate(user.id)
             flash("Password successfully changed", 'success')
             return redirect("/")
 
@@ -519,7 +740,49 @@ def change_password():
 #Homepage/About/FAQ routes
 ######################################################
 
-@app.route('/')
+def check_metrics_token():
+    """404 unless the request has the METRICS_TOKEN bearer token - or this is the debug server"""
+
+    if current_app.debug:
+        return
+
+    token = current_app.config['METRICS_TOKEN']
+    supplied = request.headers.get("Authorization", "")
+    if not token or not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+        abort(404)
+
+@views.route('/stats/user_cache')
+def user_cache_stats():
+    """Hit/miss counts for this process's user cache"""
+
+    check_metrics_token()
+    return jsonify(user_cache.stats())
+
+@views.route('/stats/fragment_cache')
+def fragment_cache_stats():
+    """Hit ratio, and rendering time saved, for the quiz page's fragment cache"""
+
+    check_metrics_token()
+    return jsonify(fragment_cache.stats())
+
+@views.route('/metrics')
+def metrics_page():
+    """Request, database, JService and cache metrics in Prometheus' text format"""
+
+    check_metrics_token()
+    fragments = fragment_cache.stats()
+    users = user_cache.stats()
+    caches = [("quizzr_fragment_cache_hits_total", "counter", "Quiz question lists served from the fragment cache", fragments["hits"]),
+              ("quizzr_fragment_cache_misses_total", "counter", "Quiz question lists that had to be rendered", fragments["misses"]),
+              ("quizzr_fragment_cache_saved_seconds_total", "counter", "Rendering time saved by the fragment cache", fragments["saved_ms"] / 1000),
+              ("quizzr_fragment_cache_bytes", "gauge", "Size of the fragment cache", fragments["bytes"]),
+              ("quizzr_user_cache_hits_total", "counter", "Logged in users found in the user cache", users["hits"]),
+              ("quizzr_user_cache_misses_total", "counter", "Logged in users that had to be looked up", users["misses"]),
+              ("quizzr_user_cache_size", "gauge", "Users in the user cache", users["size"])]
+
+    return Response(metrics.render(caches), content_type=metrics.CONTENT_TYPE)
+
+@views.route('/')
 def homepage():
     """Show homepage"""
 
@@ -530,7 +793,7 @@ def homepage():
     else:
         return render_template('home-anon.html')
 
-@app.route('/about')
+@views.route('/about')
 def about_page():
     """Show 'about' page"""
 
@@ -540,7 +803,7 @@ def about_page():
 
     return render_template('about.html')
 
-@app.route('/faq')
+@views.route('/faq')
 def faq_page():
     """Show FAQ page"""
 
@@ -551,24 +814,27 @@ def faq_page():
     return render_template('faq.html')
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Caching headers
+#
+# Fingerprinted static files (see static_url) never change, so browsers can
+# keep them for a year. Pages that set their own validators (see http_cache.py)
+# keep their headers, and nothing else is cached at all.
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@views.after_app_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add caching headers to every response."""
+
+    if request.endpoint == "static" and "v" in request.args:
+        req.headers['Cache-Control'] = "public, max-age=31536000, immutable"
+        return req
+
+    if request.endpoint == "static" or req.headers.get("ETag"):
+        return req
 
     req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
     req.headers["Pragma"] = "no-cache"
     req.headers["Expires"] = "0"
     req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
-
-
-
-    
-
-
+    return req
\ No newline at end of file
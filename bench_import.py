@@ -0,0 +1,85 @@
+"""Measure how long a worker takes to import and create the app.
+
+Usage:
+
+    python bench_import.py [--runs 5] [--top 15] [--max-ms 1500]
+
+Runs `python -X importtime` in a fresh interpreter for each run, with the
+production config, and reports the median time to import app.py and to call
+create_app(), along with which of app.py's imports took longest. With
+--max-ms it exits non-zero if the median total is over budget, so a startup
+regression can fail a build.
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+#Imports the app and times create_app() separately, so the two can be told apart
+SCRIPT = """
+import time
+import app
+start = time.perf_counter()
+app.create_app()
+print(f"create_app {(time.perf_counter() - start) * 1e6:.0f}")
+"""
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+def run_once():
+    """One cold start - returns (us to import app, us for create_app(), {module app imports directly: cumulative us})"""
+
+    env = dict(os.environ, FLASK_ENV="production")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", SCRIPT],
+                            capture_output=True, text=True, env=env, check=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    #A module's line comes after those of everything it imports, indented one level further
+    children = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if not match:
+            continue
+        depth, name, cumulative = len(match.group(3)) // 2, match.group(4), int(match.group(2))
+        if depth == 1:
+            children[name] = cumulative
+        elif depth == 0:
+            if name == "app":
+                app_us, modules = cumulative, children
+            children = {}
+
+    create_app_us = int(result.stdout.split()[-1])
+    return app_us, create_app_us, modules
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure app import and startup time")
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to time")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest modules to list")
+    parser.add_argument("--max-ms", type=float, default=None, help="fail if the median total is over this")
+    args = parser.parse_args()
+
+    totals, create_apps = [], []
+    by_module = defaultdict(list)
+    for _ in range(args.runs):
+        total, create_app_us, modules = run_once()
+        totals.append(total)
+        create_apps.append(create_app_us)
+        for name, us in modules.items():
+            by_module[name].append(us)
+
+    import_ms = statistics.median(totals) / 1000
+    create_app_ms = statistics.median(create_apps) / 1000
+    print(f"{args.runs} runs: import app {import_ms:.1f}ms, create_app {create_app_ms:.1f}ms, "
+          f"total {import_ms + create_app_ms:.1f}ms (medians)")
+
+    print(f"\nSlowest of app.py's imports (including what they import):")
+    slowest = sorted(by_module.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, timings in slowest[:args.top]:
+        print(f"  {statistics.median(timings) / 1000:8.1f}ms  {name}")
+
+    if args.max_ms is not None and import_ms + create_app_ms > args.max_ms:
+        print(f"\nOver budget: {import_ms + create_app_ms:.1f}ms > {args.max_ms:.1f}ms")
+        sys.exit(1)
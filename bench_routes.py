@@ -0,0 +1,294 @@
+"""Benchmark the hot routes end to end.
+
+Usage:
+
+    BENCH_DATABASE_URL=postgresql:///trivia-bench python bench_routes.py [--users 10] [--quizzes 20] [--questions 500]
+        [--requests 200] [--concurrency 1] [--routes quiz_show,login] [--out results.json]
+        [--baseline baseline.json] [--threshold 10]
+
+Builds the app with BenchConfig - production settings against a scratch
+database (its tables are dropped and recreated, so don't point this at real
+data), with quiz generation run in the request and JService replaced by the
+in-process fake (--jservice-latency adds latency to it). Seeds synthetic
+users, each with a library of questions and some quizzes made from them,
+then sends each route --requests requests through the Flask test client
+from --concurrency threads (a logged in user each) and reports latency
+percentiles and throughput.
+
+Everything random is seeded, so two runs at the same commit do the same
+work. quiz_create draws from the question bank once the fake JService has
+stocked it, as it would in production - use --bank to start with one.
+
+--out writes the results as JSON. --baseline compares them with a saved
+run and exits non-zero if any route's p50 or p95 got more than --threshold
+percent slower, or its throughput that much lower. --results loads saved
+results instead of running, to compare two saved runs.
+"""
+import argparse
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from bench_search import WORDS, check_scratch_database, percentile
+from models import db, hash_password, User, Quiz, Question, QuizQuestion, BankQuestion
+
+PASSWORD = "benchpass"
+
+#Latency percentiles reported for every route
+PERCENTILES = (50, 90, 95, 99)
+
+def seed(users, quizzes, questions, rounds, qs_per_round, bank):
+    """Bulk insert the synthetic data - returns {user id: [quiz ids]}"""
+
+    rng = random.Random(42)
+
+    #Every user has the same password, so it only needs hashing once
+    pw_hash = hash_password(PASSWORD)
+    db.session.execute(User.__table__.insert(), [{"username": f"bench{n}", "password": pw_hash} for n in range(users)])
+    user_ids = [user_id for (user_id,) in db.session.query(User.id).order_by(User.id)]
+
+    for user_id in user_ids:
+        db.session.execute(Question.__table__.insert(),
+                           [{"question": " ".join(rng.choices(WORDS, k=12)) + f" q{n}",
+                             "answer": rng.choice(WORDS).title(),
+                             "category": rng.choice(WORDS).upper(),
+                             "difficulty": rng.randint(1, 5),
+                             "user_id": user_id} for n in range(questions)])
+        db.session.execute(Quiz.__table__.insert(),
+                           [{"name": f"Bench quiz {n}", "description": "", "rounds": rounds, "user_id": user_id} for n in range(quizzes)])
+    db.session.flush()
+
+    quiz_ids = {}
+    for user_id in user_ids:
+        question_ids = [question_id for (question_id,) in db.session.query(Question.id).filter(Question.user_id == user_id)]
+        quiz_ids[user_id] = [quiz_id for (quiz_id,) in db.session.query(Quiz.id).filter(Quiz.user_id == user_id).order_by(Quiz.id)]
+        per_quiz = min(rounds * qs_per_round, len(question_ids))
+        db.session.execute(QuizQuestion.__table__.insert(),
+                           [{"quiz_id": quiz_id, "question_id": question_id, "round": n % rounds + 1}
+                            for quiz_id in quiz_ids[user_id]
+                            for n, question_id in enumerate(rng.sample(question_ids, per_quiz))])
+
+    if bank:
+        BankQuestion.bank([{"jservice_id": None, "question": f"Bank question {n}", "answer": f"Bank answer {n}",
+                            "category": rng.choice(WORDS), "difficulty": n % 5 + 1} for n in range(bank)])
+
+    db.session.commit()
+
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute("ANALYZE")
+        db.session.commit()
+
+    return quiz_ids
+
+#Each route's function takes a seeded Random and the (id, username, quiz ids) of the user sending it, and
+#returns the request to make - (method, url, form data, the status it should get)
+
+def login_request(rng, user):
+    return "POST", "/login", {"username": user[1], "password": PASSWORD}, 302
+
+def quiz_create_request(rng, user):
+    return "POST", "/quizzes/create", {"name": "Bench quiz", "rounds": 3, "qs_per_round": 10,
+                                       "round_one_diff": [1, 2], "round_two_diff": [3], "round_three_diff": [4, 5],
+                                       "round_four_diff": [1], "round_five_diff": [1]}, 302
+
+def quiz_show_request(rng, user):
+    return "GET", f"/quizzes/show/{rng.choice(user[2])}", None, 200
+
+def quiz_edit_request(rng, user):
+    return "GET", f"/quizzes/edit/{rng.choice(user[2])}", None, 200
+
+def quiz_replace_request(rng, user):
+    quiz_id = rng.choice(user[2])
+    #Any question that's on the quiz now - every replacement changes them
+    question_id = db.session.query(QuizQuestion.question_id).filter(QuizQuestion.quiz_id == quiz_id).limit(1).scalar()
+    return "POST", f"/quizzes/edit/{quiz_id}", {"checked_questions": question_id}, 200
+
+def questions_show_request(rng, user):
+    return "GET", "/questions/show", None, 200
+
+ROUTES = {"login": login_request,
+          "quiz_create": quiz_create_request,
+          "quiz_show": quiz_show_request,
+          "quiz_edit": quiz_edit_request,
+          "quiz_replace": quiz_replace_request,
+          "questions_show": questions_show_request}
+
+def run_route(app, route, users, requests, concurrency, warmup):
+    """Send the route `requests` requests from `concurrency` threads - returns (latencies in ms, errors, seconds taken)"""
+
+    from app import CURR_USER_KEY
+
+    timings = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n, count):
+        rng = random.Random(f"{route}:{n}")
+        user = users[n % len(users)]
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user[0]
+
+        mine = []
+        for i in range(warmup + count):
+            #Working out the request isn't part of the timing
+            with app.app_context():
+                method, url, data, status = ROUTES[route](rng, user)
+
+            start = time.perf_counter()
+            resp = client.open(url, method=method, data=data)
+            elapsed = (time.perf_counter() - start) * 1000
+
+            if i < warmup:
+                continue
+            mine.append(elapsed)
+            if resp.status_code != status:
+                with lock:
+                    errors.append(f"{method} {url}: {resp.status_code}")
+
+        with lock:
+            timings.extend(mine)
+
+    counts = [requests // concurrency + (1 if n < requests % concurrency else 0) for n in range(concurrency)]
+    threads = [threading.Thread(target=worker, args=(n, count)) for n, count in enumerate(counts)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return timings, errors, time.perf_counter() - start
+
+def summarize(timings, errors, seconds):
+    summary = {"requests": len(timings), "errors": len(errors),
+               "mean_ms": round(statistics.mean(timings), 2), "max_ms": round(max(timings), 2),
+               "throughput_rps": round(len(timings) / seconds, 1)}
+    for pct in PERCENTILES:
+        summary[f"p{pct}_ms"] = round(percentile(timings, pct), 2)
+    return summary
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """Lines comparing each route with the baseline, and the routes that regressed by more than threshold percent"""
+
+    lines = []
+    regressed = []
+    for route, now in results["routes"].items():
+        before = baseline["routes"].get(route)
+        if before is None:
+            lines.append(f"  {route:15} not in baseline")
+            continue
+
+        changes = {key: (now[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+                   for key in ("p50_ms", "p95_ms", "throughput_rps")}
+        lines.append(f"  {route:15} p50 {before['p50_ms']:8.1f} -> {now['p50_ms']:8.1f}ms ({changes['p50_ms']:+6.1f}%)  "
+                     f"p95 {before['p95_ms']:8.1f} -> {now['p95_ms']:8.1f}ms ({changes['p95_ms']:+6.1f}%)  "
+                     f"{before['throughput_rps']:7.1f} -> {now['throughput_rps']:7.1f}/s ({changes['throughput_rps']:+6.1f}%)")
+
+        if changes["p50_ms"] > threshold or changes["p95_ms"] > threshold or changes["throughput_rps"] < -threshold:
+            regressed.append(route)
+
+    return lines, regressed
+
+def run(args):
+    from app import create_app
+    from config import BenchConfig
+    from migrations import upgrade
+
+    check_scratch_database(BenchConfig)
+    BenchConfig.JSERVICE_FAKE_LATENCY = args.jservice_latency
+    app = create_app(BenchConfig)
+
+    with app.app_context():
+        db.drop_all()
+        upgrade(db.engine)
+
+        start = time.perf_counter()
+        quiz_ids = seed(args.users, args.quizzes, args.questions, args.rounds, args.qs_per_round, args.bank)
+        print(f"Seeded {args.users} users x ({args.questions} questions, {args.quizzes} quizzes) in {time.perf_counter() - start:.1f}s",
+              file=sys.stderr)
+        users = [(user.id, user.username, quiz_ids[user.id]) for user in User.query.order_by(User.id)]
+        dialect = db.engine.dialect.name
+        db.session.remove()
+
+    results = {"meta": {"commit": git_commit(),
+                        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+                        "python": platform.python_version(),
+                        "database": dialect,
+                        "users": args.users, "quizzes": args.quizzes, "questions": args.questions,
+                        "rounds": args.rounds, "qs_per_round": args.qs_per_round, "bank": args.bank,
+                        "requests": args.requests, "concurrency": args.concurrency, "warmup": args.warmup,
+                        "jservice_latency": args.jservice_latency},
+               "routes": {}}
+
+    for route in args.routes:
+        timings, errors, seconds = run_route(app, route, users, args.requests, args.concurrency, args.warmup)
+        results["routes"][route] = summarize(timings, errors, seconds)
+        for error in errors[:5]:
+            print(f"  {route}: unexpected {error}", file=sys.stderr)
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the hot routes")
+    parser.add_argument("--users", type=int, default=10, help="synthetic users - one per thread, reused if there are more threads")
+    parser.add_argument("--quizzes", type=int, default=20, help="quizzes per user")
+    parser.add_argument("--questions", type=int, default=500, help="questions per user")
+    parser.add_argument("--rounds", type=int, default=3, help="rounds per seeded quiz")
+    parser.add_argument("--qs-per-round", type=int, default=10, help="questions per round of a seeded quiz")
+    parser.add_argument("--bank", type=int, default=0, help="clues to put in the question bank to start with")
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per route")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests per thread before the timed ones")
+    parser.add_argument("--concurrency", type=int, default=1, help="threads sending requests at once")
+    parser.add_argument("--jservice-latency", type=float, default=0.0, help="seconds of latency for the fake JService")
+    parser.add_argument("--routes", type=lambda text: text.split(","), default=list(ROUTES),
+                        help=f"comma separated routes to run (default all: {','.join(ROUTES)})")
+    parser.add_argument("--out", help="write the results as JSON here (- for stdout)")
+    parser.add_argument("--results", help="load saved results instead of running the benchmark")
+    parser.add_argument("--baseline", help="saved results to compare with")
+    parser.add_argument("--threshold", type=float, default=10, help="percent slower that counts as a regression")
+    args = parser.parse_args()
+
+    unknown = set(args.routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    if args.results:
+        with open(args.results) as f:
+            results = json.load(f)
+    else:
+        results = run(args)
+
+    print(f"{'route':17} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'mean':>8}  {'req/s':>7}  errors", file=sys.stderr)
+    for route, summary in results["routes"].items():
+        print(f"  {route:15} " + " ".join(f"{summary[f'p{pct}_ms']:8.1f}" for pct in PERCENTILES) +
+              f" {summary['mean_ms']:8.1f}  {summary['throughput_rps']:7.1f}  {summary['errors']}", file=sys.stderr)
+
+    if args.out == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        lines, regressed = compare(results, baseline, args.threshold)
+        print(f"\nAgainst {args.baseline} ({baseline['meta'].get('commit')}):", file=sys.stderr)
+        print("\n".join(lines), file=sys.stderr)
+        if regressed:
+            print(f"\nRegressed by more than {args.threshold:g}%: {', '.join(regressed)}", file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,101 @@
+"""Benchmark question search on a large library.
+
+Usage:
+
+    BENCH_DATABASE_URL=postgresql:///trivia-bench python bench_search.py [--questions 100000] [--searches 200]
+
+Builds the app with BenchConfig and fills a scratch user's library with
+synthetic questions (the database's tables are dropped and recreated, so
+it refuses to run against the app's own DATABASE_URL), then times
+Question.search for a mix of common and rare words and reports the latency
+percentiles in milliseconds.
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+
+from models import db, User, Question
+
+WORDS = ("river mountain capital president novel composer painter element planet ocean "
+         "island emperor battle treaty poet opera symphony desert volcano glacier "
+         "bird mammal insect reptile cathedral bridge railway harbor festival dynasty").split()
+
+def seed(user_id, total, batch_size=10000):
+    """Bulk insert `total` questions of random words for the user"""
+
+    rng = random.Random(42)
+    for start in range(0, total, batch_size):
+        rows = [{"question": " ".join(rng.choices(WORDS, k=12)) + f" q{n}",
+                 "answer": rng.choice(WORDS).title(),
+                 "category": rng.choice(WORDS).upper(),
+                 "difficulty": rng.randint(1, 5),
+                 "user_id": user_id} for n in range(start, min(start + batch_size, total))]
+        db.session.execute(Question.__table__.insert(), rows)
+        db.session.commit()
+
+def check_scratch_database(config):
+    """Exit if the benchmark's database is the app's - its tables are about to be dropped"""
+
+    from config import ProductionConfig
+
+    if config.SQLALCHEMY_DATABASE_URI == ProductionConfig.SQLALCHEMY_DATABASE_URI:
+        sys.exit(f"Refusing to benchmark against the app's database ({config.SQLALCHEMY_DATABASE_URI}) - "
+                 "set BENCH_DATABASE_URL to a scratch database")
+
+def percentile(timings, pct):
+    timings = sorted(timings)
+    return timings[min(len(timings) - 1, int(len(timings) * pct / 100))]
+
+def bench(user_id, searches):
+    """Time a mix of searches, returning the latencies in milliseconds"""
+
+    rng = random.Random(7)
+    #Common single words, pairs, and a rare exact token
+    queries = [rng.choice(WORDS) for _ in range(searches // 2)]
+    queries += [f"{rng.choice(WORDS)} {rng.choice(WORDS)}" for _ in range(searches // 4)]
+    queries += [f"q{rng.randint(0, 1000)}" for _ in range(searches - len(queries))]
+
+    timings = []
+    for terms in queries:
+        start = time.perf_counter()
+        Question.search(user_id, terms, page=rng.randint(1, 3))
+        timings.append((time.perf_counter() - start) * 1000)
+        db.session.rollback()
+
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark question search")
+    parser.add_argument("--questions", type=int, default=100000, help="size of the synthetic library")
+    parser.add_argument("--searches", type=int, default=200, help="number of searches to time")
+    args = parser.parse_args()
+
+    from app import create_app
+    from config import BenchConfig
+    from migrations import upgrade
+
+    check_scratch_database(BenchConfig)
+
+    with create_app(BenchConfig).app_context():
+        db.engine.echo = False
+        db.drop_all()
+        upgrade(db.engine)
+
+        user = User.signup("benchuser", "benchuser")
+        db.session.commit()
+
+        start = time.perf_counter()
+        seed(user.id, args.questions)
+        print(f"Seeded {args.questions} questions in {time.perf_counter() - start:.1f}s")
+
+        if db.engine.dialect.name == "postgresql":
+            db.session.execute("ANALYZE questions")
+            db.session.commit()
+
+        timings = bench(user.id, args.searches)
+        print(f"{len(timings)} searches: p50 {percentile(timings, 50):.1f}ms, "
+              f"p95 {percentile(timings, 95):.1f}ms, p99 {percentile(timings, 99):.1f}ms, "
+              f"mean {statistics.mean(timings):.1f}ms")
@@ -0,0 +1,100 @@
+"""App configuration - pass one of these classes to create_app().
+
+Settings come from environment variables where it makes sense to vary them
+per deployment. ProductionConfig is the default; FLASK_ENV=development picks
+DevelopmentConfig.
+"""
+import os
+
+def database_url(default, var='DATABASE_URL'):
+    """The database URL in the environment variable, with Heroku's postgres:// scheme (which SQLAlchemy no longer accepts) fixed up"""
+
+    uri = os.environ.get(var, default)
+    if uri.startswith("postgres://"):
+        uri = uri.replace("postgres://", "postgresql://", 1)
+    return uri
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = database_url('postgresql:///trivia')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'shh')
+
+    DEBUG_TB_ENABLED = False
+
+    #Upstream question fetching - size the pool to the number of threads per worker
+    JSERVICE_URL = os.environ.get('JSERVICE_URL', 'http://jservice.io')
+    JSERVICE_POOL_SIZE = int(os.environ.get('JSERVICE_POOL_SIZE', 10))
+    JSERVICE_CONNECT_TIMEOUT = float(os.environ.get('JSERVICE_CONNECT_TIMEOUT', 3.05))
+    JSERVICE_READ_TIMEOUT = float(os.environ.get('JSERVICE_READ_TIMEOUT', 10))
+    JSERVICE_MAX_RETRIES = int(os.environ.get('JSERVICE_MAX_RETRIES', 3))
+    JSERVICE_BACKOFF = float(os.environ.get('JSERVICE_BACKOFF', 0.5))
+    #Threads for fetching quiz rounds concurrently, and how long (in seconds) to wait for them all
+    JSERVICE_FETCH_WORKERS = int(os.environ.get('JSERVICE_FETCH_WORKERS', 5))
+    JSERVICE_DEADLINE = float(os.environ.get('JSERVICE_DEADLINE', 30))
+    #Use an in-process fake JService instead of JSERVICE_URL, e.g. for working offline - see fake_jservice.py
+    JSERVICE_FAKE = os.environ.get('JSERVICE_FAKE') == '1'
+    JSERVICE_FAKE_SEED = int(os.environ.get('JSERVICE_FAKE_SEED', 0))
+    JSERVICE_FAKE_LATENCY = float(os.environ.get('JSERVICE_FAKE_LATENCY', 0))
+    JSERVICE_FAKE_ERROR_RATE = float(os.environ.get('JSERVICE_FAKE_ERROR_RATE', 0))
+
+    #Background quiz generation - see jobs.py. QUIZ_JOBS_EAGER runs jobs in the request instead (handy for tests)
+    QUIZ_JOB_WORKERS = int(os.environ.get('QUIZ_JOB_WORKERS', 2))
+    QUIZ_JOB_LEASE = int(os.environ.get('QUIZ_JOB_LEASE', 120))
+    QUIZ_JOB_MAX_ATTEMPTS = int(os.environ.get('QUIZ_JOB_MAX_ATTEMPTS', 3))
+    QUIZ_JOB_RETRY_DELAY = float(os.environ.get('QUIZ_JOB_RETRY_DELAY', 5))
+    QUIZ_JOBS_EAGER = os.environ.get('QUIZ_JOBS_EAGER') == '1'
+
+    #bcrypt work factor - existing hashes are upgraded (or downgraded) to it as users log in -
+    #and how many hashes can be worked on at once
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))
+
+    #Logged in users are cached per process for USER_CACHE_TTL seconds - see user_cache.py
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 60))
+
+    #Rendered quiz question lists - "memory" (per process, up to FRAGMENT_CACHE_BYTES) or "disk"
+    #(in FRAGMENT_CACHE_DIR - by default "fragments" in the app's instance folder - shared by every
+    #worker on the machine). See fragment_cache.py
+    FRAGMENT_CACHE = os.environ.get('FRAGMENT_CACHE', 'memory')
+    FRAGMENT_CACHE_BYTES = int(os.environ.get('FRAGMENT_CACHE_BYTES', 32 * 1024 * 1024))
+    FRAGMENT_CACHE_DIR = os.environ.get('FRAGMENT_CACHE_DIR')
+
+    #Rows per page on the quiz and question listings
+    PAGE_SIZE = int(os.environ.get('PAGE_SIZE', 25))
+
+    #/metrics and /stats/* need "Authorization: Bearer <METRICS_TOKEN>" - without a token they're only on the debug server
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+class ProductionConfig(Config):
+    pass
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    SQLALCHEMY_ECHO = True
+    DEBUG_TB_ENABLED = True
+
+class TestConfig(Config):
+    TESTING = True
+    #Never DATABASE_URL, so the tests can't be pointed at real data by accident
+    SQLALCHEMY_DATABASE_URI = database_url('postgresql:///trivia-test', 'TEST_DATABASE_URL')
+    WTF_CSRF_ENABLED = False
+    QUIZ_JOBS_EAGER = True
+    #Never the real JService - the tests have to run offline, and the same every time
+    JSERVICE_FAKE = True
+    JSERVICE_FAKE_SEED = 1
+    JSERVICE_FAKE_LATENCY = 0.0
+    JSERVICE_FAKE_ERROR_RATE = 0.0
+    METRICS_TOKEN = "test-metrics-token"
+
+class BenchConfig(ProductionConfig):
+    #Production settings, but a scratch database (bench_routes.py drops its tables) and the fake JService, so runs can be compared
+    SQLALCHEMY_DATABASE_URI = database_url('postgresql:///trivia-bench', 'BENCH_DATABASE_URL')
+    WTF_CSRF_ENABLED = False
+    QUIZ_JOBS_EAGER = True
+    JSERVICE_FAKE = True
+    JSERVICE_FAKE_SEED = 1
+
+CONFIGS = {"production": ProductionConfig, "development": DevelopmentConfig, "test": TestConfig}
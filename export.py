@@ -0,0 +1,110 @@
+"""Streaming exports of a quiz, or a user's whole question library.
+
+Rows are read with yield_per, which on Postgres means a server-side cursor,
+and written out a batch at a time as the response is sent - so the first
+bytes go out straight away and memory use doesn't grow with the size of the
+library. Formats are CSV, newline-delimited JSON, and a printable HTML answer
+sheet (questions first, then the answers on a page of their own).
+"""
+import csv
+import io
+import json
+from itertools import groupby
+
+from flask import current_app, stream_with_context, Response
+from werkzeug.utils import secure_filename
+
+from models import db, Question, QuizQuestion
+
+#Rows fetched from the database at a time, and written to the response at a time
+FETCH_SIZE = 1000
+WRITE_SIZE = 500
+
+FIELDS = ["id", "question", "answer", "difficulty", "category"]
+
+FORMATS = {"csv": "text/csv; charset=utf-8",
+           "ndjson": "application/x-ndjson",
+           "html": "text/html; charset=utf-8"}
+
+def library_rows(user_id):
+    """All the user's questions in id order, as (round, id, question, answer, difficulty, category) - round is always None"""
+
+    return (db.session.query(db.null().label("round"), Question.id, Question.question, Question.answer, Question.difficulty, Question.category)
+            .filter(Question.user_id == user_id)
+            .order_by(Question.id)
+            .yield_per(FETCH_SIZE))
+
+def quiz_rows(quiz_id):
+    """The quiz's questions in round order, as (round, id, question, answer, difficulty, category)"""
+
+    return (db.session.query(QuizQuestion.round, Question.id, Question.question, Question.answer, Question.difficulty, Question.category)
+            .join(Question, Question.id == QuizQuestion.question_id)
+            .filter(QuizQuestion.quiz_id == quiz_id)
+            .order_by(QuizQuestion.round, Question.id)
+            .yield_per(FETCH_SIZE))
+
+def _batches(rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == WRITE_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def stream_csv(rows, with_round=False):
+    """CSV with a header row - one chunk per WRITE_SIZE rows"""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    writer.writerow((["round"] if with_round else []) + FIELDS)
+    yield buffer.getvalue()
+
+    for batch in _batches(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(tuple(row) if with_round else tuple(row)[1:] for row in batch)
+        yield buffer.getvalue()
+
+def stream_ndjson(rows, with_round=False):
+    """One JSON object per line - one chunk per WRITE_SIZE rows"""
+
+    fields = (["round"] if with_round else []) + FIELDS
+    for batch in _batches(rows):
+        yield "".join(json.dumps(dict(zip(fields, tuple(row) if with_round else tuple(row)[1:]))) + "\n" for row in batch)
+
+def stream_answer_sheet(title, rows):
+    """Printable HTML - rows is called twice, once for the questions and once for the answers.
+
+    Questions are grouped by round - a library export is one long round.
+    """
+
+    def rounds():
+        for round_no, round_rows in groupby(rows(), key=lambda row: row[0]):
+            yield round_no, round_rows
+
+    template = current_app.jinja_env.get_template("answer_sheet.html")
+    context = {"title": title, "rounds": rounds}
+    current_app.update_template_context(context)
+
+    stream = template.stream(context)
+    stream.enable_buffering(WRITE_SIZE)
+    return stream
+
+def export_response(fmt, title, rows, with_round=False):
+    """Streaming response with the rows in the given format - rows is a function returning the query for them"""
+
+    if fmt == "html":
+        body = stream_answer_sheet(title, rows)
+    elif fmt == "csv":
+        body = stream_csv(rows(), with_round)
+    else:
+        body = stream_ndjson(rows(), with_round)
+
+    #The rows are read as the response is sent, so the request (and its database session) have to stay around until then
+    resp = Response(stream_with_context(body), content_type=FORMATS[fmt])
+    if fmt != "html":
+        resp.headers["Content-Disposition"] = f'attachment; filename="{secure_filename(title) or "export"}.{fmt}"'
+    return resp
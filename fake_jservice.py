@@ -0,0 +1,223 @@
+"""A stand-in for JService, for tests, benchmarks and working offline.
+
+Serves the one endpoint the app uses - GET /api/random?count=N, returning up
+to 100 clues in JService's format - from a pool of clues that's either
+generated from a seed or read from a fixture file (a JSON array or NDJSON of
+JService clues, as load_bank.py reads). The clues each request gets are
+decided by the seed and the request's number, so a run can be repeated
+exactly.
+
+Knobs for what the real thing gets up to: latency (with jitter), a rate of
+requests failing with a 5xx, a rate of clues with no value, and weights to
+skew how often each difficulty turns up.
+
+In-process:
+
+    with FakeJService(seed=1, latency=0.1) as server:
+        requests.get(f"{server.url}/api/random", params={"count": 10})
+
+or set JSERVICE_FAKE=1 and the app starts one for itself (see
+tools.connect_jservice). Standalone:
+
+    python fake_jservice.py --port 5001 --latency 0.2 --error-rate 0.1 --weights 5=3,1=1
+    JSERVICE_URL=http://localhost:5001 flask run
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request, Response
+
+from tools import value_to_difficulty
+
+#JService's own limit on clues per request
+MAX_COUNT = 100
+
+#Clue values as they appear on the board - single and double Jeopardy!
+VALUES = [100, 200, 300, 400, 500, 600, 800, 1000, 1200, 1600, 2000]
+
+CATEGORIES = ["history", "science", "literature", "geography", "sports", "music", "film", "food & drink", "animals", "potpourri"]
+
+def generate_clues(seed, size, null_rate=0.05):
+    """A pool of `size` made-up clues, the same for the same seed"""
+
+    rng = random.Random(seed)
+    clues = []
+    for n in range(1, size + 1):
+        category_id = rng.randrange(len(CATEGORIES))
+        clues.append({"id": n,
+                      "question": f"Fake question {n}",
+                      "answer": f"Fake answer {n}",
+                      "value": None if rng.random() < null_rate else rng.choice(VALUES),
+                      "category_id": category_id + 1,
+                      "category": {"id": category_id + 1, "title": CATEGORIES[category_id]}})
+    return clues
+
+def load_fixture(path):
+    """The JService clues in a JSON array or NDJSON file"""
+
+    #Imported here as it needs the database models, which generated pools don't
+    from load_bank import iter_records
+
+    return list(iter_records(path))
+
+class FakeJService:
+    """A fake JService on a local port, running in a background thread"""
+
+    def __init__(self, host="127.0.0.1", port=0, **settings):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self.configure(**settings)
+
+    def configure(self, seed=0, pool_size=5000, fixture=None, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500, null_rate=0.05, weights=None):
+        """Change the server's behaviour - safe to call while it's running, and starts the request count again.
+
+        weights maps difficulty (1-10) to how likely clues of that difficulty
+        are to be picked - None picks from the whole pool evenly. null_rate is
+        then the chance of a clue with no value.
+        """
+
+        pool = load_fixture(fixture) if fixture else generate_clues(seed, pool_size, null_rate)
+
+        by_difficulty = defaultdict(list)
+        for clue in pool:
+            by_difficulty[None if clue.get("value") is None else value_to_difficulty(clue["value"])].append(clue)
+
+        with self._lock:
+            self.seed = seed
+            self.latency = latency
+            self.jitter = jitter
+            self.error_rate = error_rate
+            self.error_status = error_status
+            self.null_rate = null_rate
+            self.weights = {diff: weight for diff, weight in (weights or {}).items() if by_difficulty.get(diff)}
+            if weights and not self.weights:
+                raise ValueError("None of the weighted difficulties are in the pool")
+            self.pool = pool
+            self._by_difficulty = by_difficulty
+            self.requests = 0
+            self.errors = 0
+            self.clues_served = 0
+
+    def _pick(self, rng):
+        if not self.weights:
+            return rng.choice(self.pool)
+        if self._by_difficulty.get(None) and rng.random() < self.null_rate:
+            return rng.choice(self._by_difficulty[None])
+        diff = rng.choices(list(self.weights), weights=list(self.weights.values()))[0]
+        return rng.choice(self._by_difficulty[diff])
+
+    def random_clues(self, count):
+        """What the next /api/random request gets - (status, clues)"""
+
+        with self._lock:
+            self.requests += 1
+            #Seeded by request number, so the same requests in the same order always get the same answers
+            rng = random.Random(f"{self.seed}:{self.requests}")
+            delay = self.latency + rng.uniform(0, self.jitter)
+
+            if rng.random() < self.error_rate:
+                self.errors += 1
+                status, clues = self.error_status, None
+            else:
+                clues = [self._pick(rng) for _ in range(max(1, min(count, MAX_COUNT)))]
+                self.clues_served += len(clues)
+                status = 200
+
+        #Outside the lock, so slow requests don't hold each other up
+        if delay:
+            time.sleep(delay)
+
+        return status, clues
+
+    def wsgi_app(self, environ, start_response):
+        request = Request(environ)
+
+        if request.path.rstrip("/") != "/api/random":
+            return Response("Not found", status=404)(environ, start_response)
+
+        status, clues = self.random_clues(request.args.get("count", 1, type=int))
+        if clues is None:
+            resp = Response(json.dumps({"error": "injected failure"}), status=status, mimetype="application/json")
+        else:
+            resp = Response(json.dumps(clues), mimetype="application/json")
+        return resp(environ, start_response)
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        """Start serving in a background thread - port 0 picks a free port"""
+
+        if self._server is None:
+            self._server = make_server(self.host, self.port, self.wsgi_app, threaded=True)
+            self.port = self._server.server_port
+            self._thread = threading.Thread(target=self._server.serve_forever, name="fake-jservice", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+_shared = None
+_shared_lock = threading.Lock()
+
+def shared_server(**settings):
+    """The process's own fake JService, started the first time it's asked for and (re)configured with the settings"""
+
+    global _shared
+
+    with _shared_lock:
+        if _shared is None:
+            _shared = FakeJService(**settings).start()
+        else:
+            _shared.configure(**settings)
+        return _shared
+
+def parse_weights(text):
+    """"5=3,1=1" -> {5: 3.0, 1: 1.0}"""
+
+    weights = {}
+    for part in filter(None, text.split(",")):
+        diff, weight = part.split("=")
+        weights[int(diff)] = float(weight)
+    return weights
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake JService.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--pool-size", type=int, default=5000, help="Clues to generate (ignored with --fixture)")
+    parser.add_argument("--fixture", help="JSON array or NDJSON file of JService clues to serve instead")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many more seconds at random")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--null-rate", type=float, default=0.05, help="Fraction of clues with no value")
+    parser.add_argument("--weights", type=parse_weights, default=None, help="Difficulty weights, e.g. 5=3,1=1")
+    args = parser.parse_args()
+
+    server = FakeJService(host=args.host, port=args.port, seed=args.seed, pool_size=args.pool_size, fixture=args.fixture,
+                          latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, error_status=args.error_status,
+                          null_rate=args.null_rate, weights=args.weights)
+    print(f"Fake JService on {server.url} - {len(server.pool)} clues")
+    make_server(args.host, args.port, server.wsgi_app, threaded=True).serve_forever()
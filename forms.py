@@ -1,5 +1,6 @@
 from wtforms import SelectField, StringField, SelectMultipleField, RadioField, PasswordField, widgets
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired, FileAllowed
 from wtforms.validators import InputRequired, DataRequired, Length, Optional
 
 class MultiCheckboxField(SelectMultipleField):
@@ -47,6 +48,13 @@ class AddQuestion(FlaskForm):
     answer = StringField("Answer",  validators=[InputRequired(message="Answer can't be blank")])
     difficulty = RadioField("Difficulty", choices=[(1,1),(2,2),(3,3),(4,4),(5,5)], coerce=int, validators=[DataRequired(message="Select a difficulty")])
 
+class ImportQuestions(FlaskForm):
+    """Form for importing a file of questions"""
+
+    file = FileField("CSV or JSON File", validators=[FileRequired(message="Choose a file to import"), FileAllowed(["csv", "json", "ndjson", "jsonl"], message="Upload a .csv, .json or .ndjson file")])
+    quiz = SelectField("Add Questions To Quiz:", coerce=int)
+    round = SelectField("Add Questions To Round:", choices=[(1,1),(2,2),(3,3),(4,4),(5,5)], coerce=int)
+
 class NewUserForm(FlaskForm):
     """Form for adding a user"""
     
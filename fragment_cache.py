@@ -0,0 +1,193 @@
+"""Cache of rendered page fragments.
+
+The quiz page's question list is by far the most expensive part of it to
+render, and quizzes hardly change once they're written, so the rendered list
+is cached per quiz. Each entry is tagged with the version it was rendered
+from (the quiz's revision - see http_cache.page_etag), and is only used while
+that's still the current version, so a stale entry can never be served. Routes
+that change a quiz's questions also invalidate its entry, so the space is
+freed straight away.
+
+Two backends: MemoryBackend keeps fragments in this process, evicting the
+least recently used once they add up to more than a set number of bytes;
+DiskBackend keeps them as files in a directory, which every worker on the
+machine can share.
+"""
+import os
+import stat
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+class MemoryBackend:
+    """In-process LRU of fragments, bounded by their total size in bytes"""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry[:3]
+        return None
+
+    def set(self, key, version, html, render_ms):
+        size = len(html.encode("utf-8"))
+        #Not worth evicting everything else for
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (version, html, render_ms, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[3]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "memory", "entries": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+class DiskBackend:
+    """Fragments as files in a directory, shared by every process that points at it.
+
+    There's one file per key, overwritten when the fragment is re-rendered and
+    removed when it's invalidated, so the directory stays about as big as the
+    set of quizzes being viewed.
+
+    Fragments are served as HTML without being escaped again, so the directory
+    must be the app's alone: it's made private to the user the app runs as, and
+    one that's anyone else's, or that others can write to, is refused.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        info = os.lstat(directory)
+        if not stat.S_ISDIR(info.st_mode):
+            raise RuntimeError(f"Fragment cache directory {directory} isn't a directory")
+        if hasattr(os, "geteuid") and info.st_uid != os.geteuid():
+            raise RuntimeError(f"Fragment cache directory {directory} belongs to another user")
+        if info.st_mode & 0o022:
+            raise RuntimeError(f"Fragment cache directory {directory} can be written to by other users")
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.html")
+
+    def get(self, key):
+        try:
+            with open(self._path(key), encoding="utf-8") as f:
+                version = f.readline().rstrip("\n")
+                render_ms = float(f.readline())
+                return version, f.read(), render_ms
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set(self, key, version, html, render_ms):
+        #Write to a temporary file and rename it into place, so readers never see half a fragment
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(f"{version}\n{render_ms}\n{html}")
+        os.replace(tmp_path, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".html"):
+                self.delete(name[:-len(".html")])
+
+    def stats(self):
+        sizes = [entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(".html")]
+        return {"backend": "disk", "entries": len(sizes), "bytes": sum(sizes), "directory": self.directory}
+
+class FragmentCache:
+    """Front end to a backend, counting hits and how much rendering they saved"""
+
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+        self._lock = threading.Lock()
+        self._reset_counts()
+
+    def _reset_counts(self):
+        self.hits = 0
+        self.misses = 0
+        self.render_ms = 0.0
+        self.saved_ms = 0.0
+
+    def configure(self, backend):
+        #Only this process's counts start again - a disk backend's entries are shared with the other workers,
+        #and are still good (entries for old versions are never served), so a worker starting mustn't wipe them
+        self.backend = backend
+        with self._lock:
+            self._reset_counts()
+
+    def get_or_render(self, key, version, render):
+        """The fragment for `key` at `version` - from the cache if possible, otherwise render()ed and cached"""
+
+        entry = self.backend.get(key)
+        if entry is not None and entry[0] == version:
+            with self._lock:
+                self.hits += 1
+                self.saved_ms += entry[2]
+            return entry[1]
+
+        start = time.perf_counter()
+        html = render()
+        render_ms = (time.perf_counter() - start) * 1000
+
+        self.backend.set(key, version, html, render_ms)
+        with self._lock:
+            self.misses += 1
+            self.render_ms += render_ms
+
+        return html
+
+    def invalidate(self, key):
+        self.backend.delete(key)
+
+    def clear(self):
+        self.backend.clear()
+        with self._lock:
+            self._reset_counts()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {"hits": self.hits, "misses": self.misses,
+                     "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                     "render_ms": round(self.render_ms, 1), "saved_ms": round(self.saved_ms, 1)}
+        stats.update(self.backend.stats())
+        return stats
+
+def make_backend(app):
+    """The backend named by FRAGMENT_CACHE ("memory" or "disk")"""
+
+    if app.config['FRAGMENT_CACHE'] == "disk":
+        return DiskBackend(app.config['FRAGMENT_CACHE_DIR'] or os.path.join(app.instance_path, "fragments"))
+    return MemoryBackend(app.config['FRAGMENT_CACHE_BYTES'])
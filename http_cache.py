@@ -0,0 +1,86 @@
+"""HTTP caching helpers.
+
+Pages built from data that rarely changes (a quiz, say) carry an ETag made
+from the data's revision, and a request that comes back with a matching
+If-None-Match gets a 304 before any of the page is rendered. Static files are
+linked with a fingerprint of their contents (see static_url), so browsers can
+keep them for a long time without them going stale after a deploy.
+"""
+import hashlib
+import os
+
+from flask import current_app, request, session, Response
+
+#Fingerprints of static files by filename, and of the templates and static files together - they only change on
+#a deploy, which restarts the process
+_static_fingerprints = {}
+_assets_fingerprint = None
+
+def _fingerprint(*paths):
+    digest = hashlib.md5()
+    for path in paths:
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+def static_url(filename):
+    """URL for a static file, with a fingerprint of its contents so it can be cached indefinitely"""
+
+    fingerprint = _static_fingerprints.get(filename)
+    if fingerprint is None:
+        fingerprint = _static_fingerprints[filename] = _fingerprint(os.path.join(current_app.static_folder, filename))
+
+    return f"{current_app.static_url_path}/{filename}?v={fingerprint}"
+
+def _asset_paths():
+    """Every template and static file, in a fixed order"""
+
+    paths = []
+    for folder in (os.path.join(current_app.root_path, current_app.template_folder), current_app.static_folder):
+        for directory, subdirectories, filenames in os.walk(folder):
+            subdirectories.sort()
+            paths += [os.path.join(directory, filename) for filename in sorted(filenames)]
+    return paths
+
+def page_etag(*parts):
+    """Strong ETag for a page made from the given parts (e.g. "quiz", id, revision) and the assets it's made with.
+
+    Those are the templates that render it and the static files it links to -
+    a page cached from before a deploy links to the old static_url()s.
+    """
+
+    global _assets_fingerprint
+
+    if _assets_fingerprint is None:
+        _assets_fingerprint = _fingerprint(*_asset_paths())
+
+    return "-".join(str(part) for part in parts + (_assets_fingerprint,))
+
+def set_validators(resp, etag, last_modified=None):
+    """Add the ETag and Last-Modified headers to the response"""
+
+    resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    #private - the pages are for logged in users only. no-cache - the browser checks back every time, but it's cheap
+    resp.headers["Cache-Control"] = "private, no-cache"
+    return resp
+
+def pending_flashes():
+    """Whether there are messages waiting to be flashed on the next page rendered"""
+
+    return bool(session.get("_flashes"))
+
+def not_modified(etag, last_modified=None):
+    """A 304 response if the browser's copy of the page is current, otherwise None.
+
+    Call it before doing the work of rendering the page. Messages waiting to
+    be flashed need a fresh page to show on, so they always get None.
+    """
+
+    if pending_flashes():
+        return None
+
+    resp = set_validators(Response(), etag, last_modified)
+    resp.make_conditional(request)
+    return resp if resp.status_code == 304 else None
@@ -0,0 +1,109 @@
+"""Bulk import of user-written questions from an uploaded CSV or (ND)JSON file.
+
+Each row needs question, answer and difficulty (1-5), and may have a
+category. Rows are checked with the same rules as the create question form,
+and the ones that pass are written in batches, all in one transaction. Rows
+can also be added to one of the user's quizzes: to the round given in the
+form, or in a row's own round column (so a quiz's CSV export can be imported
+straight back in).
+
+The upload is read a record at a time - Werkzeug spools large uploads to
+disk - so memory use doesn't depend on the size of the file.
+"""
+import codecs
+from collections import namedtuple
+
+from werkzeug.datastructures import MultiDict
+
+from forms import AddQuestion
+from load_bank import iter_file_records
+from models import db, Question, Quiz, QuizQuestion
+
+#Only this many row errors are kept for the report - the rest are just counted
+MAX_REPORTED_ERRORS = 500
+
+ImportReport = namedtuple("ImportReport", ["imported", "error_count", "errors", "file_error"])
+
+def _row_errors(form, quiz, round_no):
+    """Messages for everything wrong with the row in form (already process()ed)"""
+
+    messages = [] if form.validate() else [error for errors in form.errors.values() for error in errors]
+
+    if quiz is not None and round_no is not None:
+        try:
+            round_no = int(round_no)
+        except (TypeError, ValueError):
+            round_no = None
+        if round_no is None or not 1 <= round_no <= quiz.rounds:
+            messages.append(f"Round must be between 1 and {quiz.rounds}")
+
+    return messages
+
+def import_questions(file, filename, user_id, quiz=None, round_no=None, batch_size=1000):
+    """Import the questions in the (binary) file for the user, optionally adding them to the quiz.
+
+    round_no is the quiz round to add rows to when they don't name one. Returns
+    an ImportReport; if the file can't be read at all, nothing is imported and
+    file_error says why.
+    """
+
+    #A codecs reader rather than io.TextIOWrapper, which older Pythons can't put round Werkzeug's spooled upload files
+    text = codecs.getreader("utf-8-sig")(file)
+    #The same checks as the create question form - CSRF aside, as there's no token per row
+    form = AddQuestion(formdata=None, meta={"csrf": False})
+
+    imported = 0
+    error_count = 0
+    errors = []
+    batch = []
+
+    def flush():
+        #Once flushed, nothing refers to the batch's objects, so the session lets them go and memory stays flat
+        db.session.add_all(batch)
+        db.session.flush()
+        batch.clear()
+
+    row_no = 0
+    try:
+        for row_no, record in enumerate(iter_file_records(text, filename), start=1):
+            if not isinstance(record, dict):
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append((row_no, ["Not a question - each one should be an object with question, answer and difficulty"]))
+                continue
+
+            record = {str(key).strip().lower(): "" if val is None else str(val).strip() for key, val in record.items() if key is not None}
+            form.process(MultiDict(record))
+            row_round = record.get("round") or round_no
+
+            messages = _row_errors(form, quiz, row_round)
+            if messages:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append((row_no, messages))
+                continue
+
+            question = Question(question=form.question.data,
+                                answer=form.answer.data,
+                                difficulty=form.difficulty.data,
+                                category=record.get("category") or None,
+                                user_id=user_id)
+            batch.append(question)
+            if quiz is not None and row_round is not None:
+                batch.append(QuizQuestion(quiz_id=quiz.id, question=question, round=int(row_round)))
+
+            imported += 1
+            if len(batch) >= batch_size:
+                flush()
+
+        flush()
+
+    except (ValueError, UnicodeDecodeError) as exc:
+        db.session.rollback()
+        return ImportReport(0, error_count, errors, f"Couldn't read the file after row {row_no}: {exc}")
+
+    if quiz is not None and imported:
+        Quiz.touch([quiz.id])
+    db.session.commit()
+
+    return ImportReport(imported, error_count, errors, None)
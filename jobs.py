@@ -0,0 +1,191 @@
+"""Background quiz generation.
+
+Creating a quiz can mean several round trips to JService, so rather than tie up
+a web worker for all of them, /quizzes/create adds a QuizJob row and redirects to
+a status page. A small pool of threads in each process claims queued jobs from
+the table and builds the quizzes.
+
+Jobs live in the database, so they outlast the process that queued them: a job
+that was running when its worker died is picked up again once its lease runs
+out. Jobs that fail because JService couldn't supply questions are retried with
+backoff, up to a limit.
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_
+
+from models import db, Quiz, Question, QuizQuestion, QuizJob
+from tools import get_rounds_data, QuestionFetchError
+
+#Only one process-wide pool of workers
+_workers = []
+_workers_lock = threading.Lock()
+#SQLite can't SKIP LOCKED, so at least keep this process's workers from claiming the same job
+_claim_lock = threading.Lock()
+
+def enqueue_quiz_job(user_id, params):
+    """Queue a quiz to be generated - params is the create quiz form data"""
+
+    job = QuizJob(user_id=user_id, params=params)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def build_quiz(user_id, params, timings):
+    """Fetch the questions for a quiz and write it, along with its questions, in one transaction"""
+
+    start = time.monotonic()
+    #Nothing the user already has in their library
+    rounds_data = get_rounds_data(params["difficulty_levels"][:params["rounds"]], params["qs_per_round"], user_id,
+                                  in_use=Question.bank_ids_in_library(user_id))
+    timings["fetch"] = round(time.monotonic() - start, 3)
+
+    start = time.monotonic()
+    quiz = Quiz(name=params["name"],
+                description=params["description"],
+                rounds=params["rounds"],
+                user_id=user_id)
+    for round_no, quiz_data in enumerate(rounds_data, start=1):
+        for quiz_datum in quiz_data:
+            quiz.questions.append(QuizQuestion(question=quiz_datum, round=round_no))
+
+    #The flush batches each table's rows into a single INSERT, with the new ids coming back from the database
+    db.session.add(quiz)
+    db.session.flush()
+    timings["persist"] = round(time.monotonic() - start, 3)
+
+    return quiz
+
+def runnable_jobs(now):
+    """Jobs that are due to run, oldest first - queued ones, and running ones whose worker's lease has run out"""
+
+    query = (QuizJob.query
+             .filter(or_(and_(QuizJob.status == "queued", QuizJob.run_after <= now),
+                         and_(QuizJob.status == "running", QuizJob.locked_until < now)))
+             .order_by(QuizJob.id))
+
+    if db.engine.dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    return query
+
+def claim_job(app):
+    """Mark the next runnable job as running and return it - None if there's nothing to do"""
+
+    now = datetime.utcnow()
+
+    with _claim_lock:
+        job = runnable_jobs(now).first()
+        if job is None:
+            db.session.rollback()
+            return None
+
+        #A job whose worker keeps dying mid-run shouldn't be retried forever
+        if job.status == "running" and job.attempts >= app.config.get("QUIZ_JOB_MAX_ATTEMPTS", 3):
+            job.status = "failed"
+            job.error = "Worker stopped while generating the quiz"
+            job.locked_until = None
+            db.session.commit()
+            return None
+
+        job.status = "running"
+        job.attempts += 1
+        job.locked_until = now + timedelta(seconds=app.config.get("QUIZ_JOB_LEASE", 120))
+        db.session.commit()
+
+    return job
+
+def _failed_attempt(job_id, exc, timings, start):
+    """Throw away the attempt's work and reload its job, with the error recorded"""
+
+    db.session.rollback()
+    job = QuizJob.query.get(job_id)
+    timings["total"] = round(time.monotonic() - start, 3)
+    job.error = str(exc) or type(exc).__name__
+    return job
+
+def run_job(app, job):
+    """Generate the quiz for a claimed job, rescheduling it if JService lets us down"""
+
+    job_id = job.id
+    timings = {"queued": round((datetime.utcnow() - job.created_at).total_seconds(), 3)}
+    start = time.monotonic()
+
+    try:
+        quiz = build_quiz(job.user_id, job.params, timings)
+        timings["total"] = round(time.monotonic() - start, 3)
+
+        job.quiz_id = quiz.id
+        job.status = "done"
+        job.error = None
+        job.timings = timings
+        job.locked_until = None
+        db.session.commit()
+        return job
+
+    except QuestionFetchError as exc:
+        job = _failed_attempt(job_id, exc, timings, start)
+
+        if job.attempts >= app.config.get("QUIZ_JOB_MAX_ATTEMPTS", 3):
+            job.status = "failed"
+        else:
+            #Back off before the next attempt in case JService is having a bad moment
+            job.status = "queued"
+            job.run_after = datetime.utcnow() + timedelta(seconds=app.config.get("QUIZ_JOB_RETRY_DELAY", 5) * 2 ** (job.attempts - 1))
+
+    except Exception as exc:
+        #Anything else is a bug or a database error, which another attempt is unlikely to get past - fail the job
+        #now rather than leave it "running" until its lease runs out (or for good, when it was run in the request)
+        app.logger.exception("Quiz job %s failed", job_id)
+        job = _failed_attempt(job_id, exc, timings, start)
+        job.status = "failed"
+
+    job.timings = timings
+    job.locked_until = None
+    db.session.commit()
+    return job
+
+def run_job_now(app, job):
+    """Run a freshly queued job in this thread, retrying straight away rather than waiting for a worker"""
+
+    while job.status == "queued":
+        job.status = "running"
+        job.attempts += 1
+        db.session.commit()
+        job = run_job(app, job)
+
+    return job
+
+def _work(app):
+    """Worker thread loop - run jobs as they come in"""
+
+    with app.app_context():
+        while True:
+            try:
+                job = claim_job(app)
+                if job is None:
+                    time.sleep(app.config.get("QUIZ_JOB_POLL_INTERVAL", 1))
+                else:
+                    run_job(app, job)
+
+            except Exception:
+                #Don't let one bad job (or a database blip) kill the worker - its lease will run out and it'll be retried
+                app.logger.exception("Quiz job worker error")
+                db.session.rollback()
+                time.sleep(app.config.get("QUIZ_JOB_POLL_INTERVAL", 1))
+
+            finally:
+                db.session.remove()
+
+def start_workers(app):
+    """Start this process's job workers, if they aren't already running"""
+
+    with _workers_lock:
+        if _workers:
+            return
+
+        for n in range(app.config.get("QUIZ_JOB_WORKERS", 2)):
+            worker = threading.Thread(target=_work, args=(app,), name=f"quiz-job-{n}", daemon=True)
+            worker.start()
+            _workers.append(worker)
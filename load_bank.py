@@ -0,0 +1,186 @@
+"""Bulk load an offline Jeopardy! clue dump into the question bank.
+
+Usage:
+
+    python load_bank.py clues.json [--batch-size 5000] [--restart]
+
+Accepts a JSON array or newline-delimited JSON of JService-style clues
+({"id", "question", "answer", "value", "category": {"title"}}) or a CSV
+with question/answer/value/category columns (e.g. the Kaggle "JEOPARDY_CSV"
+dump - "$1,200" style values are fine). The file is streamed record by
+record and written in batches, so memory use doesn't depend on its size.
+
+Progress is committed alongside each batch, so an interrupted load can be
+re-run with the same command and will resume where it stopped.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from models import db, BankQuestion, BankLoad
+from tools import value_to_difficulty
+
+READ_SIZE = 1 << 16
+
+def iter_json_array(file):
+    """Yields the objects in a JSON array one at a time without reading the whole file"""
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    started = False
+
+    for chunk in iter(lambda: file.read(READ_SIZE), ""):
+        buffer += chunk
+        pos = 0
+
+        while True:
+            #Skip whitespace, the opening bracket and separating commas
+            while pos < len(buffer) and (buffer[pos].isspace() or buffer[pos] == "," or (buffer[pos] == "[" and not started)):
+                started = started or buffer[pos] == "["
+                pos += 1
+
+            if pos < len(buffer) and buffer[pos] == "]":
+                return
+
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                #Record is split across chunks - read some more
+                break
+
+            yield record
+
+        buffer = buffer[pos:]
+
+    if buffer.strip():
+        raise ValueError(f"Unexpected end of file in a JSON array: {buffer[:40]!r}")
+
+def iter_file_records(file, name):
+    """Yields the raw records in an open (text, seekable) file - CSV if name ends .csv, otherwise a JSON array or NDJSON"""
+
+    if name.lower().endswith(".csv"):
+        yield from csv.DictReader(file)
+        return
+
+    first = file.read(1)
+    while first.isspace():
+        first = file.read(1)
+    file.seek(0)
+
+    if first == "[":
+        yield from iter_json_array(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def iter_records(path):
+    """Yields the raw records in a clue dump, working out its format from the file"""
+
+    with open(path, newline="", encoding="utf-8") as file:
+        yield from iter_file_records(file, path)
+
+def normalize_record(record):
+    """Turns a dump record into a question bank row - None if it has no value or is missing text"""
+
+    record = {key.strip().lower(): val for key, val in record.items()}
+
+    value = record.get("value")
+    if isinstance(value, str):
+        value = value.replace("$", "").replace(",", "").strip()
+        if value.lower() in ("", "none", "null"):
+            value = None
+    if value is None:
+        return None
+
+    category = record.get("category")
+    if isinstance(category, dict):
+        category = category.get("title")
+
+    question = record.get("question")
+    answer = record.get("answer")
+    if not question or not answer:
+        return None
+
+    jservice_id = record.get("id")
+
+    return {"jservice_id": int(jservice_id) if jservice_id not in (None, "") else None,
+            "question": question,
+            "answer": answer,
+            "category": category,
+            "difficulty": value_to_difficulty(value)}
+
+def load_bank(path, batch_size=5000, restart=False, out=sys.stdout):
+    """Streams the dump at `path` into the question bank, resuming any earlier partial load"""
+
+    source = os.path.abspath(path)
+    progress = BankLoad.query.get(source)
+
+    if progress is None or restart:
+        progress = progress or BankLoad(source=source)
+        progress.records_done = 0
+        progress.rows_loaded = 0
+        progress.finished = False
+        db.session.add(progress)
+        db.session.commit()
+    elif progress.finished:
+        print(f"{path} already loaded ({progress.rows_loaded} rows) - use --restart to load it again", file=out)
+        return progress.rows_loaded
+
+    skip = progress.records_done
+    if skip:
+        print(f"Resuming {path} after {skip} records", file=out)
+
+    start = time.monotonic()
+    loaded_this_run = 0
+    records_done = skip
+    batch = []
+
+    def flush():
+        nonlocal loaded_this_run
+        BankQuestion.bank(batch)
+        progress.records_done = records_done
+        progress.rows_loaded += len(batch)
+        db.session.commit()
+
+        loaded_this_run += len(batch)
+        elapsed = time.monotonic() - start
+        print(f"{records_done} records read, {progress.rows_loaded} rows loaded ({loaded_this_run / max(elapsed, 1e-6):.0f} rows/sec)", file=out)
+        batch.clear()
+
+    for records_done, record in enumerate(iter_records(path), start=1):
+        if records_done <= skip:
+            continue
+
+        row = normalize_record(record)
+        if row is not None:
+            batch.append(row)
+
+        if len(batch) >= batch_size:
+            flush()
+
+    flush()
+    progress.finished = True
+    db.session.commit()
+
+    elapsed = time.monotonic() - start
+    print(f"Done: {loaded_this_run} rows in {elapsed:.1f}s ({loaded_this_run / max(elapsed, 1e-6):.0f} rows/sec)", file=out)
+    return progress.rows_loaded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load an offline Jeopardy! clue dump into the question bank")
+    parser.add_argument("path", help="JSON, newline-delimited JSON or CSV clue dump")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows per INSERT batch")
+    parser.add_argument("--restart", action="store_true", help="ignore any saved progress and load from the start")
+    args = parser.parse_args()
+
+    from app import create_app
+
+    with create_app().app_context():
+        #Statement logging would swamp the progress output
+        db.engine.echo = False
+        load_bank(args.path, batch_size=args.batch_size, restart=args.restart)
@@ -0,0 +1,222 @@
+"""Request metrics - served in Prometheus' text format on /metrics, and per request as a Server-Timing header.
+
+For every request this records how long it took, how many SQL statements it
+ran and how long they took (from SQLAlchemy's engine events), and how many
+requests it made to JService and how long it waited for them. Those go into
+histograms labelled by endpoint, and the request's own figures go back to
+the browser as Server-Timing, where the dev tools show them alongside the
+network timings.
+
+Metrics are per process, like the caches - Prometheus scrapes each worker
+and adds them up. Streamed responses (the exports) are timed up to the point
+they start streaming.
+"""
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+#Upper bounds of the histogram buckets - seconds, and counts of things per request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """A count that only goes up, per combination of label values"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        with self._lock:
+            return [f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}" for labels, value in sorted(self._values.items())]
+
+class Histogram:
+    """Observations counted into buckets, with their sum - per combination of label values"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            #labels -> [count in each bucket (not cumulative), sum, count]
+            self._values = {}
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0, 0]
+            for n, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][n] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            return entry[2] if entry else 0
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for labels, (buckets, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, in_bucket in zip(self.buckets, buckets):
+                    cumulative += in_bucket
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', '+Inf')])} {count}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(float(total))}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+request_seconds = Histogram("quizzr_request_duration_seconds", "Time to handle a request", ["endpoint", "method", "status"])
+request_sql_statements = Histogram("quizzr_request_sql_statements", "SQL statements run per request", ["endpoint"], COUNT_BUCKETS)
+request_sql_seconds = Histogram("quizzr_request_sql_duration_seconds", "Time per request spent running SQL", ["endpoint"])
+question_fetch_seconds = Histogram("quizzr_question_fetch_duration_seconds", "Time spent waiting for JService to supply a quiz's (or a replacement's) questions")
+jservice_requests = Counter("quizzr_jservice_requests_total", "Requests made to JService, by outcome", ["outcome"])
+jservice_request_seconds = Histogram("quizzr_jservice_request_duration_seconds", "Time for each request to JService")
+jservice_clues_fetched = Counter("quizzr_jservice_clues_fetched_total", "Clues that came back from JService")
+jservice_clues_kept = Counter("quizzr_jservice_clues_kept_total", "Clues from JService that went into a quiz - the rest only go in the bank")
+
+METRICS = [request_seconds, request_sql_statements, request_sql_seconds, question_fetch_seconds, jservice_requests, jservice_request_seconds,
+           jservice_clues_fetched, jservice_clues_kept]
+
+def clear():
+    """Start every metric again from zero"""
+
+    for metric in METRICS:
+        metric.clear()
+
+def render(extra=()):
+    """Every metric in Prometheus' text format - extra is (name, type, help, value) for figures kept elsewhere, such as the caches'"""
+
+    lines = []
+    for metric in METRICS:
+        lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"] + metric.render()
+    for name, kind, help, value in extra:
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {_number(value)}"]
+    return "\n".join(lines) + "\n"
+
+class RequestTimings:
+    """What one request has done so far"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.fetches = 0
+        self.fetch_requests = 0
+        self.fetch_seconds = 0.0
+
+#The request being handled by this thread, if any. SQL run by other threads (e.g. background jobs) isn't any request's
+_local = threading.local()
+
+def current():
+    return getattr(_local, "timings", None)
+
+def start_request():
+    _local.timings = RequestTimings()
+
+def end_request():
+    _local.timings = None
+
+def finish_request(resp, endpoint, method):
+    """Record the request's metrics, and add its Server-Timing header to the response"""
+
+    timings = current()
+    if timings is None:
+        return resp
+
+    seconds = time.perf_counter() - timings.start
+    request_seconds.observe(seconds, endpoint, method, str(resp.status_code))
+    request_sql_statements.observe(timings.sql_statements, endpoint)
+    request_sql_seconds.observe(timings.sql_seconds, endpoint)
+
+    server_timing = [f"app;dur={seconds * 1000:.1f}", f'db;dur={timings.sql_seconds * 1000:.1f};desc="{timings.sql_statements} queries"']
+    if timings.fetches:
+        server_timing.append(f'jservice;dur={timings.fetch_seconds * 1000:.1f};desc="{timings.fetch_requests} requests"')
+    resp.headers["Server-Timing"] = ", ".join(server_timing)
+
+    return resp
+
+def record_fetch(requests, seconds):
+    """Note that the current request (if any) waited `seconds` for `requests` JService requests to supply its questions"""
+
+    question_fetch_seconds.observe(seconds)
+    timings = current()
+    if timings is not None:
+        timings.fetches += 1
+        timings.fetch_requests += requests
+        timings.fetch_seconds += seconds
+
+def record_jservice_request(seconds, outcome):
+    """Count one request to JService - outcome is "ok", "retry" (a 5xx or connection error) or "error" """
+
+    jservice_requests.inc(outcome)
+    jservice_request_seconds.observe(seconds)
+
+def record_clues(fetched, kept):
+    """Count the clues one fetch got from JService, and how many of them it kept for the quiz"""
+
+    jservice_clues_fetched.inc(amount=fetched)
+    jservice_clues_kept.inc(amount=kept)
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if current() is not None:
+        context._metrics_start = time.perf_counter()
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = current()
+    start = getattr(context, "_metrics_start", None)
+    if timings is not None and start is not None:
+        timings.sql_statements += 1
+        timings.sql_seconds += time.perf_counter() - start
+
+def connect_metrics(app):
+    """Time the SQL of every engine - every app has its own, so it's done on the Engine class, once"""
+
+    if not event.contains(Engine, "before_cursor_execute", _before_execute):
+        event.listen(Engine, "before_cursor_execute", _before_execute)
+        event.listen(Engine, "after_cursor_execute", _after_execute)
@@ -0,0 +1,306 @@
+"""Versioned schema migrations.
+
+The schema used to be made by db.create_all() whenever app.py was imported.
+Now each change to it is a numbered migration below, and
+
+    FLASK_APP=app flask db upgrade
+
+applies whichever ones a database hasn't had yet, recording each in
+schema_migrations as it goes. `flask db current` shows the version a database
+is at.
+
+Migrations describe the tables as they were when the migration was written,
+not via the models, which only ever describe the latest schema. They also only
+create what's missing, so a database that create_all() made before migrations
+existed is brought into line rather than tripping over the tables it already has.
+"""
+import click
+from flask.cli import AppGroup
+from sqlalchemy import (MetaData, Table, Column, Integer, String, Text, Float, Boolean, DateTime, JSON,
+                        ForeignKey, Index, inspect, text)
+
+from models import db
+
+schema_migrations = db.Table("schema_migrations",
+                             db.Column("version", db.Integer, primary_key=True),
+                             db.Column("description", db.Text, nullable=False))
+
+#(version, description, upgrade function) in the order they're applied
+MIGRATIONS = []
+
+def migration(version, description):
+    """Register the decorated function as the migration to `version` - it's passed the connection to upgrade"""
+
+    def register(upgrade):
+        MIGRATIONS.append((version, description, upgrade))
+        return upgrade
+
+    return register
+
+def _reflect(conn, name):
+    return Table(name, MetaData(), autoload_with=conn)
+
+def _create_indexes(conn, table_name, *columns_by_index):
+    """Create any of the (index name, column names) indexes on the table that aren't there yet"""
+
+    table = _reflect(conn, table_name)
+    for name, columns in columns_by_index:
+        Index(name, *[table.c[column] for column in columns]).create(conn, checkfirst=True)
+
+@migration(1, "Users, quizzes and questions")
+def _initial(conn):
+    metadata = MetaData()
+    Table("users", metadata,
+          Column("id", Integer, primary_key=True, autoincrement=True),
+          Column("username", Text, nullable=False, unique=True),
+          Column("password", Text, nullable=False))
+    Table("quizzes", metadata,
+          Column("id", Integer, primary_key=True, autoincrement=True),
+          Column("name", String(50), nullable=False),
+          Column("description", String(250), nullable=True),
+          Column("rounds", Integer, nullable=False),
+          Column("user_id", Integer, ForeignKey("users.id"), nullable=False))
+    Table("questions", metadata,
+          Column("id", Integer, primary_key=True, autoincrement=True),
+          Column("question", Text, nullable=False),
+          Column("answer", Text, nullable=False),
+          Column("difficulty", Integer, nullable=False),
+          Column("category", Text, nullable=True),
+          Column("user_id", Integer, ForeignKey("users.id"), nullable=False))
+    Table("quiz_questions", metadata,
+          Column("quiz_id", Integer, ForeignKey("quizzes.id"), primary_key=True),
+          Column("question_id", Integer, ForeignKey("questions.id"), primary_key=True),
+          Column("round", Integer, nullable=False))
+    metadata.create_all(conn, checkfirst=True)
+
+@migration(2, "Question bank and bulk load progress")
+def _question_bank(conn):
+    metadata = MetaData()
+    Table("bank_questions", metadata,
+          Column("id", Integer, primary_key=True, autoincrement=True),
+          Column("jservice_id", Integer, nullable=True, unique=True),
+          Column("question", Text, nullable=False),
+          Column("answer", Text, nullable=False),
+          Column("difficulty", Integer, nullable=False),
+          Column("category", Text, nullable=True),
+          Column("random_key", Float, nullable=False),
+          Index("ix_bank_questions_difficulty_random_key", "difficulty", "random_key"),
+          Index("ix_bank_questions_category_difficulty_random_key", "category", "difficulty", "random_key"))
+    Table("bank_loads", metadata,
+          Column("source", Text, primary_key=True),
+          Column("records_done", Integer, nullable=False),
+          Column("rows_loaded", Integer, nullable=False),
+          Column("finished", Boolean, nullable=False))
+    metadata.create_all(conn, checkfirst=True)
+
+@migration(3, "Quiz generation jobs")
+def _quiz_jobs(conn):
+    metadata = MetaData()
+    Table("users", metadata, Column("id", Integer, primary_key=True))
+    Table("quizzes", metadata, Column("id", Integer, primary_key=True))
+    Table("quiz_jobs", metadata,
+          Column("id", Integer, primary_key=True, autoincrement=True),
+          Column("user_id", Integer, ForeignKey("users.id"), nullable=False),
+          Column("status", String(10), nullable=False),
+          Column("params", JSON, nullable=False),
+          Column("attempts", Integer, nullable=False),
+          Column("error", Text, nullable=True),
+          Column("timings", JSON, nullable=True),
+          Column("quiz_id", Integer, ForeignKey("quizzes.id", ondelete="SET NULL"), nullable=True),
+          Column("created_at", DateTime, nullable=False),
+          Column("run_after", DateTime, nullable=False),
+          Column("locked_until", DateTime, nullable=True),
+          Index("ix_quiz_jobs_status_run_after", "status", "run_after"))
+    metadata.tables["quiz_jobs"].create(conn, checkfirst=True)
+
+@migration(4, "Keyset pagination indexes on quizzes and questions")
+def _listing_indexes(conn):
+    _create_indexes(conn, "quizzes", ("ix_quizzes_user_id_id", ["user_id", "id"]))
+    _create_indexes(conn, "questions", ("ix_questions_user_id_id", ["user_id", "id"]))
+
+@migration(5, "Full-text search over questions")
+def _question_search(conn):
+    search_text = "coalesce(question, '') || ' ' || coalesce(answer, '') || ' ' || coalesce(category, '')"
+
+    if conn.dialect.name == "postgresql":
+        if "search_vector" not in [column["name"] for column in inspect(conn).get_columns("questions")]:
+            conn.execute(text(f"ALTER TABLE questions ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', {search_text})) STORED"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_questions_search_vector ON questions USING GIN (search_vector)"))
+
+    elif conn.dialect.name == "sqlite":
+        conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(question, answer, category, content='questions', content_rowid='id')"))
+        conn.execute(text("""CREATE TRIGGER IF NOT EXISTS questions_fts_insert AFTER INSERT ON questions BEGIN
+                                 INSERT INTO questions_fts(rowid, question, answer, category) VALUES (new.id, new.question, new.answer, new.category);
+                             END"""))
+        conn.execute(text("""CREATE TRIGGER IF NOT EXISTS questions_fts_delete AFTER DELETE ON questions BEGIN
+                                 INSERT INTO questions_fts(questions_fts, rowid, question, answer, category) VALUES ('delete', old.id, old.question, old.answer, old.category);
+                             END"""))
+        conn.execute(text("""CREATE TRIGGER IF NOT EXISTS questions_fts_update AFTER UPDATE ON questions BEGIN
+                                 INSERT INTO questions_fts(questions_fts, rowid, question, answer, category) VALUES ('delete', old.id, old.question, old.answer, old.category);
+                                 INSERT INTO questions_fts(rowid, question, answer, category) VALUES (new.id, new.question, new.answer, new.category);
+                             END"""))
+        #Index the questions that were there before the triggers
+        conn.execute(text("INSERT INTO questions_fts(questions_fts) VALUES ('rebuild')"))
+
+@migration(6, "Indexes for looking up quiz questions by quiz and round, and by question")
+def _quiz_question_indexes(conn):
+    #The primary key covers quiz_id on its own, but not quiz_id then round (the quiz pages'
+    #ordering), and nothing covers finding the quizzes a question is on
+    _create_indexes(conn, "quiz_questions",
+                    ("ix_quiz_questions_quiz_id_round", ["quiz_id", "round"]),
+                    ("ix_quiz_questions_question_id", ["question_id"]))
+
+@migration(7, "Revisions for quizzes and questions")
+def _revisions(conn):
+    for table in ("quizzes", "questions"):
+        columns = [column["name"] for column in inspect(conn).get_columns(table)]
+        if "revision" not in columns:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN revision INTEGER DEFAULT 1 NOT NULL"))
+        if "updated_at" not in columns:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at TIMESTAMP"))
+
+#(table, column) of each foreign key that cascades deletes from migration 8 on
+CASCADING_KEYS = [("quizzes", "user_id"), ("questions", "user_id"), ("quiz_questions", "quiz_id"),
+                  ("quiz_questions", "question_id"), ("quiz_jobs", "user_id")]
+
+def _rebuild_sqlite_table(conn, name, cascade_columns):
+    """Copy the table into a new one whose foreign keys on cascade_columns cascade deletes - SQLite can't alter a key"""
+
+    metadata = MetaData()
+    old = Table(name, metadata, autoload_with=conn)
+    if all((fk.ondelete or "").upper() == "CASCADE" for fk in old.foreign_keys if fk.parent.name in cascade_columns):
+        return
+
+    indexes = [(index.name, [column.name for column in index.columns], index.unique) for index in old.indexes]
+    columns = ", ".join(column.name for column in old.columns)
+
+    #The new table is made from the reflected one - the tables it refers to stay in the metadata
+    metadata.remove(old)
+    new = old.to_metadata(metadata)
+    for constraint in new.foreign_key_constraints:
+        if constraint.column_keys[0] in cascade_columns:
+            constraint.ondelete = "CASCADE"
+    new.indexes.clear()
+
+    #With legacy_alter_table (and keys not enforced - see upgrade), renaming the old table out of the way
+    #leaves other tables' keys pointing at the name, so they refer to the new table once it's made
+    conn.execute(text("PRAGMA legacy_alter_table = ON"))
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {name}_old"))
+    new.create(conn)
+    conn.execute(text(f"INSERT INTO {name} ({columns}) SELECT {columns} FROM {name}_old"))
+    #Takes the old table's indexes and triggers with it
+    conn.execute(text(f"DROP TABLE {name}_old"))
+    conn.execute(text("PRAGMA legacy_alter_table = OFF"))
+
+    for index_name, index_columns, unique in indexes:
+        Index(index_name, *[new.c[column] for column in index_columns], unique=unique).create(conn)
+
+@migration(8, "Cascading deletes from users to their quizzes, questions and jobs, and from both to quiz_questions")
+def _cascading_deletes(conn):
+    for table in ("quizzes", "questions", "quiz_questions", "quiz_jobs"):
+        columns = [column for key_table, column in CASCADING_KEYS if key_table == table]
+
+        if conn.dialect.name == "sqlite":
+            _rebuild_sqlite_table(conn, table, columns)
+            continue
+
+        for fk in inspect(conn).get_foreign_keys(table):
+            if fk["constrained_columns"][0] in columns and fk["options"].get("ondelete", "").upper() != "CASCADE":
+                conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {fk['name']}, "
+                                  f"ADD CONSTRAINT {fk['name']} FOREIGN KEY ({fk['constrained_columns'][0]}) "
+                                  f"REFERENCES {fk['referred_table']} ({fk['referred_columns'][0]}) ON DELETE CASCADE"))
+
+    #Rebuilding questions on SQLite dropped its search triggers
+    if conn.dialect.name == "sqlite":
+        _question_search(conn)
+
+    #Deleting a user looks up their jobs by user_id
+    _create_indexes(conn, "quiz_jobs", ("ix_quiz_jobs_user_id", ["user_id"]))
+
+@migration(9, "Index the unfinished quiz jobs in the order they're claimed")
+def _unfinished_jobs_index(conn):
+    #claim_job takes the oldest runnable job by id, which the (status, run_after) index couldn't give it
+    unfinished = text("status IN ('queued', 'running')")
+    Index("ix_quiz_jobs_unfinished_id", _reflect(conn, "quiz_jobs").c.id,
+          postgresql_where=unfinished, sqlite_where=unfinished).create(conn, checkfirst=True)
+    conn.execute(text("DROP INDEX IF EXISTS ix_quiz_jobs_status_run_after"))
+
+@migration(10, "Record the bank clue each question was made from")
+def _question_bank_ids(conn):
+    if "bank_id" not in [column["name"] for column in inspect(conn).get_columns("questions")]:
+        conn.execute(text("ALTER TABLE questions ADD COLUMN bank_id INTEGER REFERENCES bank_questions (id) ON DELETE SET NULL"))
+
+def current_version(engine):
+    """The latest migration applied to the database - 0 if none have been"""
+
+    with engine.connect() as conn:
+        if not inspect(conn).has_table("schema_migrations"):
+            return 0
+        return conn.execute(text("SELECT coalesce(max(version), 0) FROM schema_migrations")).scalar()
+
+def upgrade(engine, target=None, out=None):
+    """Apply the migrations the database hasn't had yet, up to `target` (default all of them).
+
+    Each migration runs in its own transaction along with the record of it
+    being applied. Returns the versions applied.
+    """
+
+    applied = []
+
+    with engine.begin() as conn:
+        schema_migrations.create(conn, checkfirst=True)
+
+    for version, description, run in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if target is not None and version > target:
+            break
+
+        with engine.connect() as conn:
+            #SQLite's own recipe for changing a table: keys aren't enforced while it's rebuilt (which can
+            #only be switched outside a transaction), then are checked before it's committed
+            if conn.dialect.name == "sqlite":
+                conn.execute(text("PRAGMA foreign_keys = OFF"))
+            try:
+                with conn.begin():
+                    #Stop two processes upgrading at once from both running the same migration
+                    if conn.dialect.name == "postgresql":
+                        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'))"))
+
+                    if conn.execute(schema_migrations.select().where(schema_migrations.c.version == version)).first():
+                        continue
+
+                    run(conn)
+                    if conn.dialect.name == "sqlite" and conn.execute(text("PRAGMA foreign_key_check")).first():
+                        raise RuntimeError(f"Migration {version} left rows whose foreign keys don't match")
+                    conn.execute(schema_migrations.insert().values(version=version, description=description))
+            finally:
+                if conn.dialect.name == "sqlite":
+                    conn.execute(text("PRAGMA foreign_keys = ON"))
+
+        applied.append(version)
+        if out is not None:
+            print(f"Applied {version}: {description}", file=out)
+
+    return applied
+
+migrate_cli = AppGroup("db", help="Manage the database schema.")
+
+@migrate_cli.command("upgrade")
+@click.option("--target", type=int, default=None, help="Stop after this version.")
+def upgrade_command(target):
+    """Apply any outstanding migrations."""
+
+    applied = upgrade(db.engine, target, out=click.get_text_stream("stdout"))
+    click.echo(f"Database at version {current_version(db.engine)}" + ("" if applied else " - nothing to do"))
+
+@migrate_cli.command("current")
+def current_command():
+    """Show the database's schema version."""
+
+    version = current_version(db.engine)
+    latest = max(m[0] for m in MIGRATIONS)
+    click.echo(f"Database at version {version} of {latest}")
+
+def connect_migrations(app):
+    """Add the `flask db` commands to the app"""
+
+    app.cli.add_command(migrate_cli)
@@ -1,9 +1,47 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, func, literal_column, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import load_only
+from sqlalchemy.pool import Pool
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+#bcrypt is deliberately CPU-heavy, so hashing runs on a small pool - a burst of logins
+#can only keep that many cores busy, rather than every request thread at once
+_password_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bcrypt")
+_password_rounds = 12
+
+def configure_password_hashing(app):
+    """Set the bcrypt work factor and the size of the hashing pool from the app config"""
+
+    global _password_pool, _password_rounds
+
+    _password_rounds = app.config.get("BCRYPT_LOG_ROUNDS", 12)
+    _password_pool.shutdown(wait=False)
+    _password_pool = ThreadPoolExecutor(max_workers=app.config.get("BCRYPT_WORKERS", 2), thread_name_prefix="bcrypt")
+
+def hash_password(password):
+    """bcrypt hash of the password, at the configured work factor"""
+
+    return _password_pool.submit(bcrypt.generate_password_hash, password, _password_rounds).result().decode('UTF-8')
+
+def check_password(pw_hash, password):
+    """Whether the password matches the bcrypt hash"""
+
+    return _password_pool.submit(bcrypt.check_password_hash, pw_hash, password).result()
+
+def needs_rehash(pw_hash):
+    """Whether the hash was made with a different work factor to the configured one"""
+
+    #bcrypt hashes look like $2b$<rounds>$<salt and hash>
+    return int(pw_hash.split("$")[2]) != _password_rounds
+
 class User(db.Model):
     """User"""
 
@@ -13,8 +51,10 @@ class User(db.Model):
     username = db.Column(db.Text, nullable=False, unique=True)
     password = db.Column(db.Text,nullable=False)
 
-    quizzes = db.relationship('Quiz', cascade="all, delete")
-    questions = db.relationship('Question', cascade="all, delete")
+    #The database deletes these itself (ON DELETE CASCADE) - passive_deletes stops them all being loaded just to be deleted
+    quizzes = db.relationship('Quiz', cascade="all, delete", passive_deletes=True)
+    questions = db.relationship('Question', cascade="all, delete", passive_deletes=True)
+    quiz_jobs = db.relationship('QuizJob', cascade="all, delete", passive_deletes=True)
 
     @classmethod
     def signup(cls, username, password):
@@ -24,7 +64,7 @@ class User(db.Model):
         Stolen from the 'Warbler' app
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hash_password(password)
 
         user = User(
             username=username,
@@ -34,6 +74,20 @@ class User(db.Model):
         db.session.add(user)
         return user
 
+    def verify_password(self, password):
+        """Whether password is this user's password.
+
+        If its hash was made with an old work factor it's rehashed with the
+        current one - the caller needs to commit for that to stick.
+        """
+
+        if not check_password(self.password, password):
+            return False
+
+        if needs_rehash(self.password):
+            self.password = hash_password(password)
+        return True
+
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
@@ -49,10 +103,8 @@ class User(db.Model):
 
         user = cls.query.filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user and user.verify_password(password):
+            return user
 
         return False
 
@@ -63,7 +115,7 @@ class User(db.Model):
         user = cls.authenticate(username, password)
 
         if user:
-            hashed_pwd = bcrypt.generate_password_hash(new_password).decode('UTF-8')
+            hashed_pwd = hash_password(new_password)
             user.password = hashed_pwd
             db.session.commit()
             return True
@@ -75,22 +127,77 @@ class Quiz(db.Model):
     """Quiz"""
 
     __tablename__ = "quizzes"
+    __table_args__ = (db.Index("ix_quizzes_user_id_id", "user_id", "id"),)
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50), nullable=False)
     description = db.Column(db.String(250), nullable=True)
     rounds = db.Column(db.Integer, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'),nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
+    #Bumped whenever the quiz's questions change - the quiz page's ETag is made from it
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+
+    questions = db.relationship("QuizQuestion", back_populates="quiz", cascade="all, delete", passive_deletes=True)
 
-    questions = db.relationship("QuizQuestion", back_populates="quiz", cascade="all, delete")
+    @classmethod
+    def touch(cls, quiz_ids):
+        """Bump the revision of the quizzes with the given ids"""
+
+        if quiz_ids:
+            (db.session.query(cls).filter(cls.id.in_(quiz_ids))
+             .update({cls.revision: cls.revision + 1, cls.updated_at: datetime.utcnow()}, synchronize_session=False))
+
+    @classmethod
+    def without_question(cls, user_id, question_id):
+        """The id, name and rounds of each of the user's quizzes that the question isn't on.
+
+        An anti-join (NOT EXISTS) against quiz_questions - its primary key
+        answers each probe, and ix_quizzes_user_id_id finds the user's
+        quizzes - so it only ever reads the user's own quizzes.
+        """
+
+        on_quiz = (db.session.query(QuizQuestion.quiz_id)
+                   .filter(QuizQuestion.quiz_id == cls.id, QuizQuestion.question_id == question_id)
+                   .exists())
+
+        return (db.session.query(cls.id, cls.name, cls.rounds)
+                .filter(cls.user_id == user_id, ~on_quiz)
+                .order_by(cls.id))
+
+    @classmethod
+    def round_rows(cls, quiz_id):
+        """(round, question) for each of the quiz's questions, in round order - the query behind questions_by_round"""
+
+        return (db.session.query(QuizQuestion.round, Question)
+                .join(Question, Question.id == QuizQuestion.question_id)
+                .filter(QuizQuestion.quiz_id == quiz_id)
+                .options(load_only(Question.id, Question.question, Question.answer, Question.difficulty, Question.category))
+                .order_by(QuizQuestion.round, Question.id))
+
+    def questions_by_round(self):
+        """The quiz's questions, as a list for each round.
+
+        One joined query, ordered by round, loading only the columns the quiz
+        pages show - rather than lazy loading each question in turn.
+        """
+
+        rounds = [[] for _ in range(self.rounds)]
+        for round_no, question in self.round_rows(self.id):
+            if 1 <= round_no <= self.rounds:
+                rounds[round_no - 1].append(question)
+
+        return rounds
 
 class QuizQuestion(db.Model):
     """Mapping of a quiz to a question."""
 
     __tablename__ = "quiz_questions"
+    __table_args__ = (db.Index("ix_quiz_questions_quiz_id_round", "quiz_id", "round"),
+                      db.Index("ix_quiz_questions_question_id", "question_id"))
 
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), primary_key=True)
-    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id', ondelete="CASCADE"), primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id', ondelete="CASCADE"), primary_key=True)
     round = db.Column(db.Integer, nullable=False)
     question = db.relationship("Question", back_populates="quizzes")
     quiz = db.relationship("Quiz", back_populates="questions")
@@ -99,18 +206,197 @@ class Question(db.Model):
     """Question"""
 
     __tablename__ = "questions"
+    __table_args__ = (db.Index("ix_questions_user_id_id", "user_id", "id"),)
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     question = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text, nullable=False)
     difficulty = db.Column(db.Integer, nullable=False)
     category = db.Column(db.Text, nullable=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'),nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
+    revision = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+    #The question bank clue it was made from, if any - so the same clue isn't handed out twice
+    bank_id = db.Column(db.Integer, db.ForeignKey('bank_questions.id', ondelete="SET NULL"), nullable=True)
+
+    quizzes = db.relationship("QuizQuestion", back_populates="question", cascade="all, delete", passive_deletes=True)
+
+    @classmethod
+    def bank_ids_in_library(cls, user_id):
+        """The bank clues the user's questions were made from - a query, to use as a subquery"""
+
+        return db.session.query(cls.bank_id).filter(cls.user_id == user_id, cls.bank_id.isnot(None))
+
+    @classmethod
+    def bank_ids_on_quiz(cls, quiz_id):
+        """The bank clues the quiz's questions were made from - a query, to use as a subquery"""
+
+        return (db.session.query(cls.bank_id)
+                .join(QuizQuestion, QuizQuestion.question_id == cls.id)
+                .filter(QuizQuestion.quiz_id == quiz_id, cls.bank_id.isnot(None)))
+
+    def touch(self):
+        """Bump this question's revision, along with that of every quiz it's on - returns those quizzes' ids"""
+
+        self.revision = Question.revision + 1
+        self.updated_at = datetime.utcnow()
+
+        quiz_ids = [quiz_id for quiz_id, in db.session.query(QuizQuestion.quiz_id).filter(QuizQuestion.question_id == self.id)]
+        Quiz.touch(quiz_ids)
+        return quiz_ids
+
+    @classmethod
+    def search(cls, user_id, terms, page=1, per_page=25):
+        """Search a user's questions, answers and categories, best matches first.
+
+        Returns the requested page of matches, and whether there are more after it.
+        Uses the full-text index set up below - a tsvector column with a GIN
+        index on Postgres, or an FTS5 table on SQLite. Either way the index is
+        kept up to date by the database, whichever route writes the question.
+        """
+
+        query = cls.query.filter(cls.user_id == user_id)
+
+        if db.engine.dialect.name == "postgresql":
+            tsquery = func.websearch_to_tsquery("english", terms)
+            vector = literal_column("questions.search_vector")
+            query = (query.filter(vector.op("@@")(tsquery))
+                     .order_by(func.ts_rank(vector, tsquery).desc(), cls.id))
+        else:
+            #Quote each word so FTS5 doesn't try to read the user's input as query syntax
+            match = " ".join('"' + word.replace('"', '""') + '"' for word in terms.split())
+            query = (query.join(db.table("questions_fts", db.column("rowid")), literal_column("questions_fts.rowid") == cls.id)
+                     .filter(text("questions_fts MATCH :match")).params(match=match)
+                     .order_by(text("bm25(questions_fts)"), cls.id))
+
+        questions = query.offset((page - 1) * per_page).limit(per_page + 1).all()
+        return questions[:per_page], len(questions) > per_page
+
+#Full-text index over questions - the database keeps it in step with the table on every insert/update/delete
+_SEARCH_TEXT = "coalesce(question, '') || ' ' || coalesce(answer, '') || ' ' || coalesce(category, '')"
+
+event.listen(Question.__table__, "after_create",
+             DDL(f"ALTER TABLE questions ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (to_tsvector('english', {_SEARCH_TEXT})) STORED").execute_if(dialect="postgresql"))
+event.listen(Question.__table__, "after_create",
+             DDL("CREATE INDEX ix_questions_search_vector ON questions USING GIN (search_vector)").execute_if(dialect="postgresql"))
+
+for _ddl in ("CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts USING fts5(question, answer, category, content='questions', content_rowid='id')",
+             """CREATE TRIGGER questions_fts_insert AFTER INSERT ON questions BEGIN
+                    INSERT INTO questions_fts(rowid, question, answer, category) VALUES (new.id, new.question, new.answer, new.category);
+                END""",
+             """CREATE TRIGGER questions_fts_delete AFTER DELETE ON questions BEGIN
+                    INSERT INTO questions_fts(questions_fts, rowid, question, answer, category) VALUES ('delete', old.id, old.question, old.answer, old.category);
+                END""",
+             """CREATE TRIGGER questions_fts_update AFTER UPDATE ON questions BEGIN
+                    INSERT INTO questions_fts(questions_fts, rowid, question, answer, category) VALUES ('delete', old.id, old.question, old.answer, old.category);
+                    INSERT INTO questions_fts(rowid, question, answer, category) VALUES (new.id, new.question, new.answer, new.category);
+                END"""):
+    event.listen(Question.__table__, "after_create", DDL(_ddl).execute_if(dialect="sqlite"))
+event.listen(Question.__table__, "before_drop", DDL("DROP TABLE IF EXISTS questions_fts").execute_if(dialect="sqlite"))
+
+class QuizJob(db.Model):
+    """Queued request to generate a quiz (see jobs.py).
+
+    params holds the create quiz form data; timings records how long each
+    stage of the most recent attempt took, in seconds.
+    """
+
+    __tablename__ = "quiz_jobs"
+    #Only the few unfinished jobs, in the id order claim_job takes them in - rather than every job there's ever been
+    __table_args__ = (db.Index("ix_quiz_jobs_unfinished_id", "id", postgresql_where=text("status IN ('queued', 'running')"),
+                               sqlite_where=text("status IN ('queued', 'running')")),
+                      db.Index("ix_quiz_jobs_user_id", "user_id"))
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete="CASCADE"), nullable=False)
+    status = db.Column(db.String(10), nullable=False, default="queued")
+    params = db.Column(db.JSON, nullable=False)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    timings = db.Column(db.JSON, nullable=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id', ondelete="SET NULL"), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_until = db.Column(db.DateTime, nullable=True)
+
+class BankQuestion(db.Model):
+    """Clue in the shared question bank - not owned by any user.
+
+    Quizzes are generated by sampling from this table, and only fall back
+    to JService when it can't supply enough clues. random_key is a uniform
+    random number assigned on insert - picking a random pivot and reading
+    forward along the (difficulty, random_key) index gives a random sample
+    without sorting the whole table the way ORDER BY random() would.
+    """
+
+    __tablename__ = "bank_questions"
+    __table_args__ = (db.Index("ix_bank_questions_difficulty_random_key", "difficulty", "random_key"),
+                      db.Index("ix_bank_questions_category_difficulty_random_key", "category", "difficulty", "random_key"))
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    jservice_id = db.Column(db.Integer, nullable=True, unique=True)
+    question = db.Column(db.Text, nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+    difficulty = db.Column(db.Integer, nullable=False)
+    category = db.Column(db.Text, nullable=True)
+    random_key = db.Column(db.Float, nullable=False, default=random.random)
+
+    @classmethod
+    def bank(cls, clues):
+        """Add clues to the bank, skipping any (by JService id) already in it.
+
+        clues is a list of dicts with question/answer/category/difficulty and
+        (optionally) jservice_id keys. Everything goes in as a single
+        executemany in the current transaction.
+        """
+
+        if not clues:
+            return
+
+        rows = [{"jservice_id": clue.get("jservice_id"),
+                 "question": clue["question"],
+                 "answer": clue["answer"],
+                 "category": clue.get("category"),
+                 "difficulty": clue["difficulty"],
+                 "random_key": random.random()} for clue in clues]
+        #Concurrent quiz generations can bank some of the same clues - inserting in id order means they
+        #wait on each other's rows in the same order, rather than deadlocking
+        rows.sort(key=lambda row: (row["jservice_id"] is None, row["jservice_id"] or 0))
+
+        if db.engine.dialect.name == "postgresql":
+            stmt = postgresql.insert(cls.__table__).on_conflict_do_nothing(index_elements=["jservice_id"])
+        else:
+            stmt = cls.__table__.insert().prefix_with("OR IGNORE")
+
+        db.session.execute(stmt, rows)
+
+
+class BankLoad(db.Model):
+    """Progress of a bulk load into the question bank (see load_bank.py).
+
+    records_done is updated in the same transaction as each batch, so an
+    interrupted load can pick up exactly where it left off.
+    """
+
+    __tablename__ = "bank_loads"
+
+    source = db.Column(db.Text, primary_key=True)
+    records_done = db.Column(db.Integer, nullable=False, default=0)
+    rows_loaded = db.Column(db.Integer, nullable=False, default=0)
+    finished = db.Column(db.Boolean, nullable=False, default=False)
+
 
-    quizzes = db.relationship("QuizQuestion", back_populates="question", cascade="all, delete")
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    #SQLite only enforces foreign keys - and so only cascades deletes - when asked to, per connection
+    #(Checked by module name, so Postgres deployments don't import sqlite3 for it)
+    if type(dbapi_connection).__module__.startswith("sqlite3"):
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
 
 def connect_db(app):
     """Connect to database."""
 
     db.app = app
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
+    #Every pool, as every app has its own engine
+    if not event.contains(Pool, "connect", _enable_sqlite_foreign_keys):
+        event.listen(Pool, "connect", _enable_sqlite_foreign_keys)
\ No newline at end of file
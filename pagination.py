@@ -0,0 +1,39 @@
+"""Keyset (id cursor) pagination for the quiz and question listings.
+
+Rather than OFFSET, which makes the database walk past every earlier row, each
+page is fetched with WHERE id > <last id on the previous page> (or id < <first
+id on the next page> going backwards) along a (user_id, id) index, so a page
+costs the same however big the library is.
+"""
+from collections import namedtuple
+
+Page = namedtuple("Page", ["items", "prev_before", "next_after"])
+
+def keyset_page(query, id_column, after=None, before=None, per_page=25):
+    """One page of `query` in id order.
+
+    Pass `after` to get the page following that id, or `before` for the page
+    preceding it. The returned Page has the cursors for the neighbouring pages
+    (None when there isn't one).
+    """
+
+    if before is not None:
+        #Walk backwards from the cursor, then put the page back in order
+        items = query.filter(id_column < before).order_by(id_column.desc()).limit(per_page + 1).all()
+        more_before = len(items) > per_page
+        items = items[:per_page][::-1]
+
+        return Page(items,
+                    items[0].id if more_before else None,
+                    items[-1].id if items else None)
+
+    if after is not None:
+        query = query.filter(id_column > after)
+
+    items = query.order_by(id_column).limit(per_page + 1).all()
+    more_after = len(items) > per_page
+    items = items[:per_page]
+
+    return Page(items,
+                items[0].id if after is not None and items else None,
+                items[-1].id if more_after else None)
@@ -0,0 +1,57 @@
+"""Counting the SQL statements a block of code runs - for the tests' query budgets.
+
+    with count_queries() as queries:
+        client.get("/quizzes/show/1")
+    queries.writes()          #the INSERT/UPDATE/DELETEs
+    print(queries.report())   #every statement, numbered
+
+QueryBudgetMixin adds assertQueryBudget to a TestCase: it fails when the
+block runs more statements than the budget, listing what was run, so an N+1
+shows up as a test failure rather than as a slow page in production.
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+class QueryLog(list):
+    """The statements run, in order"""
+
+    def matching(self, *verbs):
+        """The statements that start with one of the verbs (e.g. "INSERT")"""
+
+        return [statement for statement in self if statement.lstrip().split(None, 1)[0].upper() in verbs]
+
+    def writes(self):
+        return self.matching("INSERT", "UPDATE", "DELETE")
+
+    def report(self):
+        return "\n".join(f"{n:3}: {' '.join(statement.split())}" for n, statement in enumerate(self, start=1))
+
+@contextmanager
+def count_queries():
+    """Collects the SQL statements run inside the block into a QueryLog"""
+
+    queries = QueryLog()
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    #Every engine, rather than db.engine - each app made by create_app has its own
+    event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(Engine, "before_cursor_execute", before_cursor_execute)
+
+class QueryBudgetMixin:
+    """assertQueryBudget for TestCases"""
+
+    @contextmanager
+    def assertQueryBudget(self, budget, label=""):
+        """Fail if the block runs more than `budget` statements"""
+
+        with count_queries() as queries:
+            yield queries
+
+        if len(queries) > budget:
+            self.fail(f"{label or 'Block'} ran {len(queries)} statements - over its budget of {budget}:\n{queries.report()}")
@@ -1,7 +1,10 @@
 """Seed file to make sample data for db"""
 from models import db
-from app import app
+from app import create_app
+from migrations import upgrade
+
+app = create_app()
 
 #create all tables
 db.drop_all()
-db.create_all()
\ No newline at end of file
+upgrade(db.engine)
\ No newline at end of file
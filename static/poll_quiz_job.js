@@ -0,0 +1,25 @@
+//Poll the quiz job until it's finished, then go to the new quiz
+function pollQuizJob() {
+    var status_url = $("#quiz-job").data("status-url");
+    $.getJSON(status_url, function(job) {
+        if (job.status == "done") {
+            window.location = window.location.pathname;
+        }
+        else if (job.status == "failed") {
+            $("#job-working").hide();
+            $("#job-failed").show();
+        }
+        else {
+            if (job.attempts > 1) {
+                $("#job-attempts").text(`Attempt ${job.attempts}`);
+            }
+            setTimeout(pollQuizJob, 1000);
+        }
+    });
+}
+
+$("document").ready(function() {
+    if ($("#job-failed").is(":hidden")) {
+        setTimeout(pollQuizJob, 1000);
+    }
+});
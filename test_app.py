@@ -0,0 +1,80 @@
+"""App Factory Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_app.py
+
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from flask import Flask
+
+import http_cache
+from app import create_app
+from config import ProductionConfig, DevelopmentConfig, TestConfig
+from query_counter import count_queries
+
+class CreateAppTestCase(TestCase):
+
+    def tearDown(self):
+        #Leave the shared extensions pointing at a test app for the other test modules
+        create_app(TestConfig)
+
+    def test_production(self):
+        """Production gets no toolbar, no statement logging and no database work at startup"""
+
+        with count_queries() as statements:
+            app = create_app(ProductionConfig)
+
+        self.assertNotIn("debugtoolbar", app.blueprints)
+        self.assertFalse(app.config['SQLALCHEMY_ECHO'])
+        self.assertFalse(app.debug)
+        self.assertEqual(statements, [])
+
+    def test_development(self):
+        """Development gets the toolbar and statement logging"""
+
+        app = create_app(DevelopmentConfig)
+
+        self.assertIn("debugtoolbar", app.blueprints)
+        self.assertTrue(app.config['SQLALCHEMY_ECHO'])
+
+    def test_static_caching(self):
+        """Fingerprinted static files are cached for a long time, pages not at all"""
+
+        app = create_app(TestConfig)
+
+        with app.test_request_context():
+            url = app.jinja_env.globals["static_url"]("quizzr_styles.css")
+        self.assertRegex(url, r"^/static/quizzr_styles\.css\?v=\w+$")
+
+        with app.test_client() as c:
+            resp = c.get(url)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("max-age=31536000", resp.headers["Cache-Control"])
+            resp.close()
+
+            resp = c.get("/about")
+            self.assertIn("max-age=0", resp.headers["Cache-Control"])
+
+    def test_page_etag_covers_static_files(self):
+        """Changing a static file changes every page's ETag, as the pages link to it by its fingerprint"""
+
+        with tempfile.TemporaryDirectory() as root:
+            for folder, filename in (("templates", "page.html"), ("static", "styles.css"), ("static/js", "page.js")):
+                os.makedirs(os.path.join(root, folder), exist_ok=True)
+                with open(os.path.join(root, folder, filename), "w") as f:
+                    f.write("one")
+            app = Flask(__name__, root_path=root)
+
+            etags = []
+            for filename in ("page.html", "styles.css", "js/page.js", None):
+                with app.app_context(), mock.patch("http_cache._assets_fingerprint", None):
+                    etags.append(http_cache.page_etag("quiz", 1, 1))
+                if filename is not None:
+                    folder = "templates" if filename.endswith(".html") else "static"
+                    with open(os.path.join(root, folder, filename), "w") as f:
+                        f.write("two")
+
+        self.assertEqual(len(set(etags)), 4)
@@ -0,0 +1,104 @@
+"""Fake JService Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_fake_jservice.py
+
+import json
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+import requests
+
+from fake_jservice import FakeJService, parse_weights
+from tools import JServiceClient, QuestionFetchError, parse_clue
+
+class FakeJServiceTestCase(TestCase):
+
+    def setUp(self):
+        self.server = FakeJService(seed=7).start()
+        self.client = JServiceClient(base_url=self.server.url, connect_timeout=1, read_timeout=2, max_retries=2, backoff=0)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_random_contract(self):
+        """/api/random hands out `count` JService clues, at most 100"""
+
+        clues = self.client.random_clues(10)
+        self.assertEqual(len(clues), 10)
+        for clue in clues:
+            self.assertEqual(set(clue), {"id", "question", "answer", "value", "category_id", "category"})
+            parsed = parse_clue(clue)
+            if parsed is not None:
+                self.assertIn(parsed["difficulty"], range(1, 11))
+
+        self.assertEqual(len(self.client.random_clues(500)), 100)
+        self.assertEqual(len(requests.get(f"{self.server.url}/api/random").json()), 1)
+        self.assertEqual(requests.get(f"{self.server.url}/api/clues").status_code, 404)
+
+    def test_seeded(self):
+        """The same seed gives the same clues, request for request"""
+
+        first = [self.client.random_clues(20) for _ in range(3)]
+
+        self.server.configure(seed=7)
+        self.assertEqual([self.client.random_clues(20) for _ in range(3)], first)
+
+        self.server.configure(seed=8)
+        self.assertNotEqual(self.client.random_clues(20), first[0])
+
+    def test_weights(self):
+        """Difficulty weights skew the clues handed out"""
+
+        self.server.configure(seed=7, weights={5: 1}, null_rate=0)
+        self.assertEqual({parse_clue(clue)["difficulty"] for clue in self.client.random_clues(100)}, {5})
+
+        self.server.configure(seed=7, weights={1: 9, 2: 1}, null_rate=0)
+        difficulties = [parse_clue(clue)["difficulty"] for clue in self.client.random_clues(100)]
+        self.assertGreater(difficulties.count(1), 3 * difficulties.count(2))
+
+        self.assertEqual(parse_weights("5=3,1=1"), {5: 3.0, 1: 1.0})
+        with self.assertRaises(ValueError):
+            self.server.configure(weights={42: 1})
+
+    def test_errors(self):
+        """Injected failures are retried by the client, and it gives up if they keep coming"""
+
+        self.server.configure(seed=7, error_rate=1)
+        with self.assertRaises(QuestionFetchError):
+            self.client.random_clues(5)
+        self.assertEqual(self.server.errors, 3)
+
+        self.server.configure(seed=7, error_rate=0.5)
+        for _ in range(5):
+            self.assertEqual(len(self.client.random_clues(5)), 5)
+        self.assertGreater(self.server.errors, 0)
+        self.assertEqual(self.server.requests, self.server.errors + 5)
+
+    def test_latency(self):
+        """Injected latency slows requests down - past the client's timeout, if it's long enough"""
+
+        self.server.configure(seed=7, latency=0.2)
+        start = time.perf_counter()
+        self.client.random_clues(5)
+        self.assertGreaterEqual(time.perf_counter() - start, 0.2)
+
+        impatient = JServiceClient(base_url=self.server.url, connect_timeout=1, read_timeout=0.05, max_retries=0, backoff=0)
+        with self.assertRaises(QuestionFetchError):
+            impatient.random_clues(5)
+
+    def test_fixture(self):
+        """Clues can come from a fixture file instead of being made up"""
+
+        clues = [{"id": n, "question": f"Fixture {n}", "answer": "A", "value": 400, "category": {"id": 1, "title": "fixed"}} for n in range(3)]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "clues.json")
+            with open(path, "w") as f:
+                json.dump(clues, f)
+            self.server.configure(fixture=path)
+
+        served = self.client.random_clues(30)
+        self.assertEqual({clue["question"] for clue in served}, {"Fixture 0", "Fixture 1", "Fixture 2"})
@@ -0,0 +1,107 @@
+"""Fragment Cache Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_fragment_cache.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+from fragment_cache import FragmentCache, MemoryBackend, DiskBackend, make_backend
+
+class MemoryBackendTestCase(TestCase):
+
+    def test_evicts_by_size(self):
+        """Least recently used fragments go once the total size is over the limit"""
+
+        backend = MemoryBackend(max_bytes=25)
+        backend.set("a", "1", "a" * 10, 1.0)
+        backend.set("b", "1", "b" * 10, 1.0)
+        backend.get("a")
+        backend.set("c", "1", "c" * 10, 1.0)
+
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual(backend.get("a"), ("1", "a" * 10, 1.0))
+        self.assertEqual(backend.stats()["bytes"], 20)
+
+        #Too big to cache at all
+        backend.set("d", "1", "d" * 30, 1.0)
+        self.assertIsNone(backend.get("d"))
+        self.assertEqual(backend.stats()["entries"], 2)
+
+class DiskBackendTestCase(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_shared(self):
+        """Fragments written by one process's backend are read by another's"""
+
+        DiskBackend(self.dir.name).set("quiz-1", "v1", "<p>héllo</p>\n<p>there</p>", 12.5)
+
+        backend = DiskBackend(self.dir.name)
+        self.assertEqual(backend.get("quiz-1"), ("v1", "<p>héllo</p>\n<p>there</p>", 12.5))
+
+        backend.delete("quiz-1")
+        self.assertIsNone(DiskBackend(self.dir.name).get("quiz-1"))
+        self.assertEqual(backend.stats()["entries"], 0)
+
+    def test_private_directory(self):
+        """The directory is made private to the app, and one that others can write to is refused"""
+
+        directory = os.path.join(self.dir.name, "fragments")
+        DiskBackend(directory)
+        self.assertEqual(os.stat(directory).st_mode & 0o777, 0o700)
+
+        os.chmod(directory, 0o777)
+        with self.assertRaisesRegex(RuntimeError, "can be written to by other users"):
+            DiskBackend(directory)
+
+        link = os.path.join(self.dir.name, "link")
+        os.symlink(directory, link)
+        with self.assertRaisesRegex(RuntimeError, "isn't a directory"):
+            DiskBackend(link)
+
+    def test_default_directory(self):
+        """Without FRAGMENT_CACHE_DIR, fragments go in the instance folder rather than a shared temporary directory"""
+
+        app = Flask(__name__, instance_path=self.dir.name)
+        app.config.update(FRAGMENT_CACHE="disk", FRAGMENT_CACHE_DIR=None)
+
+        self.assertEqual(make_backend(app).directory, os.path.join(self.dir.name, "fragments"))
+
+    def test_configure_keeps_entries(self):
+        """A worker starting up doesn't wipe the fragments the others have cached"""
+
+        DiskBackend(self.dir.name).set("quiz-1", "v1", "<p>one</p>", 12.5)
+
+        cache = FragmentCache()
+        cache.configure(DiskBackend(self.dir.name))
+
+        self.assertEqual(cache.get_or_render("quiz-1", "v1", lambda: "not called"), "<p>one</p>")
+        self.assertEqual(cache.stats()["hits"], 1)
+
+class FragmentCacheTestCase(TestCase):
+
+    def test_versions(self):
+        """An entry for an old version is re-rendered rather than served"""
+
+        cache = FragmentCache(MemoryBackend())
+        renders = []
+        def render(html):
+            renders.append(html)
+            return html
+
+        self.assertEqual(cache.get_or_render("quiz-1", "v1", lambda: render("one")), "one")
+        self.assertEqual(cache.get_or_render("quiz-1", "v1", lambda: render("not called")), "one")
+        self.assertEqual(cache.get_or_render("quiz-1", "v2", lambda: render("two")), "two")
+
+        self.assertEqual(renders, ["one", "two"])
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_ratio"]), (1, 2, 0.333))
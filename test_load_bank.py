@@ -0,0 +1,110 @@
+"""Question Bank Loader Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_load_bank.py
+
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from models import db, BankQuestion, BankLoad
+from app import create_app
+from config import TestConfig
+from load_bank import load_bank, iter_json_array
+
+app = create_app(TestConfig)
+
+db.create_all()
+
+def make_clue(n, value):
+    return {"id": n, "question": f"Question {n}", "answer": f"Answer {n}", "value": value, "category": {"title": "test"}}
+
+class LoadBankTestCase(TestCase):
+
+    def setUp(self):
+        """Clear out the question bank"""
+
+        db.drop_all()
+        db.create_all()
+
+        self.dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        self.dir.cleanup()
+        return resp
+
+    def write_file(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, "w") as file:
+            file.write(content)
+        return path
+
+    def test_load_json_array(self):
+        """Null-value clues are dropped and values map to difficulty levels"""
+
+        clues = [make_clue(1, 200), make_clue(2, None), make_clue(3, 1000), make_clue(4, 600)]
+        path = self.write_file("clues.json", json.dumps(clues, indent=2))
+
+        load_bank(path, batch_size=2, out=io.StringIO())
+
+        bank = {clue.jservice_id: clue.difficulty for clue in BankQuestion.query.all()}
+        self.assertEqual(bank, {1: 1, 3: 5, 4: 3})
+        self.assertTrue(BankLoad.query.one().finished)
+
+    def test_load_csv(self):
+        """Kaggle-style CSV dumps load too"""
+
+        path = self.write_file("clues.csv", 'Show Number, Air Date, Round, Category, Value, Question, Answer\n'
+                                            '4680,2004-12-31,Jeopardy!,HISTORY,$200,"First, a question",Answer one\n'
+                                            '4680,2004-12-31,Final Jeopardy!,HISTORY,None,Final question,Answer two\n'
+                                            '4680,2004-12-31,Double Jeopardy!,SCIENCE,"$1,000",Last question,Answer three\n')
+
+        load_bank(path, out=io.StringIO())
+
+        bank = {clue.question: clue.difficulty for clue in BankQuestion.query.all()}
+        self.assertEqual(bank, {"First, a question": 1, "Last question": 5})
+
+    def test_resume(self):
+        """An interrupted load picks up after the last committed batch"""
+
+        clues = [make_clue(n, 400) for n in range(1, 11)]
+        path = self.write_file("clues.ndjson", "\n".join(json.dumps(clue) for clue in clues))
+
+        #Blow up on the third batch
+        real_bank = BankQuestion.bank
+        calls = []
+        def flaky_bank(rows):
+            calls.append(len(rows))
+            if len(calls) == 3:
+                raise RuntimeError("interrupted")
+            real_bank(rows)
+
+        with mock.patch.object(BankQuestion, "bank", side_effect=flaky_bank):
+            with self.assertRaises(RuntimeError):
+                load_bank(path, batch_size=3, out=io.StringIO())
+        db.session.rollback()
+
+        self.assertEqual(BankQuestion.query.count(), 6)
+        self.assertEqual(BankLoad.query.one().records_done, 6)
+
+        out = io.StringIO()
+        load_bank(path, batch_size=3, out=out)
+
+        self.assertIn("Resuming", out.getvalue())
+        self.assertIn("rows/sec", out.getvalue())
+        self.assertEqual(sorted(clue.jservice_id for clue in BankQuestion.query.all()), list(range(1, 11)))
+
+    def test_iter_json_array_across_reads(self):
+        """Records split across read boundaries are reassembled"""
+
+        clues = [make_clue(n, 200) for n in range(50)]
+
+        with mock.patch("load_bank.READ_SIZE", 7):
+            records = list(iter_json_array(io.StringIO(json.dumps(clues))))
+
+        self.assertEqual(records, clues)
@@ -0,0 +1,129 @@
+"""Metrics Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_metrics.py
+
+import re
+from unittest import TestCase
+
+import metrics
+from metrics import Counter, Histogram
+from models import db, User, Quiz, Question, QuizQuestion
+
+from app import create_app, CURR_USER_KEY, user_cache, fragment_cache
+from config import TestConfig
+
+app = create_app(TestConfig)
+
+db.create_all()
+
+class MetricTypesTestCase(TestCase):
+
+    def test_histogram(self):
+        """Buckets are cumulative in the output, with +Inf, the sum and the count"""
+
+        histogram = Histogram("test_seconds", "A test", ["endpoint"], buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 5):
+            histogram.observe(value, 'say "hi"')
+
+        self.assertEqual(histogram.render(), ['test_seconds_bucket{endpoint="say \\"hi\\"",le="0.1"} 1',
+                                              'test_seconds_bucket{endpoint="say \\"hi\\"",le="1"} 3',
+                                              'test_seconds_bucket{endpoint="say \\"hi\\"",le="+Inf"} 4',
+                                              'test_seconds_sum{endpoint="say \\"hi\\""} 6.05',
+                                              'test_seconds_count{endpoint="say \\"hi\\""} 4'])
+
+    def test_counter(self):
+        counter = Counter("test_total", "A test", ["outcome"])
+        counter.inc("ok")
+        counter.inc("ok", amount=2)
+        counter.inc("error")
+
+        self.assertEqual(counter.render(), ['test_total{outcome="error"} 1', 'test_total{outcome="ok"} 3'])
+
+class MetricsViewTestCase(TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+        fragment_cache.clear()
+        metrics.clear()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser", password="testuser")
+        db.session.commit()
+        self.testuser_id = self.testuser.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_request_metrics(self):
+        """Every request is timed, with its SQL counted, and gets a Server-Timing header"""
+
+        quiz = Quiz(name="testquiz", description="", rounds=1, user_id=self.testuser_id)
+        question = Question(question="Q", answer="A", difficulty=1, user_id=self.testuser_id)
+        db.session.add_all([quiz, question])
+        db.session.flush()
+        db.session.add(QuizQuestion(quiz_id=quiz.id, question_id=question.id, round=1))
+        db.session.commit()
+        quiz_id = quiz.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/quizzes/show/{quiz_id}")
+            timing = resp.headers["Server-Timing"]
+            self.assertRegex(timing, r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+            self.assertGreater(int(re.search(r'"(\d+) queries"', timing).group(1)), 0)
+
+            c.get("/nowhere")
+
+            body = c.get("/metrics", headers={"Authorization": f"Bearer {app.config['METRICS_TOKEN']}"}).get_data(as_text=True)
+
+        self.assertIn('quizzr_request_duration_seconds_count{endpoint="views.show_quiz",method="GET",status="200"} 1', body)
+        self.assertIn('quizzr_request_duration_seconds_count{endpoint="unmatched",method="GET",status="404"} 1', body)
+        self.assertIn('quizzr_request_sql_statements_bucket{endpoint="views.show_quiz",le="0"} 0', body)
+        self.assertIn("quizzr_fragment_cache_misses_total 1", body)
+        self.assertEqual(metrics.request_sql_statements.count("views.show_quiz"), 1)
+
+    def test_question_fetch_metrics(self):
+        """Generating a quiz records the JService requests it made and how long it waited for them"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post("/quizzes/create", data={"name": "testquiz", "rounds": 1, "qs_per_round": 5, "round_one_diff": 3,
+                                                   "round_two_diff": 1, "round_three_diff": 1, "round_four_diff": 1, "round_five_diff": 1})
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertRegex(resp.headers["Server-Timing"], r'jservice;dur=[\d.]+;desc="[1-9]\d* requests"')
+
+            body = c.get("/metrics", headers={"Authorization": f"Bearer {app.config['METRICS_TOKEN']}"}).get_data(as_text=True)
+
+        self.assertIn("quizzr_jservice_clues_kept_total 5", body)
+        self.assertRegex(body, r"quizzr_jservice_clues_fetched_total [1-9]\d*")
+        self.assertEqual(metrics.question_fetch_seconds.count(), 1)
+        self.assertGreater(metrics.jservice_requests.value("ok"), 0)
+
+    def test_metrics_need_token(self):
+        """The metrics and cache stats are hidden from anyone without METRICS_TOKEN"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            for url in ("/metrics", "/stats/user_cache", "/stats/fragment_cache"):
+                self.assertEqual(c.get(url).status_code, 404, url)
+                self.assertEqual(c.get(url, headers={"Authorization": "Bearer wrong"}).status_code, 404, url)
+                self.assertEqual(c.get(url, headers={"Authorization": f"Bearer {app.config['METRICS_TOKEN']}"}).status_code, 200, url)
+
+        #With no token set, nobody gets them
+        app.config["METRICS_TOKEN"] = None
+        try:
+            self.assertEqual(self.client.get("/metrics", headers={"Authorization": "Bearer "}).status_code, 404)
+        finally:
+            app.config["METRICS_TOKEN"] = TestConfig.METRICS_TOKEN
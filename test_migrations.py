@@ -0,0 +1,196 @@
+"""Schema Migration Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_migrations.py
+
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import inspect, text
+
+from models import db, User, Quiz, QuizQuestion, Question, QuizJob, BankQuestion
+
+from app import create_app
+from config import TestConfig
+from jobs import runnable_jobs
+from migrations import MIGRATIONS, upgrade, current_version
+
+app = create_app(TestConfig)
+
+LATEST = max(m[0] for m in MIGRATIONS)
+
+class MigrationTestCase(TestCase):
+
+    def setUp(self):
+        """Start from an empty database"""
+
+        db.session.rollback()
+        db.drop_all()
+
+    def tearDown(self):
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+    def assertSchemaMatchesModels(self):
+        inspector = inspect(db.engine)
+
+        for table in db.metadata.sorted_tables:
+            self.assertTrue(inspector.has_table(table.name), table.name)
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            self.assertLessEqual({column.name for column in table.columns}, columns, table.name)
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            self.assertLessEqual({index.name for index in table.indexes}, indexes, table.name)
+            if db.engine.dialect.name == "sqlite":
+                #SQLAlchemy doesn't reflect ON DELETE from a key declared with its column (as ADD COLUMN has to) - ask SQLite
+                keys = db.session.execute(text(f"PRAGMA foreign_key_list({table.name})"))
+                ondelete = {key["from"]: "" if key["on_delete"] == "NO ACTION" else key["on_delete"] for key in keys.mappings()}
+            else:
+                ondelete = {fk["constrained_columns"][0]: (fk["options"].get("ondelete") or "").upper() for fk in inspector.get_foreign_keys(table.name)}
+            self.assertEqual({fk.parent.name: (fk.ondelete or "").upper() for fk in table.foreign_keys}, ondelete, table.name)
+
+    def test_fresh_database(self):
+        """Upgrading an empty database gives the schema the models describe"""
+
+        self.assertEqual(current_version(db.engine), 0)
+        self.assertEqual(upgrade(db.engine), sorted(m[0] for m in MIGRATIONS))
+        self.assertEqual(current_version(db.engine), LATEST)
+        self.assertSchemaMatchesModels()
+
+        #Nothing left to do the second time round
+        self.assertEqual(upgrade(db.engine), [])
+
+    def test_step_by_step(self):
+        """Migrations can be applied a version at a time"""
+
+        self.assertEqual(upgrade(db.engine, target=1), [1])
+        self.assertEqual(current_version(db.engine), 1)
+        self.assertEqual(upgrade(db.engine), [m[0] for m in MIGRATIONS if m[0] > 1])
+        self.assertSchemaMatchesModels()
+
+    def test_existing_database(self):
+        """A database made by create_all() before migrations existed is brought up to date"""
+
+        db.create_all()
+        user = User.signup("olduser", "olduser")
+        db.session.flush()
+        db.session.add(Question(question="Existing question", answer="Answer", difficulty=1, user_id=user.id))
+        db.session.commit()
+
+        upgrade(db.engine)
+
+        self.assertEqual(current_version(db.engine), LATEST)
+        self.assertSchemaMatchesModels()
+        questions, more = Question.search(user.id, "existing")
+        self.assertEqual([q.question for q in questions], ["Existing question"])
+
+    def test_cascading_deletes(self):
+        """Keys made before migration 8 are changed to cascade, keeping the rows"""
+
+        upgrade(db.engine, target=7)
+        user = User.signup("olduser", "olduser")
+        db.session.flush()
+        quiz = Quiz(name="Old quiz", rounds=1, user_id=user.id)
+        db.session.add(quiz)
+        #The questions table doesn't have all the model's columns yet
+        question_id = db.session.execute(Question.__table__.insert().values(question="Old question", answer="Answer", difficulty=1,
+                                                                            user_id=user.id)).inserted_primary_key[0]
+        db.session.flush()
+        db.session.add(QuizQuestion(quiz_id=quiz.id, question_id=question_id, round=1))
+        db.session.add(QuizJob(user_id=user.id, params={}, quiz_id=quiz.id))
+        user_id = user.id
+        db.session.commit()
+
+        upgrade(db.engine)
+        self.assertSchemaMatchesModels()
+        self.assertEqual(QuizQuestion.query.count(), 1)
+        questions, more = Question.search(user_id, "old")
+        self.assertEqual(len(questions), 1)
+
+        db.session.execute(text("DELETE FROM users WHERE id = :id"), {"id": user_id})
+        db.session.commit()
+        for model in (Quiz, Question, QuizQuestion, QuizJob):
+            self.assertEqual(model.query.count(), 0, model.__tablename__)
+
+class IndexUsageTestCase(TestCase):
+    """The routes' hot queries can be answered from an index rather than a sequential scan"""
+
+    @classmethod
+    def setUpClass(cls):
+        if db.engine.dialect.name != "postgresql":
+            raise cls.skipTest(cls, "EXPLAIN output checked is Postgres's")
+
+        db.session.rollback()
+        db.drop_all()
+        upgrade(db.engine)
+
+        users = [User.signup(f"user{n}", "password") for n in range(3)]
+        db.session.flush()
+        for user in users:
+            quizzes = [Quiz(name=f"Quiz {n}", rounds=2, user_id=user.id) for n in range(20)]
+            questions = [Question(question=f"Question {n}", answer="Answer", difficulty=n % 5 + 1, user_id=user.id) for n in range(100)]
+            db.session.add_all(quizzes + questions)
+            db.session.flush()
+            db.session.add_all(QuizQuestion(quiz_id=quiz.id, question_id=question.id, round=n % 2 + 1)
+                               for quiz in quizzes for n, question in enumerate(questions[:10]))
+        BankQuestion.bank([{"question": f"Bank {n}", "answer": "Answer", "difficulty": n % 5 + 1} for n in range(500)])
+        #Most jobs are long finished - only a few are waiting to be claimed
+        db.session.execute(QuizJob.__table__.insert(), [{"user_id": users[0].id, "status": "done" if n > 5 else "queued",
+                                                         "params": {}, "attempts": 1, "run_after": datetime.utcnow(),
+                                                         "created_at": datetime.utcnow()} for n in range(2000)])
+        db.session.commit()
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+
+    @classmethod
+    def tearDownClass(cls):
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+    def explain(self, query):
+        """The plan for the query, with sequential scans made as unattractive as possible to the planner"""
+
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        try:
+            db.session.execute(text("SET LOCAL enable_seqscan = off"))
+            return "\n".join(row[0] for row in db.session.connection().exec_driver_sql("EXPLAIN " + str(compiled), compiled.params))
+        finally:
+            db.session.rollback()
+
+    def assertUsesIndex(self, query, index):
+        plan = self.explain(query)
+        self.assertIn(index, plan)
+        self.assertNotIn("Seq Scan", plan)
+
+    def test_quiz_listing(self):
+        self.assertUsesIndex(Quiz.query.filter(Quiz.user_id == 2, Quiz.id > 25).order_by(Quiz.id).limit(26),
+                             "ix_quizzes_user_id_id")
+
+    def test_question_listing(self):
+        self.assertUsesIndex(Question.query.filter(Question.user_id == 2, Question.id < 250).order_by(Question.id.desc()).limit(26),
+                             "ix_questions_user_id_id")
+
+    def test_quiz_rounds(self):
+        #The query questions_by_round runs
+        self.assertUsesIndex(Quiz.round_rows(5), "ix_quiz_questions_quiz_id_round")
+
+    def test_question_quizzes(self):
+        self.assertUsesIndex(QuizQuestion.query.filter(QuizQuestion.question_id == 5),
+                             "ix_quiz_questions_question_id")
+
+    def test_quizzes_without_question(self):
+        plan = self.explain(Quiz.without_question(2, 5))
+        self.assertIn("ix_quizzes_user_id_id", plan)
+        self.assertIn("Anti Join", plan)
+        self.assertNotIn("Seq Scan", plan)
+
+    def test_bank_sample(self):
+        self.assertUsesIndex(BankQuestion.query.filter(BankQuestion.difficulty == 3, BankQuestion.random_key >= 0.5)
+                             .order_by(BankQuestion.random_key).limit(10),
+                             "ix_bank_questions_difficulty_random_key")
+
+    def test_queued_jobs(self):
+        #Built the way claim_job builds it - the oldest runnable job, locked
+        self.assertUsesIndex(runnable_jobs(datetime.utcnow()).limit(1), "ix_quiz_jobs_unfinished_id")
@@ -0,0 +1,138 @@
+"""Query Budget Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_budgets.py
+
+from unittest import TestCase, mock
+
+from models import db, User, Quiz, Question, QuizQuestion, BankQuestion
+from query_counter import QueryBudgetMixin, count_queries
+
+from app import create_app, CURR_USER_KEY, user_cache, fragment_cache
+from config import TestConfig
+
+app = create_app(TestConfig)
+
+db.create_all()
+
+#The most statements each page may run, with the logged in user already cached. They mustn't grow with the
+#size of the quiz (or the number of quizzes a question is on, or the user's library) - see SIZES
+QUERY_BUDGETS = {
+    "show_quizzes": 2,
+    "show_quiz": 2,
+    "edit_quiz": 2,
+    "replace_question": 9,
+    "remove_questions": 4,
+    "show_questions": 1,
+    "search_questions": 1,
+    "show_question": 2,
+    "edit_question": 1,
+}
+
+#(quizzes, rounds per quiz, questions per round) - the pages are checked at each size
+SIZES = [(1, 1, 2), (30, 5, 20)]
+
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+        fragment_cache.clear()
+
+        self.client = app.test_client()
+
+        user = User.signup(username="testuser", password="testuser")
+        db.session.commit()
+        self.testuser_id = user.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def setup_library(self, quizzes, rounds, qs_per_round):
+        """`quizzes` quizzes of rounds x qs_per_round questions, with the first question on every one of them.
+
+        Returns the first quiz's id and the shared question's id.
+        """
+
+        shared = Question(question="On every quiz", answer="Shared", difficulty=1, user_id=self.testuser_id)
+        quiz_ids = []
+        for quiz_no in range(quizzes):
+            quiz = Quiz(name=f"quiz{quiz_no}", description="", rounds=rounds, user_id=self.testuser_id)
+            quiz.questions.append(QuizQuestion(question=shared, round=1))
+            for round_no in range(1, rounds + 1):
+                for n in range(qs_per_round - (round_no == 1)):
+                    question = Question(question=f"Quiz {quiz_no} round {round_no} question {n}", answer=f"Answer {n}",
+                                        difficulty=round_no, user_id=self.testuser_id)
+                    quiz.questions.append(QuizQuestion(question=question, round=round_no))
+            db.session.add(quiz)
+            db.session.flush()
+            quiz_ids.append(quiz.id)
+
+        #Replacements come from the bank, so JService isn't part of the count
+        BankQuestion.bank([{"jservice_id": None, "question": f"Bank question {n}", "answer": "Bank answer", "category": "bank",
+                            "difficulty": diff} for diff in range(1, 6) for n in range(5)])
+        #At the top of the random_key index, so reading forward from any pivot finds them without wrapping round
+        #to the start - which would be a statement more, at random
+        BankQuestion.query.update({BankQuestion.random_key: 1.0})
+        db.session.commit()
+        return quiz_ids[0], shared.id
+
+    def page_requests(self, quiz_id, question_id):
+        """(budget name, method, url, form data) for every page with a budget"""
+
+        replaced = db.session.query(QuizQuestion.question_id).filter(QuizQuestion.quiz_id == quiz_id, QuizQuestion.question_id != question_id).first()[0]
+        return [("show_quizzes", "GET", "/quizzes/show", None),
+                ("show_quiz", "GET", f"/quizzes/show/{quiz_id}", None),
+                ("edit_quiz", "GET", f"/quizzes/edit/{quiz_id}", None),
+                ("replace_question", "POST", f"/quizzes/edit/{quiz_id}", {"checked_questions": [replaced]}),
+                ("show_questions", "GET", "/questions/show", None),
+                ("search_questions", "GET", "/questions/search?q=question", None),
+                ("show_question", "GET", f"/questions/show/{question_id}", None),
+                ("edit_question", "GET", f"/questions/edit/{question_id}", None),
+                ("remove_questions", "POST", f"/quizzes/remove_questions/{quiz_id}", {"checked_questions": [question_id]})]
+
+    def test_query_budgets(self):
+        """No page runs more statements than its budget, however big the quizzes and library"""
+
+        counts = {}
+
+        for size in SIZES:
+            with self.subTest(size=size):
+                #Start again from an empty database for each size
+                self.tearDown()
+                self.setUp()
+                quiz_id, question_id = self.setup_library(*size)
+
+                with self.client as c:
+                    with c.session_transaction() as sess:
+                        sess[CURR_USER_KEY] = self.testuser_id
+                    #Get the logged in user into the user cache
+                    c.get("/")
+
+                    with mock.patch("tools.jservice.random_clues", side_effect=AssertionError("JService should not be called")):
+                        for name, method, url, data in self.page_requests(quiz_id, question_id):
+                            with self.assertQueryBudget(QUERY_BUDGETS[name], f"{method} {url}") as queries:
+                                resp = c.open(url, method=method, data=data)
+                            self.assertLess(resp.status_code, 400, url)
+                            counts.setdefault(name, []).append(len(queries))
+
+        #Nothing more for a big library than a small one
+        for name, by_size in counts.items():
+            self.assertEqual(len(set(by_size)), 1, f"{name} ran {by_size} statements at sizes {SIZES}")
+
+    def test_budget_failure(self):
+        """Going over budget fails, listing the statements"""
+
+        with self.assertRaises(AssertionError) as raised:
+            with self.assertQueryBudget(1, "Two queries"):
+                db.session.execute("SELECT 1")
+                db.session.execute("SELECT 2")
+
+        self.assertIn("Two queries ran 2 statements - over its budget of 1", str(raised.exception))
+        self.assertIn("2: SELECT 2", str(raised.exception))
+
+        with count_queries() as queries:
+            db.session.execute("SELECT 1")
+        self.assertEqual((len(queries), queries.writes()), (1, []))
@@ -4,19 +4,20 @@
 #
 #    FLASK_ENV=production python -m unittest test_question_views.py
 
-import os
+import csv
+import io
+import json
 from unittest import TestCase
 
 from models import db, connect_db, User, Quiz, Question, QuizQuestion
 
-os.environ['DATABASE_URL'] = "postgresql:///trivia-test"
+from app import create_app, CURR_USER_KEY, user_cache, fragment_cache
+from config import TestConfig
 
-from app import app, CURR_USER_KEY
+app = create_app(TestConfig)
 
 db.create_all()
 
-app.config['WTF_CSRF_ENABLED'] = False
-
 class QuestionViewTestCase(TestCase):
 
     def setUp(self):
@@ -24,6 +25,8 @@ class QuestionViewTestCase(TestCase):
 
         db.drop_all()
         db.create_all()
+        user_cache.clear()
+        fragment_cache.clear()
 
         self.client = app.test_client()
 
@@ -125,6 +128,76 @@ class QuestionViewTestCase(TestCase):
             self.assertIn('Forty-two', str(resp.data))
             self.assertIn('<strong>Difficulty:</strong> 5', str(resp.data))
 
+    def test_show_questions_pages(self):
+        """Questions are shown a page at a time, with links to the pages either side"""
+
+        db.session.add_all([Question(question=f"Question number {n}.", answer=f"Answer {n}", difficulty=1, user_id=self.testuser.id) for n in range(25)])
+        db.session.commit()
+        ids = [question.id for question in Question.query.order_by(Question.id)]
+        app.config['PAGE_SIZE'] = 10
+
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser.id
+
+                resp = c.get("/questions/show")
+                self.assertIn("Question number 9.", str(resp.data))
+                self.assertNotIn("Question number 10.", str(resp.data))
+                self.assertIn(f"?after={ids[9]}", str(resp.data))
+
+                resp = c.get(f"/questions/show?after={ids[19]}")
+                self.assertIn("Question number 20.", str(resp.data))
+                self.assertIn("Question number 24.", str(resp.data))
+                self.assertNotIn("Question number 19.", str(resp.data))
+                self.assertIn(f"?before={ids[20]}", str(resp.data))
+
+                resp = c.get(f"/questions/show?before={ids[20]}")
+                self.assertIn("Question number 10.", str(resp.data))
+                self.assertIn("Question number 19.", str(resp.data))
+                self.assertNotIn("Question number 9.", str(resp.data))
+                self.assertIn(f"?before={ids[10]}", str(resp.data))
+                self.assertIn(f"?after={ids[19]}", str(resp.data))
+
+        finally:
+            app.config['PAGE_SIZE'] = 25
+
+    def test_search_questions(self):
+        """Search covers question, answer and category, only for the user's own questions, and keeps up with edits"""
+
+        other_user = User.signup(username="otheruser", password="otheruser")
+        db.session.commit()
+
+        db.session.add_all([Question(question="This planet is the largest in the solar system", answer="Jupiter", difficulty=1, category="Astronomy", user_id=self.testuser.id),
+                            Question(question="Roman king of the gods", answer="Jupiter", difficulty=2, user_id=self.testuser.id),
+                            Question(question="A planet with rings", answer="Saturn", difficulty=3, category="Astronomy", user_id=self.testuser.id),
+                            Question(question="Another planet question", answer="Jupiter", difficulty=3, user_id=other_user.id)])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get("/questions/search?q=jupiter")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("largest in the solar system", str(resp.data))
+            self.assertIn("Roman king of the gods", str(resp.data))
+            self.assertNotIn("Another planet question", str(resp.data))
+            self.assertNotIn("A planet with rings", str(resp.data))
+
+            resp = c.get("/questions/search?q=astronomy")
+            self.assertIn("A planet with rings", str(resp.data))
+            self.assertNotIn("Roman king of the gods", str(resp.data))
+
+            #Edited questions are found by their new text
+            roman = Question.query.filter(Question.question == "Roman king of the gods").one()
+            c.post(f"/questions/edit/{roman.id}", data={"question": "Greek king of the gods", "answer": "Zeus", "difficulty": 2})
+
+            resp = c.get("/questions/search?q=zeus")
+            self.assertIn("Greek king of the gods", str(resp.data))
+            resp = c.get("/questions/search?q=jupiter")
+            self.assertNotIn("king of the gods", str(resp.data))
+
     def test_show_question(self):
         """Test show question - The GET route for questions/show/<int:question_id>"""
 
@@ -144,6 +217,35 @@ class QuestionViewTestCase(TestCase):
             self.assertIn('Forty-two', str(resp.data))
             self.assertIn('<strong>Difficulty:</strong> 5', str(resp.data))
 
+    def test_show_question_quiz_choices(self):
+        """Only the user's own quizzes that the question isn't on yet can be picked"""
+
+        self.setup_quiz_and_question()
+        question_id = Question.query.filter(Question.answer=="Forty-two").one().id
+
+        other = User.signup(username="otheruser", password="otheruser")
+        db.session.flush()
+        db.session.add_all([Quiz(name="roomforone", description="", rounds=3, user_id=self.testuser_id),
+                            Quiz(name="notmine", description="", rounds=1, user_id=other.id)])
+        db.session.commit()
+        not_mine = Quiz.query.filter(Quiz.name=="notmine").one().id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            html = c.get(f"/questions/show/{question_id}").get_data(as_text=True)
+
+            self.assertIn("roomforone", html)
+            self.assertIn('data-rounds=3', html)
+            #Already on testquiz, and notmine is someone else's
+            self.assertNotIn(">testquiz<", html)
+            self.assertNotIn("notmine", html)
+
+            resp = c.post(f"/questions/show/{question_id}", data={"quiz": not_mine, "round": 1})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(QuizQuestion.query.filter(QuizQuestion.quiz_id == not_mine).count(), 0)
+
     def test_add_question_to_quiz(self):
         """Test adding question to quiz - The POST route for questions/show/<int:question_id>"""
 
@@ -203,3 +305,140 @@ class QuestionViewTestCase(TestCase):
 
             
 
+    def test_export_questions(self):
+        """The whole library streams out as CSV, NDJSON or an answer sheet"""
+
+        db.session.execute(Question.__table__.insert(),
+                           [{"question": f"Question {n}, \"quoted\"", "answer": f"Answer {n}", "difficulty": n % 5 + 1,
+                             "category": "cat" if n % 2 else None, "user_id": self.testuser_id} for n in range(1200)])
+        other = User.signup(username="otheruser", password="otheruser")
+        db.session.flush()
+        db.session.add(Question(question="Someone else's", answer="Not mine", difficulty=1, user_id=other.id))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/questions/export.csv", buffered=False)
+            self.assertTrue(resp.is_streamed)
+            self.assertIn("attachment", resp.headers["Content-Disposition"])
+            #The header goes out before any rows, and the rows in batches
+            chunks = list(resp.response)
+            self.assertEqual(chunks[0], b"id,question,answer,difficulty,category\r\n")
+            self.assertEqual(len(chunks), 4)
+
+            rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode())))
+            self.assertEqual(len(rows), 1200)
+            self.assertEqual(rows[0]["question"], 'Question 0, "quoted"')
+            self.assertEqual(rows[1]["category"], "cat")
+
+            lines = c.get("/questions/export.ndjson").data.decode().splitlines()
+            self.assertEqual(len(lines), 1200)
+            self.assertEqual(json.loads(lines[-1])["answer"], "Answer 1199")
+
+            html = c.get("/questions/export.html").data.decode()
+            self.assertEqual(html.count("<li>"), 2400)
+            self.assertLess(html.index("Question 1199"), html.index("Answers"), html.index("Answer 0<"))
+            self.assertNotIn("Not mine", html)
+
+            self.assertEqual(c.get("/questions/export.xml").status_code, 404)
+
+    def test_import_questions(self):
+        """Good rows of a CSV are imported, and bad ones are reported by row number"""
+
+        upload = ("question,answer,difficulty,category\n"
+                  "First question,First answer,1,History\n"
+                  ",No question,2,\n"
+                  "Third question,Third answer,9,\n"
+                  "\"Fourth, with a comma\",Fourth answer,5,\n")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post("/questions/import", data={"file": (io.BytesIO(upload.encode("utf-8-sig")), "questions.csv"), "quiz": 0, "round": 1},
+                          content_type="multipart/form-data")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("2 imported, 2 skipped", html)
+            self.assertIn("Row 2: Question can&#39;t be blank", html)
+            self.assertIn("Row 3: ", html)
+
+            questions = Question.query.filter_by(user_id=self.testuser_id).order_by(Question.id).all()
+            self.assertEqual([q.question for q in questions], ["First question", "Fourth, with a comma"])
+            self.assertEqual(questions[0].category, "History")
+            self.assertEqual(questions[1].difficulty, 5)
+
+    def test_import_questions_to_quiz(self):
+        """Imported NDJSON goes onto the chosen quiz - in each row's own round if it has one"""
+
+        quiz = Quiz(name="importquiz", description="", rounds=2, user_id=self.testuser_id)
+        db.session.add(quiz)
+        db.session.commit()
+        quiz_id = quiz.id
+
+        upload = "\n".join(json.dumps(record) for record in [
+            {"question": "In round one", "answer": "A", "difficulty": 2},
+            {"question": "In round two", "answer": "B", "difficulty": 3, "round": 2},
+            {"question": "No such round", "answer": "C", "difficulty": 3, "round": 7},
+        ])
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post("/questions/import", data={"file": (io.BytesIO(upload.encode()), "questions.ndjson"), "quiz": quiz_id, "round": 1},
+                          content_type="multipart/form-data")
+            self.assertIn("Row 3: Round must be between 1 and 2", resp.get_data(as_text=True))
+
+            rounds = dict(db.session.query(Question.question, QuizQuestion.round)
+                          .join(QuizQuestion, QuizQuestion.question_id == Question.id)
+                          .filter(QuizQuestion.quiz_id == quiz_id))
+            self.assertEqual(rounds, {"In round one": 1, "In round two": 2})
+            self.assertEqual(Quiz.query.get(quiz_id).revision, 2)
+
+            #A quiz the user doesn't own can't be chosen
+            other = User.signup(username="otheruser", password="otheruser")
+            db.session.flush()
+            other_quiz = Quiz(name="notmine", description="", rounds=1, user_id=other.id)
+            db.session.add(other_quiz)
+            db.session.commit()
+
+            resp = c.post("/questions/import", data={"file": (io.BytesIO(upload.encode()), "questions.ndjson"), "quiz": other_quiz.id, "round": 1},
+                          content_type="multipart/form-data")
+            self.assertIn("Not a valid choice", resp.get_data(as_text=True))
+            self.assertEqual(QuizQuestion.query.filter_by(quiz_id=other_quiz.id).count(), 0)
+
+    def test_import_questions_bad_file(self):
+        """A file that can't be read imports nothing, even from the rows before the problem"""
+
+        upload = '[{"question": "Fine", "answer": "Fine", "difficulty": 1}, {"question": "Broken'
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post("/questions/import", data={"file": (io.BytesIO(upload.encode()), "questions.json"), "quiz": 0, "round": 1},
+                          content_type="multipart/form-data", follow_redirects=True)
+            self.assertIn("Couldn&#39;t read the file", resp.get_data(as_text=True))
+            self.assertEqual(Question.query.filter_by(user_id=self.testuser_id).count(), 0)
+
+            resp = c.post("/questions/import", data={"file": (io.BytesIO(b"x"), "questions.txt"), "quiz": 0, "round": 1},
+                          content_type="multipart/form-data")
+            self.assertIn("Upload a .csv, .json or .ndjson file", resp.get_data(as_text=True))
+
+    def test_import_questions_batches(self):
+        """A large file is written in batches of INSERTs, not a statement per row"""
+
+        upload = "question,answer,difficulty\n" + "".join(f"Question {n},Answer {n},{n % 5 + 1}\n" for n in range(2500))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.post("/questions/import", data={"file": (io.BytesIO(upload.encode()), "questions.csv"), "quiz": 0, "round": 1},
+                          content_type="multipart/form-data")
+            self.assertIn("2500 imported, 0 skipped", resp.get_data(as_text=True))
+            self.assertEqual(Question.query.filter_by(user_id=self.testuser_id).count(), 2500)
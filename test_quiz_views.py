@@ -4,19 +4,25 @@
 #
 #    FLASK_ENV=production python -m unittest test_quiz_views.py
 
-import os
-from unittest import TestCase
+import csv
+import io
+import json
+import time
+from datetime import datetime, timedelta
+from unittest import TestCase, mock
 
-from models import db, connect_db, User, Quiz, Question, QuizQuestion
+from models import db, connect_db, User, Quiz, Question, QuizQuestion, BankQuestion, QuizJob
+from query_counter import count_queries
 
-os.environ['DATABASE_URL'] = "postgresql:///trivia-test"
+from app import create_app, CURR_USER_KEY, user_cache, fragment_cache
+from config import TestConfig
+from jobs import claim_job, run_job
+from tools import QuestionFetchError
 
-from app import app, CURR_USER_KEY
+app = create_app(TestConfig)
 
 db.create_all()
 
-app.config['WTF_CSRF_ENABLED'] = False
-
 class QuizViewTestCase(TestCase):
 
     def setUp(self):
@@ -24,6 +30,8 @@ class QuizViewTestCase(TestCase):
 
         db.drop_all()
         db.create_all()
+        user_cache.clear()
+        fragment_cache.clear()
 
         self.client = app.test_client()
 
@@ -63,6 +71,252 @@ class QuizViewTestCase(TestCase):
             self.assertEqual(quiz.rounds, 5)
             self.assertEqual(len(quiz.questions), 25)
 
+    def setup_bank(self, per_difficulty):
+        """Fill the question bank with `per_difficulty` clues at each difficulty level"""
+
+        BankQuestion.bank([{"jservice_id": diff * 1000 + n,
+                            "question": f"Bank question {diff}-{n}",
+                            "answer": f"Bank answer {diff}-{n}",
+                            "category": "bank",
+                            "difficulty": diff} for diff in range(1, 6) for n in range(per_difficulty)])
+        db.session.commit()
+
+    def test_create_quiz_from_bank(self):
+        """A well-stocked question bank means no calls to JService"""
+
+        self.setup_bank(10)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with mock.patch("tools.jservice.random_clues", side_effect=AssertionError("JService should not be called")):
+                resp = c.post("/quizzes/create", data={"name": "bankquiz",
+                                                       "rounds" : 2,
+                                                       "qs_per_round": 10,
+                                                       "round_one_diff": [1, 2],
+                                                       "round_two_diff": 5,
+                                                       "round_three_diff": 1,
+                                                       "round_four_diff": 1,
+                                                       "round_five_diff": 1})
+
+            self.assertEqual(resp.status_code, 302)
+
+            quiz = Quiz.query.one()
+            self.assertEqual(len(quiz.questions), 20)
+            for quiz_question in quiz.questions:
+                if quiz_question.round == 1:
+                    self.assertIn(quiz_question.question.difficulty, [1, 2])
+                else:
+                    self.assertEqual(quiz_question.question.difficulty, 5)
+            #Each round's questions should be distinct
+            self.assertEqual(len({qq.question.question for qq in quiz.questions}), 20)
+
+    def test_create_quiz_skips_library(self):
+        """A new quiz doesn't hand out bank clues the user already has, going upstream when the rest of the bank runs short"""
+
+        self.setup_bank(8)
+        upstream = [{"id": 9000 + n, "question": f"Upstream question {n}", "answer": f"Upstream answer {n}", "value": 200, "category": {"title": "test"}}
+                    for n in range(5)]
+        data = {"rounds" : 1,
+                "qs_per_round": 5,
+                "round_one_diff": 1,
+                "round_two_diff": 1,
+                "round_three_diff": 1,
+                "round_four_diff": 1,
+                "round_five_diff": 1}
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with mock.patch("tools.jservice.random_clues", side_effect=AssertionError("JService should not be called")):
+                c.post("/quizzes/create", data={"name": "first", **data})
+            with mock.patch("tools.jservice.random_clues", return_value=upstream) as random_clues:
+                c.post("/quizzes/create", data={"name": "second", **data})
+
+            #Only 3 clues were left that the user didn't have
+            random_clues.assert_called()
+            questions = Question.query.all()
+            self.assertEqual(len(questions), 10)
+            self.assertEqual(len({question.question for question in questions}), 10)
+            self.assertEqual(sum(question.question.startswith("Bank") for question in questions), 8)
+            #Every question records the bank clue it came from - the upstream ones were banked as they were used
+            self.assertEqual(len({question.bank_id for question in questions if question.bank_id is not None}), 10)
+
+    def test_create_quiz_statement_count(self):
+        """Writing a quiz takes the same number of statements however many questions it has"""
+
+        #Only psycopg2 gets the new rows' ids back from a single batched INSERT - SQLite needs one per question
+        if db.engine.dialect.name != "postgresql":
+            self.skipTest("Batched INSERT ... RETURNING is Postgres's")
+
+        #Enough for both quizzes - the second can't reuse the first's clues
+        self.setup_bank(25)
+        counts = []
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            #Get the logged in user into the user cache
+            c.get("/")
+
+            for qs_per_round in (5, 20):
+                with count_queries() as statements:
+                    resp = c.post("/quizzes/create", data={"name": f"quiz{qs_per_round}",
+                                                           "rounds" : 1,
+                                                           "qs_per_round": qs_per_round,
+                                                           "round_one_diff": 3,
+                                                           "round_two_diff": 1,
+                                                           "round_three_diff": 1,
+                                                           "round_four_diff": 1,
+                                                           "round_five_diff": 1})
+                self.assertEqual(resp.status_code, 302)
+
+                #One INSERT each for the quiz, its questions and the quiz_questions rows (plus the job that built it)
+                inserts = [statement for statement in statements.matching("INSERT") if "quiz_jobs" not in statement]
+                self.assertEqual(len(inserts), 3)
+                #Sampling the bank can take an extra query to wrap around its index, so leave that out
+                counts.append(len([statement for statement in statements if "bank_questions" not in statement]))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Question.query.count(), 25)
+
+    def test_create_quiz_rounds_fetched_concurrently(self):
+        """Rounds are fetched from JService in parallel but still land in the right round"""
+
+        def slow_random_clues(count, deadline=None):
+            time.sleep(0.5)
+            return [{"id": None, "question": f"Question {n}", "answer": f"Answer {n}", "value": 200 * (n % 5 + 1), "category": {"title": "test"}} for n in range(count)]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            start = time.monotonic()
+            with mock.patch("tools.jservice.random_clues", side_effect=slow_random_clues):
+                resp = c.post("/quizzes/create", data={"name": "testquiz",
+                                                       "rounds" : 5,
+                                                       "qs_per_round": 5,
+                                                       "round_one_diff": 1,
+                                                       "round_two_diff": 2,
+                                                       "round_three_diff": 3,
+                                                       "round_four_diff": 4,
+                                                       "round_five_diff": 5})
+            elapsed = time.monotonic() - start
+
+            self.assertEqual(resp.status_code, 302)
+            #Five sequential rounds would take at least 2.5 seconds
+            self.assertLess(elapsed, 2)
+
+            quiz = Quiz.query.one()
+            self.assertEqual(len(quiz.questions), 25)
+            for quiz_question in quiz.questions:
+                self.assertEqual(quiz_question.question.difficulty, quiz_question.round)
+
+    def test_quiz_job(self):
+        """Creating a quiz goes through a job, whose status can be polled"""
+
+        self.setup_bank(5)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post("/quizzes/create", data={"name": "testquiz",
+                                                   "rounds" : 1,
+                                                   "qs_per_round": 5,
+                                                   "round_one_diff": 1,
+                                                   "round_two_diff": 1,
+                                                   "round_three_diff": 1,
+                                                   "round_four_diff": 1,
+                                                   "round_five_diff": 1})
+
+            job = QuizJob.query.one()
+            quiz = Quiz.query.one()
+            self.assertEqual(resp.location.rstrip("/").split("/")[-1], str(job.id))
+
+            resp = c.get(f"/quizzes/jobs/{job.id}/status")
+            self.assertEqual(resp.json["status"], "done")
+            self.assertEqual(resp.json["quiz_id"], quiz.id)
+            self.assertEqual(set(resp.json["timings"]), {"queued", "fetch", "persist", "total"})
+
+            #Once the job's done its page forwards to the quiz
+            resp = c.get(f"/quizzes/jobs/{job.id}")
+            self.assertEqual(resp.status_code, 302)
+            self.assertIn(f"/quizzes/show/{quiz.id}", resp.location)
+
+    def test_quiz_job_unexpected_error(self):
+        """A job that fails with anything but a fetch error is marked failed straight away, not left running"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with mock.patch("jobs.build_quiz", side_effect=RuntimeError("Database went away")):
+                resp = c.post("/quizzes/create", data={"name": "testquiz",
+                                                       "rounds" : 1,
+                                                       "qs_per_round": 5,
+                                                       "round_one_diff": 1,
+                                                       "round_two_diff": 1,
+                                                       "round_three_diff": 1,
+                                                       "round_four_diff": 1,
+                                                       "round_five_diff": 1})
+
+            self.assertEqual(resp.status_code, 302)
+            job = QuizJob.query.one()
+            self.assertEqual((job.status, job.error, job.attempts, job.locked_until), ("failed", "Database went away", 1, None))
+            self.assertIn("total", job.timings)
+
+            resp = c.get(f"/quizzes/jobs/{job.id}/status")
+            self.assertEqual(resp.json["status"], "failed")
+
+    def test_quiz_job_retry(self):
+        """Jobs are retried when JService fails"""
+
+        responses = [QuestionFetchError("down"), [{"id": n, "question": f"Q{n}", "answer": f"A{n}", "value": 200, "category": {"title": "test"}} for n in range(10)]]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with mock.patch("tools.jservice.random_clues", side_effect=responses):
+                c.post("/quizzes/create", data={"name": "testquiz",
+                                                "rounds" : 1,
+                                                "qs_per_round": 5,
+                                                "round_one_diff": 1,
+                                                "round_two_diff": 1,
+                                                "round_three_diff": 1,
+                                                "round_four_diff": 1,
+                                                "round_five_diff": 1})
+
+            job = QuizJob.query.one()
+            self.assertEqual(job.status, "done")
+            self.assertEqual(job.attempts, 2)
+            self.assertEqual(len(Quiz.query.one().questions), 5)
+
+    def test_quiz_job_survives_restart(self):
+        """A job left running by a dead worker is picked up again once its lease runs out"""
+
+        self.setup_bank(5)
+        params = {"name": "testquiz", "description": "", "rounds": 1, "qs_per_round": 5, "difficulty_levels": [[2]] * 5}
+        job = QuizJob(user_id=self.testuser.id, params=params, status="running", attempts=1,
+                      locked_until=datetime.utcnow() - timedelta(seconds=1))
+        db.session.add(job)
+        db.session.commit()
+
+        claimed = claim_job(app)
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual(claimed.attempts, 2)
+
+        run_job(app, claimed)
+        self.assertEqual(QuizJob.query.one().status, "done")
+        self.assertEqual(Quiz.query.one().name, "testquiz")
+
+        #Nothing left to do
+        self.assertIsNone(claim_job(app))
+
     def setup_quizzes(self):
    
         quiz = Quiz(name="testquiz",
@@ -141,6 +395,38 @@ class QuizViewTestCase(TestCase):
             self.assertNotIn('Forty-two', str(resp.data))
             self.assertIn('Difficulty:</strong> 5', str(resp.data))
 
+    def test_edit_quiz_replace_question_repeatedly(self):
+        """Replacements never put a clue on the quiz that's already there"""
+
+        self.setup_bank(25)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with mock.patch("tools.jservice.random_clues", side_effect=AssertionError("JService should not be called")):
+                c.post("/quizzes/create", data={"name": "bankquiz",
+                                                "rounds" : 1,
+                                                "qs_per_round": 20,
+                                                "round_one_diff": 5,
+                                                "round_two_diff": 1,
+                                                "round_three_diff": 1,
+                                                "round_four_diff": 1,
+                                                "round_five_diff": 1})
+                quiz_id = Quiz.query.one().id
+
+                for n in range(20):
+                    question_ids = [question_id for question_id, in db.session.query(QuizQuestion.question_id).filter(QuizQuestion.quiz_id == quiz_id)]
+                    on_quiz = {question.question for question in Question.query.filter(Question.id.in_(question_ids))}
+                    resp = c.post(f"/quizzes/edit/{quiz_id}", data={"checked_questions": question_ids[n % len(question_ids)]})
+                    self.assertEqual(resp.status_code, 200)
+
+                    questions = [quiz_question.question.question for quiz_question in QuizQuestion.query.filter(QuizQuestion.quiz_id == quiz_id)]
+                    self.assertEqual(len(questions), 20)
+                    self.assertEqual(len(set(questions)), 20)
+                    #The new question wasn't on the quiz already
+                    self.assertEqual(len(set(questions) - on_quiz), 1)
+
     def test_edit_quiz_delete_question(self):
 
         self.setup_quizzes()
@@ -161,6 +447,216 @@ class QuizViewTestCase(TestCase):
             self.assertNotIn('What is the answer to life, the universe, and everything?', str(resp.data))
             self.assertNotIn('Forty-two', str(resp.data))
 
+    def setup_big_quiz(self, rounds, qs_per_round):
+        """Set up a quiz with `qs_per_round` questions in each round, difficulty matching the round number"""
+
+        quiz = Quiz(name="bigquiz", description="a big quiz", rounds=rounds, user_id=self.testuser.id)
+        for round_no in range(1, rounds + 1):
+            for n in range(qs_per_round):
+                question = Question(question=f"Round {round_no} question {n}", answer=f"Round {round_no} answer {n}",
+                                    difficulty=round_no, user_id=self.testuser.id)
+                quiz.questions.append(QuizQuestion(question=question, round=round_no))
+        db.session.add(quiz)
+        db.session.commit()
+        return quiz.id
+
+    def test_quiz_pages_query_count(self):
+        """Showing or editing a 100-question quiz doesn't load its questions one at a time"""
+
+        quiz_id = self.setup_big_quiz(5, 20)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            #Get the logged in user into the user cache
+            c.get("/")
+
+            for url in (f"/quizzes/show/{quiz_id}", f"/quizzes/edit/{quiz_id}"):
+                with count_queries() as statements:
+                    resp = c.get(url)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Round 5 answer 19", str(resp.data))
+                #The quiz and its questions
+                self.assertEqual(len(statements), 2)
+
+    def test_show_quiz_not_modified(self):
+        """A browser with an up to date copy of the quiz gets a 304 without the questions being loaded"""
+
+        quiz_id = self.setup_big_quiz(2, 10)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.get(f"/quizzes/show/{quiz_id}")
+            etag = resp.headers["ETag"]
+            self.assertEqual(resp.headers["Cache-Control"], "private, no-cache")
+            self.assertIsNotNone(resp.headers.get("Last-Modified"))
+
+            with count_queries() as statements:
+                resp = c.get(f"/quizzes/show/{quiz_id}", headers={"If-None-Match": etag})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b"")
+            self.assertFalse(any("quiz_questions" in statement for statement in statements))
+
+            #Removing a question makes the old copy stale
+            question_id = QuizQuestion.query.filter(QuizQuestion.quiz_id == quiz_id).first().question_id
+            c.post(f"/quizzes/remove_questions/{quiz_id}", data={"checked_questions": [question_id]})
+            c.get(f"/quizzes/edit/{quiz_id}")
+
+            resp = c.get(f"/quizzes/show/{quiz_id}", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers["ETag"], etag)
+            etag = resp.headers["ETag"]
+
+            #So does editing one of its questions
+            question_id = QuizQuestion.query.filter(QuizQuestion.quiz_id == quiz_id).first().question_id
+            c.post(f"/questions/edit/{question_id}", data={"question": "Edited question", "answer": "Edited answer", "difficulty": 1})
+            c.get(f"/questions/show/{question_id}")
+
+            resp = c.get(f"/quizzes/show/{quiz_id}", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Edited question", str(resp.data))
+
+    def test_show_quiz_flash_not_cached(self):
+        """A quiz page showing a flashed message isn't cached, so the message isn't shown again on the next visit"""
+
+        quiz_id = self.setup_big_quiz(2, 10)
+        question = Question(question="Added question", answer="Added answer", difficulty=1, user_id=self.testuser.id)
+        db.session.add(question)
+        db.session.commit()
+        question_id = question.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            resp = c.post(f"/questions/show/{question_id}", data={"quiz": quiz_id, "round": 2})
+            self.assertEqual(resp.status_code, 302)
+
+            resp = c.get(f"/quizzes/show/{quiz_id}")
+            self.assertIn(f"Question ID:{question_id} added to Round 2", str(resp.data))
+            self.assertIsNone(resp.headers.get("ETag"))
+            self.assertIsNone(resp.headers.get("Last-Modified"))
+
+            #The next visit gets a cacheable copy without the message - and that's what a conditional request revalidates
+            resp = c.get(f"/quizzes/show/{quiz_id}")
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("added to Round", str(resp.data))
+            etag = resp.headers["ETag"]
+
+            resp = c.get(f"/quizzes/show/{quiz_id}", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+
+    def test_show_quiz_fragment_cache(self):
+        """The quiz's question list is rendered once, until the quiz changes"""
+
+        quiz_id = self.setup_big_quiz(5, 20)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            first = c.get(f"/quizzes/show/{quiz_id}")
+
+            with count_queries() as statements:
+                second = c.get(f"/quizzes/show/{quiz_id}")
+
+            self.assertEqual(second.data, first.data)
+            self.assertFalse(any("quiz_questions" in statement for statement in statements))
+            stats = c.get("/stats/fragment_cache", headers={"Authorization": f"Bearer {app.config['METRICS_TOKEN']}"}).json
+            self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+            self.assertGreater(stats["saved_ms"], 0)
+
+            question_id = QuizQuestion.query.filter(QuizQuestion.quiz_id == quiz_id, QuizQuestion.round == 5).first().question_id
+            c.post(f"/quizzes/remove_questions/{quiz_id}", data={"checked_questions": [question_id]})
+            self.assertEqual(fragment_cache.stats()["entries"], 0)
+            c.get(f"/quizzes/edit/{quiz_id}")
+
+            resp = c.get(f"/quizzes/show/{quiz_id}")
+            self.assertNotIn(f"<strong>Question ID:</strong> {question_id}<", str(resp.data))
+            self.assertEqual(fragment_cache.stats()["misses"], 2)
+
+    def test_export_quiz(self):
+        """A quiz exports round by round"""
+
+        quiz_id = self.setup_big_quiz(3, 4)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            rows = list(csv.DictReader(io.StringIO(c.get(f"/quizzes/export/{quiz_id}.csv").data.decode())))
+            self.assertEqual([row["round"] for row in rows], ["1"] * 4 + ["2"] * 4 + ["3"] * 4)
+            self.assertEqual(rows[-1]["answer"], "Round 3 answer 3")
+
+            records = [json.loads(line) for line in c.get(f"/quizzes/export/{quiz_id}.ndjson").data.splitlines()]
+            self.assertEqual(records[0], {"round": 1, "id": records[0]["id"], "question": "Round 1 question 0",
+                                          "answer": "Round 1 answer 0", "difficulty": 1, "category": None})
+
+            html = c.get(f"/quizzes/export/{quiz_id}.html").data.decode()
+            self.assertEqual(html.count("<h2>Round 3</h2>"), 2)
+            self.assertLess(html.index("Round 3 question 3"), html.index("Round 1 answer 0"))
+
+    def test_edit_quiz_replace_many_questions(self):
+        """Replacing lots of questions costs one fetch per difficulty and a fixed number of writes"""
+
+        self.setup_bank(20)
+        quiz_id = self.setup_big_quiz(3, 10)
+        #Every question in rounds 1 and 2, and a couple from round 3
+        old_questions = {quiz_question.question_id: quiz_question.round for quiz_question in QuizQuestion.query.all()
+                         if quiz_question.round < 3 or quiz_question.question.question.endswith(("0", "1"))}
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with mock.patch("tools.jservice.random_clues", side_effect=AssertionError("JService should not be called")):
+                with count_queries() as statements:
+                    resp = c.post(f"/quizzes/edit/{quiz_id}", data={"checked_questions": list(old_questions)})
+
+            self.assertEqual(resp.status_code, 200)
+
+            writes = [statement.lstrip().split()[0].upper() for statement in statements.writes()]
+            #The UPDATE bumps the quiz's revision
+            self.assertEqual((writes.count("DELETE"), writes.count("UPDATE")), (1, 1))
+            #Only psycopg2 batches the INSERTs that need the new rows' ids back - SQLite runs one per question
+            if db.engine.dialect.name == "postgresql":
+                self.assertEqual(sorted(writes), ["DELETE", "INSERT", "INSERT", "UPDATE"])
+
+            quiz_questions = QuizQuestion.query.filter(QuizQuestion.quiz_id == quiz_id).all()
+            self.assertEqual(len(quiz_questions), 30)
+            self.assertFalse(any(quiz_question.question_id in old_questions for quiz_question in quiz_questions))
+            #Replacements keep the round and difficulty of the question they replaced
+            self.assertEqual(sum(quiz_question.round == 3 for quiz_question in quiz_questions), 10)
+            for quiz_question in quiz_questions:
+                self.assertEqual(quiz_question.question.difficulty, quiz_question.round)
+            self.assertEqual(len({quiz_question.question.question for quiz_question in quiz_questions}), 30)
+
+            #The old questions are still in the user's library
+            self.assertEqual(Question.query.count(), 30 + len(old_questions))
+
+    def test_edit_quiz_delete_many_questions(self):
+        """Removing lots of questions is a single DELETE"""
+
+        quiz_id = self.setup_big_quiz(2, 10)
+        q_ids = [quiz_question.question_id for quiz_question in QuizQuestion.query.filter(QuizQuestion.round == 1)]
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser.id
+
+            with count_queries() as statements:
+                resp = c.post(f"/quizzes/remove_questions/{quiz_id}", data={"checked_questions": q_ids})
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(len(statements.matching("DELETE")), 1)
+            self.assertEqual(QuizQuestion.query.filter(QuizQuestion.quiz_id == quiz_id).count(), 10)
+            self.assertEqual(Question.query.count(), 20)
+
     def test_delete_quiz(self):
 
         self.setup_quizzes()
@@ -0,0 +1,160 @@
+"""Question Fetching Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_tools.py
+
+import time
+from unittest import TestCase, mock
+
+import requests
+
+import metrics
+import tools
+from tools import fetch_clues, JServiceClient, QuestionFetchError
+
+def make_clues(count, value):
+    return [{"id": n, "question": f"Question {n}", "answer": f"Answer {n}", "value": value, "category": {"title": "test"}} for n in range(count)]
+
+class FakeJService:
+    """Stands in for JServiceClient.random_clues - hands out clues of the given values in turn, recording the counts asked for"""
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.counts = []
+
+    def __call__(self, count, deadline=None):
+        self.counts.append(count)
+        value = self.values.pop(0) if len(self.values) > 1 else self.values[0]
+        return make_clues(count, value)
+
+class FetchCluesTestCase(TestCase):
+
+    def setUp(self):
+        """Start every test with no yield history"""
+
+        tools._difficulty_seen.clear()
+        metrics.clear()
+
+    def test_deficit_only(self):
+        """Later requests only ask for what's still missing"""
+
+        #First request is all the wrong difficulty, the rest are all the right one
+        fake = FakeJService(200, 1000)
+        stats = {}
+
+        with mock.patch("tools.jservice.random_clues", fake):
+            kept, spare = fetch_clues([5], 10, stats)
+
+        self.assertEqual(len(kept), 10)
+        self.assertTrue(all(clue["difficulty"] == 5 for clue in kept))
+        #Everything from the first request is spare, along with any surplus from the second
+        self.assertEqual(len([clue for clue in spare if clue["difficulty"] == 1]), fake.counts[0])
+        self.assertEqual(stats["requests"], len(fake.counts))
+        self.assertEqual(stats["fetched"], sum(fake.counts))
+        self.assertEqual(stats["kept"], 10)
+        self.assertEqual(metrics.jservice_clues_fetched.value(), sum(fake.counts))
+        self.assertEqual(metrics.jservice_clues_kept.value(), 10)
+
+    def test_request_size_tracks_yield(self):
+        """Once everything seen is the requested difficulty, requests shrink to the deficit"""
+
+        fake = FakeJService(600)
+
+        with mock.patch("tools.jservice.random_clues", fake):
+            fetch_clues([3], 5)
+            first = fake.counts[-1]
+            for _ in range(10):
+                fetch_clues([3], 5)
+
+        self.assertGreater(first, fake.counts[-1])
+        self.assertLessEqual(fake.counts[-1], 6)
+
+    def test_null_values_dropped(self):
+        """Clues without a value never make it into a quiz"""
+
+        fake = FakeJService(None, 400)
+
+        with mock.patch("tools.jservice.random_clues", fake):
+            kept, spare = fetch_clues([2], 5)
+
+        self.assertEqual(len(kept), 5)
+        self.assertTrue(all(clue["difficulty"] == 2 for clue in kept + spare))
+
+    def test_round_trip_cap(self):
+        """Give up rather than hammering JService forever"""
+
+        fake = FakeJService(200)
+
+        with mock.patch("tools.jservice.random_clues", fake):
+            with self.assertRaises(QuestionFetchError):
+                fetch_clues([5], 5)
+
+        self.assertEqual(len(fake.counts), tools.MAX_FETCH_REQUESTS)
+
+class JServiceClientTestCase(TestCase):
+
+    def setUp(self):
+        self.client = JServiceClient(base_url="http://jservice.test/", pool_size=2, connect_timeout=1, read_timeout=2, max_retries=2, backoff=0)
+
+    def response(self, status, data=None):
+        resp = requests.Response()
+        resp.status_code = status
+        resp._content = b"[]" if data is None else data
+        return resp
+
+    def test_request(self):
+        """Requests go through the pooled session with a timeout"""
+
+        with mock.patch.object(self.client.session, "get", return_value=self.response(200, b'[{"id": 1}]')) as get:
+            self.assertEqual(self.client.random_clues(5), [{"id": 1}])
+
+        get.assert_called_once_with("http://jservice.test/api/random", params={"count": 5}, timeout=(1, 2))
+
+    def test_retry_server_error(self):
+        """5xx responses and connection errors are retried"""
+
+        responses = [self.response(503), requests.ConnectionError("reset"), self.response(200)]
+
+        with mock.patch.object(self.client.session, "get", side_effect=responses) as get:
+            self.assertEqual(self.client.random_clues(5), [])
+
+        self.assertEqual(get.call_count, 3)
+
+    def test_retry_invalid_json(self):
+        """A 2xx body that isn't JSON is retried, then given up on as a QuestionFetchError"""
+
+        responses = [self.response(200, b"<html>Bad gateway</html>"), self.response(200, b'[{"id": 1}]')]
+        with mock.patch.object(self.client.session, "get", side_effect=responses) as get:
+            self.assertEqual(self.client.random_clues(5), [{"id": 1}])
+        self.assertEqual(get.call_count, 2)
+
+        with mock.patch.object(self.client.session, "get", return_value=self.response(200, b"<html>Bad gateway</html>")) as get:
+            with self.assertRaisesRegex(QuestionFetchError, "isn't JSON"):
+                self.client.random_clues(5)
+        self.assertEqual(get.call_count, 3)
+
+    def test_give_up(self):
+        """Retries are capped, and client errors aren't retried at all"""
+
+        with mock.patch.object(self.client.session, "get", side_effect=requests.Timeout("slow")) as get:
+            with self.assertRaises(QuestionFetchError):
+                self.client.random_clues(5)
+        self.assertEqual(get.call_count, 3)
+
+        with mock.patch.object(self.client.session, "get", return_value=self.response(404)) as get:
+            with self.assertRaises(QuestionFetchError):
+                self.client.random_clues(5)
+        self.assertEqual(get.call_count, 1)
+
+    def test_deadline(self):
+        """No request runs past the deadline - the timeouts shrink to fit, and none is started once it's passed"""
+
+        with mock.patch.object(self.client.session, "get", return_value=self.response(200)) as get:
+            self.client.random_clues(5, deadline=time.monotonic() + 0.5)
+        self.assertTrue(all(0 < part <= 0.5 for part in get.call_args.kwargs["timeout"]))
+
+        with mock.patch.object(self.client.session, "get", side_effect=requests.Timeout("slow")) as get:
+            with self.assertRaisesRegex(QuestionFetchError, "Ran out of time"):
+                self.client.random_clues(5, deadline=time.monotonic() - 1)
+        self.assertEqual(get.call_count, 0)
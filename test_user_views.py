@@ -0,0 +1,173 @@
+"""User View Tests"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_user_views.py
+
+import tracemalloc
+from unittest import TestCase
+
+from models import db, User, Quiz, Question, QuizQuestion, QuizJob, configure_password_hashing
+from query_counter import count_queries
+
+from app import create_app, CURR_USER_KEY, user_cache
+from config import TestConfig
+
+app = create_app(TestConfig)
+
+db.create_all()
+
+class UserViewTestCase(TestCase):
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        db.drop_all()
+        db.create_all()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser",
+                                    password="testuser")
+        db.session.commit()
+        self.testuser_id = self.testuser.id
+
+    def tearDown(self):
+        resp = super().tearDown()
+        db.session.rollback()
+        return resp
+
+    def test_user_cache(self):
+        """The logged in user is looked up once, then served from the cache"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            for _ in range(3):
+                resp = c.get("/")
+                self.assertIn("testuser", str(resp.data))
+
+            stats = c.get("/stats/user_cache", headers={"Authorization": f"Bearer {app.config['METRICS_TOKEN']}"}).json
+            self.assertEqual(stats["misses"], 1)
+            self.assertEqual(stats["hits"], 2)
+
+    def test_user_cache_skipped(self):
+        """Views that never look at the user don't look them up"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get("/stats/user_cache", headers={"Authorization": f"Bearer {app.config['METRICS_TOKEN']}"})
+            self.assertEqual(user_cache.stats()["misses"], 0)
+            self.assertEqual(user_cache.stats()["hits"], 0)
+
+    def test_change_username_invalidates_cache(self):
+        """A changed username shows up straight away"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get("/")
+            resp = c.post("/change_username", data={"username": "renameduser", "password": "testuser"}, follow_redirects=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("renameduser", str(resp.data))
+            self.assertEqual(User.query.get(self.testuser_id).username, "renameduser")
+
+    def test_delete_user_invalidates_cache(self):
+        """A deleted user is gone from the cache too"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get("/")
+            resp = c.post("/delete")
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertIsNone(User.query.get(self.testuser_id))
+            self.assertEqual(user_cache.stats()["size"], 0)
+
+            #Even with the old session cookie, the user is no longer logged in
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            resp = c.get("/")
+            self.assertNotIn("testuser", str(resp.data))
+
+    def test_delete_user_with_big_library(self):
+        """Deleting a user is one DELETE, however many questions and quizzes they have - the database cascades it"""
+
+        user_id = self.testuser_id
+        db.session.execute(Question.__table__.insert(), [{"question": f"Question {n}", "answer": f"Answer {n}", "difficulty": n % 5 + 1,
+                                                          "user_id": user_id} for n in range(50000)])
+        db.session.execute(Quiz.__table__.insert(), [{"name": f"Quiz {n}", "rounds": 1, "user_id": user_id} for n in range(100)])
+        question_ids = [id for id, in db.session.query(Question.id).order_by(Question.id).limit(5000)]
+        quiz_ids = [id for id, in db.session.query(Quiz.id).order_by(Quiz.id)]
+        db.session.execute(QuizQuestion.__table__.insert(), [{"quiz_id": quiz_id, "question_id": question_ids[n * 50 + i], "round": 1}
+                                                             for n, quiz_id in enumerate(quiz_ids) for i in range(50)])
+        db.session.add(QuizJob(user_id=user_id, params={}, quiz_id=quiz_ids[0]))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            c.get("/")
+
+            tracemalloc.start()
+            try:
+                with count_queries() as queries:
+                    resp = c.post("/delete")
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(len(queries.writes()), 1, queries.report())
+        self.assertLessEqual(len(queries), 3, queries.report())
+        #Nothing like the 50,000 questions' worth of objects the ORM would load to delete them itself
+        self.assertLess(peak, 2 * 1024 * 1024)
+
+        for model in (User, Quiz, Question, QuizQuestion, QuizJob):
+            self.assertEqual(model.query.count(), 0, model.__tablename__)
+
+    def test_rehash_on_login(self):
+        """Logging in upgrades a hash made with an old work factor"""
+
+        old_hash = self.testuser.password
+        self.assertTrue(old_hash.startswith("$2b$12$"))
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        configure_password_hashing(app)
+        try:
+            with self.client as c:
+                resp = c.post("/login", data={"username": "testuser", "password": "testuser"})
+                self.assertEqual(resp.status_code, 302)
+
+            new_hash = User.query.get(self.testuser_id).password
+            self.assertTrue(new_hash.startswith("$2b$04$"))
+            self.assertIsNot(User.authenticate("testuser", "testuser"), False)
+            self.assertIs(User.authenticate("testuser", "wrong"), False)
+
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = 12
+            configure_password_hashing(app)
+
+    def test_wrong_password_keeps_hash(self):
+        """A failed login doesn't touch the stored hash"""
+
+        app.config['BCRYPT_LOG_ROUNDS'] = 4
+        configure_password_hashing(app)
+        try:
+            with self.client as c:
+                resp = c.post("/login", data={"username": "testuser", "password": "wrongpass"})
+                self.assertEqual(resp.status_code, 200)
+
+            self.assertTrue(User.query.get(self.testuser_id).password.startswith("$2b$12$"))
+
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = 12
+            configure_password_hashing(app)
@@ -1,31 +1,335 @@
+import random
+import threading
+import time
 import requests
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
 from math import ceil
-from models import Question
+from requests.adapters import HTTPAdapter
+from metrics import record_clues, record_fetch, record_jservice_request
+from models import db, Question, BankQuestion
 
-def get_quiz_data(difficulty, total_questions, user_id):
-    """Gets the initial quiz data from the Jservice API"""
+class QuestionFetchError(Exception):
+    """Raised when JService can't supply enough questions"""
+
+class JServiceClient:
+    """Shared HTTP client for JService.
+
+    Keeps a pool of keep-alive connections so each request doesn't pay for a fresh
+    TCP/DNS setup, puts timeouts on every request, and retries 5xx responses and
+    connection errors with jittered exponential backoff. Also owns the thread pool
+    used to fetch the rounds of a quiz concurrently.
+    """
+
+    def __init__(self, **settings):
+        self.session = None
+        self.executor = None
+        self.configure(**settings)
+
+    def configure(self, base_url="http://jservice.io", pool_size=10, connect_timeout=3.05, read_timeout=10, max_retries=3, backoff=0.5, fetch_workers=5, deadline=30):
+        """(Re)build the connection and thread pools with the given settings"""
+
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.deadline = deadline
+
+        if self.session is not None:
+            self.session.close()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+        self.executor = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="jservice")
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def random_clues(self, count, deadline=None):
+        """Gets `count` random clues - giving up with QuestionFetchError at `deadline` (a time.monotonic() time), if given"""
+
+        for attempt in range(self.max_retries + 1):
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise QuestionFetchError("Ran out of time fetching questions from JService")
+                #Don't let a slow request run on past the deadline
+                timeout = tuple(min(part, remaining) for part in self.timeout)
+
+            start = time.perf_counter()
+            try:
+                resp = self.session.get(f"{self.base_url}/api/random", params={"count": count}, timeout=timeout)
+
+                if resp.status_code < 500:
+                    resp.raise_for_status()
+                    try:
+                        clues = resp.json()
+                    except ValueError:
+                        #Not JSON at all - e.g. an error page from a proxy in front of JService - so worth another go
+                        error = f"HTTP {resp.status_code} with a body that isn't JSON"
+                    else:
+                        record_jservice_request(time.perf_counter() - start, "ok")
+                        return clues
+                else:
+                    error = f"HTTP {resp.status_code}"
+
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                error = exc
+
+            except requests.RequestException as exc:
+                record_jservice_request(time.perf_counter() - start, "error")
+                raise QuestionFetchError(f"JService request failed: {exc}") from exc
+
+            record_jservice_request(time.perf_counter() - start, "retry")
+
+            if attempt < self.max_retries:
+                #Full jitter - sleep somewhere between 0 and the exponential backoff
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                if deadline is not None:
+                    delay = max(0, min(delay, deadline - time.monotonic()))
+                time.sleep(delay)
+
+        raise QuestionFetchError(f"JService unavailable after {self.max_retries + 1} attempts: {error}")
+
+jservice = JServiceClient()
+
+def connect_jservice(app):
+    """Configure the shared JService client from the app config - pointing it at a fake JService if JSERVICE_FAKE is set"""
+
+    base_url = app.config.get("JSERVICE_URL", "http://jservice.io")
+    if app.config.get("JSERVICE_FAKE"):
+        #Imported here so it's only ever loaded when it's wanted
+        from fake_jservice import shared_server
+        base_url = shared_server(seed=app.config.get("JSERVICE_FAKE_SEED", 0),
+                                 latency=app.config.get("JSERVICE_FAKE_LATENCY", 0.0),
+                                 error_rate=app.config.get("JSERVICE_FAKE_ERROR_RATE", 0.0)).url
+
+    jservice.configure(base_url=base_url,
+                       pool_size=app.config.get("JSERVICE_POOL_SIZE", 10),
+                       connect_timeout=app.config.get("JSERVICE_CONNECT_TIMEOUT", 3.05),
+                       read_timeout=app.config.get("JSERVICE_READ_TIMEOUT", 10),
+                       max_retries=app.config.get("JSERVICE_MAX_RETRIES", 3),
+                       backoff=app.config.get("JSERVICE_BACKOFF", 0.5),
+                       fetch_workers=app.config.get("JSERVICE_FETCH_WORKERS", 5),
+                       deadline=app.config.get("JSERVICE_DEADLINE", 30))
+
+def value_to_difficulty(value):
+    """Converts a Jeopardy! dollar value to a difficulty level (1-5)"""
+
+    return ceil(int(value)/200)
+
+def parse_clue(clue):
+    """Turns a raw JService clue into a question bank row - None if the clue has no value"""
+
+    if clue["value"] is None:
+        return None
+
+    return {"jservice_id": clue.get("id"),
+            "question": clue["question"],
+            "answer": clue["answer"],
+            "category": clue["category"]["title"],
+            "difficulty": value_to_difficulty(clue["value"])}
+
+def sample_bank(difficulty, total_questions, category=None, exclude=(), in_use=None):
+    """Draws a random sample of clues with the given difficulties from the question bank"""
     ###########################################
     #difficulty: a list storing the difficulty of the questions to retrieve
-    #total_questions: the total number of questions to retrieve
-    #user_id: needed for instantiation of Question objects
+    #total_questions: the number of clues wanted - fewer are returned if the bank runs short
+    #category: optionally restrict the sample to a single category
+    #exclude: ids of bank clues that mustn't be picked (e.g. already used in another round)
+    #in_use: optionally, a query of more bank ids that mustn't be picked - e.g. Question.bank_ids_on_quiz -
+    #        which goes into the sample's query as a NOT IN subquery
     ###########################################
 
-    quiz_questions = []
+    #Spread the picks across the requested difficulty levels at random
+    wanted = Counter(random.choice(difficulty) for _ in range(total_questions))
+    clues = []
+
+    for diff, count in wanted.items():
+        clues.extend(_sample_difficulty(diff, count, category, list(exclude), in_use))
+
+    #If a level ran dry, top up from the other requested levels
+    for diff in difficulty:
+        if len(clues) >= total_questions:
+            break
+        clues.extend(_sample_difficulty(diff, total_questions - len(clues), category, list(exclude) + [clue.id for clue in clues], in_use))
+
+    random.shuffle(clues)
+    return clues
+
+def _sample_difficulty(difficulty, count, category, exclude, in_use=None):
+    """Reads up to `count` clues of one difficulty forward from a random pivot on the random_key index"""
+
+    query = BankQuestion.query.filter(BankQuestion.difficulty == difficulty)
+    if category is not None:
+        query = query.filter(BankQuestion.category == category)
+    if exclude:
+        query = query.filter(BankQuestion.id.notin_(exclude))
+    if in_use is not None:
+        query = query.filter(BankQuestion.id.notin_(in_use))
+
+    pivot = random.random()
+    clues = query.filter(BankQuestion.random_key >= pivot).order_by(BankQuestion.random_key).limit(count).all()
 
-    while len(quiz_questions) < total_questions:
+    #Wrap around to the start of the index if we ran off the end
+    if len(clues) < count:
+        clues.extend(query.filter(BankQuestion.random_key < pivot).order_by(BankQuestion.random_key).limit(count - len(clues)).all())
 
-        question_resp = requests.get(f"http://jservice.io/api/random?count={total_questions * 5}")
-        question_data = question_resp.json()
+    return clues
 
+#Hard cap on JService round trips for a single fetch
+MAX_FETCH_REQUESTS = 10
+#JService won't hand out more than 100 clues per request
+MAX_FETCH_COUNT = 100
+
+#Clues seen at each difficulty so far - used to estimate how many to ask for
+_difficulty_seen = Counter()
+_counter_lock = threading.Lock()
+
+def _yield_rate(difficulty):
+    """Estimated fraction of fetched clues that will have one of the given difficulties"""
+
+    with _counter_lock:
+        #Start from one pseudo-clue per level over ten levels so the estimate is sane before anything is seen
+        seen = _difficulty_seen["total"] + 10
+        return sum(_difficulty_seen[diff] + 1 for diff in difficulty) / seen
+
+def fetch_clues(difficulty, total_questions, stats=None, deadline=None):
+    """Gets clues from the Jservice API until enough of them have one of the given difficulties.
+
+    Each request only asks for the number of clues still missing, scaled up by the
+    observed yield for the requested difficulties, and at most MAX_FETCH_REQUESTS
+    requests are made. If `deadline` (a time.monotonic() time) is given, no request
+    runs past it - QuestionFetchError is raised instead.
+
+    Returns (kept, spare): `total_questions` matching clues, and every other valued
+    clue fetched along the way so they can go in the bank too. If `stats` is given
+    it's filled in with the counts for this call.
+    """
+
+    buckets = {diff: [] for diff in difficulty}
+    kept = []
+    spare = []
+    fetched = 0
+    requests_made = 0
+
+    while len(kept) < total_questions:
+
+        if requests_made == MAX_FETCH_REQUESTS:
+            raise QuestionFetchError(f"Only found {len(kept)} of {total_questions} questions after {requests_made} requests")
+
+        deficit = total_questions - len(kept)
+        count = min(MAX_FETCH_COUNT, max(deficit, ceil(deficit / _yield_rate(difficulty))))
+
+        question_data = jservice.random_clues(count, deadline=deadline)
+        requests_made += 1
+        fetched += len(question_data)
+
+        seen = Counter()
         for question in question_data:
+            clue = parse_clue(question)
+
+            if clue is None:
+                continue
+
+            seen[clue["difficulty"]] += 1
+            if clue["difficulty"] in buckets and len(kept) < total_questions:
+                buckets[clue["difficulty"]].append(clue)
+                kept.append(clue)
+            else:
+                spare.append(clue)
+
+        with _counter_lock:
+            _difficulty_seen.update(seen)
+            _difficulty_seen["total"] += len(question_data)
+
+    record_clues(fetched, len(kept))
+
+    if stats is not None:
+        stats.update(requests=requests_made, fetched=fetched, kept=len(kept),
+                     by_difficulty={diff: len(bucket) for diff, bucket in buckets.items()})
 
-            if question["value"] is not None:
-                q_diff = ceil(int(question["value"])/200)
-                if q_diff in difficulty:
-                    quiz_questions.append(Question(question=question["question"], answer=question["answer"], category=question["category"]["title"], difficulty=q_diff, user_id=user_id))
-                    if len(quiz_questions) == total_questions:
-                        break
+    return kept, spare
 
-    return quiz_questions
+def get_rounds_data(round_difficulties, qs_per_round, user_id, stats=None, in_use=None):
+    """Gets the questions for every round of a quiz.
 
+    Each round is drawn from the question bank first. Any rounds the bank can't
+    cover are fetched from JService concurrently, so a quiz costs about one round's
+    worth of upstream latency however many rounds it has. Gives up with
+    QuestionFetchError if the fetches don't all finish within the client's deadline.
+    """
+    ###########################################
+    #round_difficulties: a list with, for each round, a list of the difficulties for that round
+    #qs_per_round: the number of questions to retrieve for each round - or a list with a count for each round
+    #user_id: needed for instantiation of Question objects
+    #stats: optional list of dicts, one per round, filled in with how many questions came from the bank and how many clues were fetched/kept
+    #in_use: optional query of bank ids not to hand out again (see sample_bank) - e.g. those already on the quiz
+    ###########################################
+
+    stats = stats if stats is not None else [{} for _ in round_difficulties]
+    counts = qs_per_round if isinstance(qs_per_round, list) else [qs_per_round] * len(round_difficulties)
+    round_clues = []
+    used = []
+
+    #The bank is quick to query, so do it here rather than juggling db sessions across threads
+    for difficulty, count, round_stats in zip(round_difficulties, counts, stats):
+        sampled = sample_bank(difficulty, count, exclude=used, in_use=in_use)
+        used.extend(clue.id for clue in sampled)
+        round_clues.append([{"bank_id": clue.id,
+                             "question": clue.question,
+                             "answer": clue.answer,
+                             "category": clue.category,
+                             "difficulty": clue.difficulty} for clue in sampled])
+        round_stats.update(from_bank=len(sampled), requests=0, fetched=0, kept=0)
+
+    #Only go upstream for the rounds the bank couldn't cover. The fetches get the deadline too - cancel() can't
+    #stop one that's already running, so they have to stop themselves rather than hold on to the executor's threads
+    deadline = time.monotonic() + jservice.deadline
+    fetches = {round_no: jservice.executor.submit(fetch_clues, difficulty, count - len(clues), stats[round_no], deadline)
+               for round_no, (difficulty, count, clues) in enumerate(zip(round_difficulties, counts, round_clues))
+               if len(clues) < count}
+
+    if fetches:
+        start = time.perf_counter()
+        done, pending = wait(fetches.values(), timeout=max(0, deadline - time.monotonic()))
+        record_fetch(sum(stats[round_no].get("requests", 0) for round_no in fetches), time.perf_counter() - start)
+        if pending:
+            for future in pending:
+                future.cancel()
+            raise QuestionFetchError(f"Timed out fetching questions for {len(pending)} round(s)")
+
+        fetched = []
+        for round_no, future in fetches.items():
+            kept, spare = future.result()
+            round_clues[round_no].extend(kept)
+            fetched.extend(kept + spare)
+
+        BankQuestion.bank(fetched)
+
+        #The fetched clues are in the bank now too - look up their ids so they're recorded against the questions
+        jservice_ids = [clue["jservice_id"] for clues in round_clues for clue in clues if clue.get("jservice_id") is not None]
+        if jservice_ids:
+            bank_ids = dict(db.session.query(BankQuestion.jservice_id, BankQuestion.id).filter(BankQuestion.jservice_id.in_(jservice_ids)))
+            for clues in round_clues:
+                for clue in clues:
+                    if "bank_id" not in clue:
+                        clue["bank_id"] = bank_ids.get(clue.get("jservice_id"))
+
+    return [[Question(question=clue["question"], answer=clue["answer"], category=clue["category"], difficulty=clue["difficulty"],
+                      bank_id=clue.get("bank_id"), user_id=user_id) for clue in clues]
+            for clues in round_clues]
+
+def get_quiz_data(difficulty, total_questions, user_id, stats=None):
+    """Gets the quiz data - from the question bank if possible, otherwise from the Jservice API"""
+    ###########################################
+    #difficulty: a list storing the difficulty of the questions to retrieve
+    #total_questions: the total number of questions to retrieve
+    #user_id: needed for instantiation of Question objects
+    #stats: optional dict, filled in with how many questions came from the bank and how many clues were fetched/kept
+    ###########################################
 
+    return get_rounds_data([difficulty], total_questions, user_id, None if stats is None else [stats])[0]
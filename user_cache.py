@@ -0,0 +1,76 @@
+"""Per-process cache of logged in users.
+
+add_user_to_g used to look the user up on every request. Instead, the handful of
+user fields the views read are cached here for a short while, keyed by user id.
+Routes that change a user (username, password, deleting the account) invalidate
+their entry. Other processes' caches only find out when the TTL runs out, so keep
+it short.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+#What the views need to know about the logged in user - anything that writes to the user loads the real row
+CurrentUser = namedtuple("CurrentUser", ["id", "username"])
+
+class UserCache:
+    """LRU cache of CurrentUsers by id, with entries expiring after `ttl` seconds"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl):
+        """Resize the cache and change the TTL of new entries"""
+
+        with self._lock:
+            self.maxsize = maxsize
+            self.ttl = ttl
+            while len(self._users) > self.maxsize:
+                self._users.popitem(last=False)
+
+    def get(self, user_id, load):
+        """The user with the given id - from the cache if possible, otherwise from load(user_id)"""
+
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._users.move_to_end(user_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        user = load(user_id)
+
+        #Don't cache misses - a user who doesn't exist yet might sign up
+        if user is not None:
+            with self._lock:
+                self._users[user_id] = (now + self.ttl, user)
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.maxsize:
+                    self._users.popitem(last=False)
+
+        return user
+
+    def invalidate(self, user_id):
+        """Forget the given user, so the next request reloads them"""
+
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._users),
+                    "maxsize": self.maxsize, "ttl": self.ttl}